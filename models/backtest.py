@@ -0,0 +1,82 @@
+import argparse
+import json
+import time
+import numpy as np
+import pandas as pd
+from model import ENGINES, DemandForecast, fit_location
+from refresh_forecasts import DATA_PATH, load_demand_forecast
+from demand_tensor import DemandTensor
+
+
+# Forecasts of one engine for the pickup IDs over [cutoff, cutoff + horizon_days), trained only on data before cutoff
+# Returns {pickup_id: DataFrame(ds, yhat, yhat_lower, yhat_upper)} and the training time in seconds
+def forecast_fold(pickup_demand, pickup_ids, cutoff, horizon_days, engine):
+    train = pickup_demand[pickup_demand['Rounded Pickup Time'] < cutoff]
+    demand_forecast = DemandForecast(pickup_demand=train, engine=engine)
+    start = time.perf_counter()
+    if engine == "seasonal":
+        forecasts = demand_forecast.fit_seasonal(pickup_ids, horizon_days, save_model=False, forecast_start=cutoff)
+    else:
+        # Models are not saved, the backtest must never overwrite the registry
+        forecasts = {}
+        for pickup_id in pickup_ids:
+            _, forecasts[pickup_id] = fit_location(demand_forecast.location_data(pickup_id), pickup_id, horizon_days, False, cutoff)
+    return forecasts, time.perf_counter() - start
+
+
+# Error metrics against the dense actuals (hours without bookings count as zero demand)
+def score(forecasts, actuals, pickup_ids):
+    yhat = np.vstack([forecasts[pickup_id]['yhat'].to_numpy() for pickup_id in pickup_ids])
+    lower = np.vstack([forecasts[pickup_id]['yhat_lower'].to_numpy() for pickup_id in pickup_ids])
+    upper = np.vstack([forecasts[pickup_id]['yhat_upper'].to_numpy() for pickup_id in pickup_ids])
+    errors = yhat - actuals
+    return {
+        "mae": float(np.abs(errors).mean()),
+        "rmse": float(np.sqrt((errors ** 2).mean())),
+        "coverage": float(((actuals >= lower) & (actuals <= upper)).mean()),
+        "interval_width": float((upper - lower).mean()),
+    }
+
+
+# Rolling-origin backtest: the last `folds` windows of horizon_days each are forecast from the data before them
+def backtest(pickup_ids, folds=3, horizon_days=1, engines=ENGINES, data_path=DATA_PATH):
+    pickup_demand = load_demand_forecast(data_path).pickup_demand
+    pickup_demand['Rounded Pickup Time'] = pd.to_datetime(pickup_demand['Rounded Pickup Time'])
+    last_day = pickup_demand['Rounded Pickup Time'].max().normalize() + pd.Timedelta(days=1)
+    cutoffs = [last_day - pd.Timedelta(days=horizon_days * fold) for fold in range(folds, 0, -1)]
+
+    results = {engine: [] for engine in engines}
+    for cutoff in cutoffs:
+        actuals = DemandTensor.from_aggregates(pickup_demand, pickup_ids, cutoff, cutoff + pd.Timedelta(days=horizon_days)).counts
+        for engine in engines:
+            forecasts, seconds = forecast_fold(pickup_demand, pickup_ids, cutoff, horizon_days, engine)
+            metrics = score(forecasts, actuals, pickup_ids)
+            metrics.update({"cutoff": cutoff.isoformat(), "train_seconds": seconds})
+            results[engine].append(metrics)
+            print(f"{cutoff.date()} {engine:>9}: MAE {metrics['mae']:.3f}  RMSE {metrics['rmse']:.3f}  "
+                  f"coverage {metrics['coverage']:.2f}  train {seconds * 1000:.1f} ms")
+
+    summary = {}
+    for engine, folds_metrics in results.items():
+        summary[engine] = {key: float(np.mean([m[key] for m in folds_metrics]))
+                           for key in ["mae", "rmse", "coverage", "interval_width", "train_seconds"]}
+    return summary, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare forecasting engines on rolling-origin backtests")
+    parser.add_argument("--pickup-ids", type=int, nargs="+", default=[0, 8, 19, 30, 31])
+    parser.add_argument("--folds", type=int, default=3)
+    parser.add_argument("--horizon-days", type=int, default=1)
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--out", default=None, help="Write the per-fold results as JSON")
+    args = parser.parse_args()
+
+    summary, results = backtest(args.pickup_ids, args.folds, args.horizon_days, args.engines)
+    print("\nMean over folds:")
+    for engine, metrics in summary.items():
+        print(f"{engine:>9}: MAE {metrics['mae']:.3f}  RMSE {metrics['rmse']:.3f}  coverage {metrics['coverage']:.2f}  "
+              f"interval width {metrics['interval_width']:.2f}  train {metrics['train_seconds'] * 1000:.1f} ms")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"summary": summary, "folds": results}, f, indent=2)
@@ -1,66 +1,328 @@
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
 import pandas as pd
-from prophet import Prophet
 import joblib  
 
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+AGGREGATES_PATH = os.path.join(MODELS_DIR, "pickup_demand.parquet")
+# Booking IDs already counted in the aggregates, so the same trips are never added twice
+BOOKING_IDS_PATH = os.path.join(MODELS_DIR, "pickup_bookings.npy")
+SEASONAL_MODEL_PATH = os.path.join(MODELS_DIR, "seasonal_baseline.npz")
+sys.path.append(os.path.join(MODELS_DIR, "..", "src"))
+from model_registry import load_registry, rebuild_registry, save_model as save_to_registry
+from demand_tensor import DemandTensor
+from seasonal_forecast import SeasonalBaseline
+
+# Forecasting engines: one Prophet model per location, or one NumPy seasonal baseline fitted on all locations at once
+ENGINES = ("prophet", "seasonal")
+
 class DemandForecast:
-    def __init__(self, data):
-        # Init with data and preprocess
-        self.data = data.copy()
-        self.data['Actual Pickup Time'] = pd.to_datetime(self.data['Actual Pickup Time'])
-        self.data['Rounded Pickup Time'] = self.data['Actual Pickup Time'].dt.floor('H')
-        self.data['Weekday'] = self.data['Rounded Pickup Time'].dt.dayofweek
-        
-        # Aggregate demand by time and location
-        self.pickup_demand = self.data.groupby(['Rounded Pickup Time', 'Pickup ID']).size().reset_index(name='demand')
-
-    def train_model(self, pickup_id, forecast_days=7, save_model=True):
-        # Filter data for the specified pickup location
-        location_data = self.pickup_demand[self.pickup_demand['Pickup ID'] == pickup_id][['Rounded Pickup Time', 'demand']]
-        location_data.rename(columns={'Rounded Pickup Time': 'ds', 'demand': 'y'}, inplace=True)
-        location_data['Weekday'] = location_data['ds'].dt.dayofweek
-
-        # Initialize Prophet model and add 'Weekday' as a regressor
-        model = Prophet()
-        model.add_regressor('Weekday')
-        
-        # Train the model
-        model.fit(location_data)
+    def __init__(self, data=None, pickup_demand=None, engine="prophet", booking_ids=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown forecasting engine '{engine}', expected one of {ENGINES}")
+        self.engine = engine
+        if data is not None:
+            # Init with data and preprocess
+            self.data = prepare_trips(data)
+
+            # Aggregate demand by time and location
+            self.pickup_demand = aggregate_demand(self.data)
+            booking_ids = self.data['Booking ID'] if 'Booking ID' in self.data else booking_ids
+        else:
+            # Resume from previously saved hourly aggregates
+            self.data = None
+            self.pickup_demand = pickup_demand.copy()
+        self.booking_ids = set() if booking_ids is None else {int(booking_id) for booking_id in booking_ids}
+
+        # Dense [stops x hours] view of the aggregates, rebuilt only when they change
+        self._demand_tensor = None
+
+        # Fitted models, training time and failures per pickup ID
+        self.models = {}
+        self.timings = {}
+        self.failed = {}
+
+    @classmethod
+    def from_aggregates(cls, path=AGGREGATES_PATH, engine="prophet", booking_ids_path=BOOKING_IDS_PATH):
+        booking_ids = np.load(booking_ids_path) if os.path.exists(booking_ids_path) else None
+        return cls(pickup_demand=pd.read_parquet(path), engine=engine, booking_ids=booking_ids)
+
+    def save_aggregates(self, path=AGGREGATES_PATH, booking_ids_path=BOOKING_IDS_PATH):
+        self.pickup_demand.to_parquet(path, index=False)
+        np.save(booking_ids_path, np.array(sorted(self.booking_ids), dtype=np.int64))
+
+    @property
+    def demand_tensor(self):
+        if self._demand_tensor is None:
+            self._demand_tensor = DemandTensor.from_aggregates(self.pickup_demand)
+        return self._demand_tensor
+
+    # Hourly demand history of one pickup location in Prophet's (ds, y) format, hours without bookings as zeros
+    def location_data(self, pickup_id):
+        tensor = self.demand_tensor
+        return pd.DataFrame({'ds': tensor.timestamps, 'y': tensor.row(pickup_id)})
+
+    def train_model(self, pickup_id, forecast_days=7, save_model=True, forecast_start=None, update_registry=True):
+        if self.engine == "seasonal":
+            return self.fit_seasonal([pickup_id], forecast_days, save_model, forecast_start)[pickup_id]
+
+        model, forecast = fit_location(self.location_data(pickup_id), pickup_id, forecast_days, save_model, forecast_start)
         self.model = model  # Save model for future use
+        self.models[pickup_id] = model
+        if save_model and update_registry:
+            rebuild_registry()
+        return forecast
 
-        # Prepare future dataframe
-        future = model.make_future_dataframe(periods=24 * forecast_days, freq='H')
-        future['Weekday'] = future['ds'].dt.dayofweek
-        
-        # Make predictions
-        forecast = model.predict(future)
+    def forecast_for_multiple_locations(self, pickup_ids, forecast_days=7, forecast_start=None, n_jobs=1, retries=1):
+        if self.engine == "seasonal":
+            # All locations are fitted together in one vectorized pass, no worker processes needed
+            return self.fit_seasonal(pickup_ids, forecast_days, True, forecast_start)
 
-        # Optionally, save the model as a file
-        if save_model:
-            model_filename = f"prophet_model_pickup_{pickup_id}.pkl"
-            joblib.dump(model, model_filename)
-            print(f"Model for Pickup ID {pickup_id} saved as {model_filename}")
-        
-        return forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
-    
-    def forecast_for_multiple_locations(self, pickup_ids, forecast_days=7):
+        if n_jobs == 1:
+            forecasts = {}
+            for pickup_id in pickup_ids:
+                for attempt in range(1, retries + 2):
+                    print(f"Forecasting for Pickup ID {pickup_id} (attempt {attempt})")
+                    start = time.perf_counter()
+                    try:
+                        forecasts[pickup_id] = self.train_model(pickup_id, forecast_days=forecast_days, forecast_start=forecast_start, update_registry=False)
+                    except Exception as e:
+                        # Same retry policy as the worker processes below
+                        if attempt <= retries:
+                            print(f"Training failed for Pickup ID {pickup_id}: {e}, retrying")
+                        else:
+                            print(f"Training failed for Pickup ID {pickup_id}: {e}")
+                            self.failed[pickup_id] = e
+                        continue
+                    self.timings[pickup_id] = time.perf_counter() - start
+                    break
+            rebuild_registry()
+            return forecasts
+
+        # Train locations in parallel, each worker only receives the history of its own location
+        results = {}
+        attempts = {pickup_id: 0 for pickup_id in pickup_ids}
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            def submit(pickup_id):
+                attempts[pickup_id] += 1
+                print(f"Forecasting for Pickup ID {pickup_id} (attempt {attempts[pickup_id]})")
+                return pool.submit(_train_location_worker, self.location_data(pickup_id), pickup_id, forecast_days, forecast_start)
+
+            pending = {submit(pickup_id): pickup_id for pickup_id in pickup_ids}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pickup_id = pending.pop(future)
+                    try:
+                        results[pickup_id] = future.result()
+                    except Exception as e:
+                        # Retry a failed location on its own without touching the others
+                        if attempts[pickup_id] <= retries:
+                            print(f"Training failed for Pickup ID {pickup_id}: {e}, retrying")
+                            pending[submit(pickup_id)] = pickup_id
+                        else:
+                            print(f"Training failed for Pickup ID {pickup_id}: {e}")
+                            self.failed[pickup_id] = e
+
+        # Keep the caller's order so the output does not depend on which worker finished first
         forecasts = {}
         for pickup_id in pickup_ids:
-            print(f"Forecasting for Pickup ID {pickup_id}")
-            forecast = self.train_model(pickup_id, forecast_days=forecast_days)
+            if pickup_id in results:
+                model, forecast, seconds = results[pickup_id]
+                self.models[pickup_id] = model
+                self.timings[pickup_id] = seconds
+                forecasts[pickup_id] = forecast
+                print(f"Pickup ID {pickup_id} trained in {seconds:.1f}s")
+
+        # Workers only write their own model files, the manifest is rebuilt once here
+        rebuild_registry()
+        return forecasts
+
+
+    # Append new trips and retrain only the locations they touch (within pickup_ids when given), warm-starting from the previous fit
+    # Trips whose Booking ID is already in the aggregates are skipped, so applying the same file twice changes nothing
+    def update(self, new_data, forecast_days=7, forecast_start=None, save_model=True, pickup_ids=None):
+        new_data = prepare_trips(new_data)
+        if 'Booking ID' in new_data:
+            new_data = new_data.drop_duplicates('Booking ID')
+            new_data = new_data[~new_data['Booking ID'].isin(self.booking_ids)]
+            self.booking_ids.update(int(booking_id) for booking_id in new_data['Booking ID'])
+        if self.data is not None:
+            self.data = pd.concat([self.data, new_data], ignore_index=True)
+
+        # Add the new hourly counts onto the existing aggregates, only the touched (hour, location) cells change
+        key = ['Rounded Pickup Time', 'Pickup ID']
+        counts = self.pickup_demand.set_index(key)['demand']
+        counts = counts.add(aggregate_demand(new_data).set_index(key)['demand'], fill_value=0).astype(int)
+        self.pickup_demand = counts.reset_index(name='demand')
+        self._demand_tensor = None
+
+        touched = sorted(int(pickup_id) for pickup_id in new_data['Pickup ID'].unique())
+        if pickup_ids is not None:
+            touched = [pickup_id for pickup_id in touched if pickup_id in set(pickup_ids)]
+        if self.engine == "seasonal":
+            # Refitting every location takes milliseconds, only the touched ones are returned
+            if pickup_ids is None:
+                pickup_ids = sorted(int(pickup_id) for pickup_id in self.pickup_demand['Pickup ID'].unique())
+            forecasts = self.fit_seasonal(list(pickup_ids), forecast_days, save_model, forecast_start) if touched else {}
+            return {pickup_id: forecasts[pickup_id] for pickup_id in touched}
+
+        # Locations without new trips keep their current model
+        forecasts = {}
+        for pickup_id in touched:
+            previous = self.load_model(pickup_id)
+            init = warm_start_params(previous) if previous is not None else None
+            print(f"Updating Pickup ID {pickup_id} ({'warm start' if init else 'cold start'})")
+            start = time.perf_counter()
+            model, forecast = fit_location(self.location_data(pickup_id), pickup_id, forecast_days, save_model, forecast_start, init=init)
+            self.timings[pickup_id] = time.perf_counter() - start
+            self.models[pickup_id] = model
             forecasts[pickup_id] = forecast
+        if save_model and forecasts:
+            rebuild_registry()
+        return forecasts
+
+    # Fit the seasonal baseline on all given locations at once and forecast each of them
+    def fit_seasonal(self, pickup_ids, forecast_days=7, save_model=True, forecast_start=None):
+        start = time.perf_counter()
+        tensor = self.demand_tensor
+        baseline = SeasonalBaseline().fit(tensor.window(stop_ids=pickup_ids), tensor.start, pickup_ids)
+        if save_model:
+            baseline.save(SEASONAL_MODEL_PATH)
+            print(f"Seasonal baseline for {len(pickup_ids)} pickup IDs saved as {SEASONAL_MODEL_PATH}")
+
+        forecasts = {}
+        for pickup_id in pickup_ids:
+            self.models[pickup_id] = baseline.location(pickup_id)
+            forecasts[pickup_id] = predict_model(self.models[pickup_id], forecast_days, forecast_start)
+        self.model = baseline
+        seconds = time.perf_counter() - start
+        for pickup_id in pickup_ids:
+            self.timings[pickup_id] = seconds / len(pickup_ids)
         return forecasts
 
-# Load data
-heatmap_data = pd.read_csv("heatmap_data.csv")
+    # Fitted model of a location, from memory, the model registry or a legacy pickle
+    def load_model(self, pickup_id):
+        if pickup_id not in self.models and self.engine == "seasonal":
+            if os.path.exists(SEASONAL_MODEL_PATH):
+                baseline = SeasonalBaseline.load(SEASONAL_MODEL_PATH)
+                if pickup_id in baseline.pickup_ids:
+                    self.models[pickup_id] = baseline.location(pickup_id)
+        elif pickup_id not in self.models:
+            registry = load_registry()
+            if registry is not None and pickup_id in registry:
+                self.models[pickup_id] = registry.load_prophet(pickup_id)
+            elif os.path.exists(model_path(pickup_id)):
+                self.models[pickup_id] = joblib.load(model_path(pickup_id))
+        return self.models.get(pickup_id)
+
+    # Forecast a location with its existing model, without refitting
+    def predict_location(self, pickup_id, forecast_days=7, forecast_start=None):
+        model = self.load_model(pickup_id)
+        if model is None:
+            return None
+        return predict_model(model, forecast_days, forecast_start)
+
+
+# Parse pickup times and add the hourly columns used for aggregation
+def prepare_trips(data):
+    data = data.copy()
+    data['Actual Pickup Time'] = pd.to_datetime(data['Actual Pickup Time'])
+    data['Rounded Pickup Time'] = data['Actual Pickup Time'].dt.floor('h')
+    data['Weekday'] = data['Rounded Pickup Time'].dt.dayofweek
+    return data
+
+
+# Number of pickups per hour and location (hours without pickups are left out of the long format)
+def aggregate_demand(data):
+    return DemandTensor.from_trips(data).to_frame()
+
+
+# Fitted parameters of a Prophet model in the format accepted by Prophet.fit(init=...)
+def warm_start_params(model):
+    params = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        params[name] = model.params[name][0][0]
+    for name in ['delta', 'beta']:
+        params[name] = model.params[name][0]
+    return params
+
+
+# Legacy pickle file name for a pickup location (models are now saved to the registry)
+def model_path(pickup_id, model_dir=MODELS_DIR):
+    return os.path.join(model_dir, f"prophet_model_pickup_{pickup_id}.pkl")
+
+
+# Fit Prophet on one location's hourly history and forecast the requested horizon
+def fit_location(location_data, pickup_id, forecast_days=7, save_model=True, forecast_start=None, init=None):
+    # Imported here so the seasonal engine and the serving code never load Prophet
+    from prophet import Prophet
+
+    location_data = location_data.copy()
+    location_data['Weekday'] = location_data['ds'].dt.dayofweek
+
+    # Initialize Prophet model and add 'Weekday' as a regressor
+    model = Prophet()
+    model.add_regressor('Weekday')
+
+    # Train the model, starting the optimizer from the previous parameters when given
+    try:
+        model.fit(location_data, **({} if init is None else {'init': init}))
+    except Exception:
+        if init is None:
+            raise
+        # The previous fit has a different parameter layout (e.g. new seasonalities), start from scratch
+        model = Prophet()
+        model.add_regressor('Weekday')
+        model.fit(location_data)
+
+    # Make predictions
+    forecast = predict_model(model, forecast_days, forecast_start)
+
+    # Optionally, save the model to the registry (the manifest is rebuilt by the caller)
+    if save_model:
+        save_to_registry(model, pickup_id)
+        print(f"Model for Pickup ID {pickup_id} saved to the model registry")
+
+    return model, forecast
+
+
+# Forecast a fitted model, continuing its history or over an explicit hourly horizon from forecast_start
+def predict_model(model, forecast_days=7, forecast_start=None):
+    if forecast_start is None and hasattr(model, 'baseline'):
+        # Seasonal baseline: the fitted history followed by the forecast horizon, like make_future_dataframe
+        baseline = model.baseline
+        future = pd.DataFrame({'ds': pd.date_range(baseline.history_start, baseline.history_end + pd.Timedelta(days=forecast_days), freq='h', inclusive='left')})
+    elif forecast_start is None:
+        future = model.make_future_dataframe(periods=24 * forecast_days, freq='h')
+    else:
+        future = pd.DataFrame({'ds': pd.date_range(pd.Timestamp(forecast_start).normalize(), periods=24 * forecast_days, freq='h')})
+    future['Weekday'] = future['ds'].dt.dayofweek
+    forecast = model.predict(future)
+    return forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+
+
+# Process pool entry point, also reports how long the location took
+def _train_location_worker(location_data, pickup_id, forecast_days, forecast_start):
+    start = time.perf_counter()
+    model, forecast = fit_location(location_data, pickup_id, forecast_days, True, forecast_start)
+    return model, forecast, time.perf_counter() - start
+
+if __name__ == "__main__":
+    # Load data
+    heatmap_data = pd.read_csv("heatmap_data.csv")
 
-# Initialize forecasting class with data
-demand_forecast = DemandForecast(heatmap_data)
+    # Initialize forecasting class with data
+    demand_forecast = DemandForecast(heatmap_data)
 
-# Train model and forecast for Pickup ID 0 (example)
-forecast_for_pickup_0 = demand_forecast.train_model(0)
-print(forecast_for_pickup_0.head())
+    # Train model and forecast for Pickup ID 0 (example)
+    forecast_for_pickup_0 = demand_forecast.train_model(0)
+    print(forecast_for_pickup_0.head())
 
-# Forecast for multiple pickup IDs (e.g., top 5 most frequent)
-top_pickup_ids = [0, 8, 19, 30, 31]  # Replace with most frequent IDs
-multiple_forecasts = demand_forecast.forecast_for_multiple_locations(top_pickup_ids)
-print(multiple_forecasts[0].head())  # Forecast for Pickup ID 0
\ No newline at end of file
+    # Forecast for multiple pickup IDs (e.g., top 5 most frequent)
+    top_pickup_ids = [0, 8, 19, 30, 31]  # Replace with most frequent IDs
+    multiple_forecasts = demand_forecast.forecast_for_multiple_locations(top_pickup_ids)
+    print(multiple_forecasts[0].head())  # Forecast for Pickup ID 0
\ No newline at end of file
@@ -0,0 +1,94 @@
+import argparse
+import os
+import sys
+import time
+import pandas as pd
+from model import AGGREGATES_PATH, ENGINES, DemandForecast
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from forecast_store import FORECAST_TABLE_PATH, write_forecast_table
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets", "heatmap_data.csv")
+# Hourly aggregates written by src/prepare_datasets.py, used instead of re-aggregating the trips when present
+HOURLY_DEMAND_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets", "hourly_pickup_demand.csv")
+
+
+# Load the training data, preferring the prepared hourly aggregates (built from the same trips as DATA_PATH)
+def load_demand_forecast(data_path=DATA_PATH, engine="prophet"):
+    if data_path == DATA_PATH and os.path.exists(HOURLY_DEMAND_PATH):
+        return DemandForecast(pickup_demand=pd.read_csv(HOURLY_DEMAND_PATH, parse_dates=['Rounded Pickup Time']), engine=engine,
+                              booking_ids=pd.read_csv(DATA_PATH, usecols=['Booking ID'])['Booking ID'])
+    return DemandForecast(pd.read_csv(data_path), engine=engine)
+
+
+# Previously written rows of the locations that failed to train, so one bad fit does not drop a stop from the table
+def keep_previous_forecasts(forecasts, failed_ids, path=FORECAST_TABLE_PATH):
+    if not failed_ids or not os.path.exists(path):
+        return
+    previous = pd.read_parquet(path)
+    for pickup_id in failed_ids:
+        rows = previous[previous['Pickup ID'] == pickup_id]
+        if len(rows):
+            print(f"Keeping the previous forecast of Pickup ID {pickup_id}")
+            forecasts[pickup_id] = rows.drop(columns='Pickup ID')
+
+
+# Train every pickup model and write a rolling forecast horizon starting today
+# Returns the pickup IDs that failed to train
+def refresh_forecasts(pickup_ids, horizon_days, n_jobs=1, data_path=DATA_PATH, output_path=FORECAST_TABLE_PATH, engine="prophet"):
+    demand_forecast = load_demand_forecast(data_path, engine)
+    forecasts = demand_forecast.forecast_for_multiple_locations(
+        pickup_ids, forecast_days=horizon_days, forecast_start=pd.Timestamp.today().normalize(), n_jobs=n_jobs
+    )
+    demand_forecast.save_aggregates()
+    keep_previous_forecasts(forecasts, sorted(demand_forecast.failed), output_path)
+    if forecasts:
+        table = write_forecast_table(forecasts, output_path)
+        print(f"Wrote {len(table)} forecast rows for {len(pickup_ids)} pickup IDs to {output_path}")
+    return sorted(demand_forecast.failed)
+
+
+# Append all new trips to the saved aggregates, retrain only the touched locations in pickup_ids and re-forecast the rest
+def refresh_forecasts_incremental(pickup_ids, horizon_days, new_trips_path, data_path=DATA_PATH, output_path=FORECAST_TABLE_PATH, engine="prophet"):
+    if os.path.exists(AGGREGATES_PATH):
+        demand_forecast = DemandForecast.from_aggregates(engine=engine)
+    else:
+        demand_forecast = load_demand_forecast(data_path, engine)
+    forecast_start = pd.Timestamp.today().normalize()
+
+    new_trips = pd.read_csv(new_trips_path)
+    forecasts = demand_forecast.update(new_trips, forecast_days=horizon_days, forecast_start=forecast_start, pickup_ids=pickup_ids)
+    for pickup_id in pickup_ids:
+        if pickup_id not in forecasts:
+            forecast = demand_forecast.predict_location(pickup_id, forecast_days=horizon_days, forecast_start=forecast_start)
+            if forecast is not None:
+                forecasts[pickup_id] = forecast
+
+    demand_forecast.save_aggregates()
+    table = write_forecast_table(forecasts, output_path)
+    print(f"Retrained {len(demand_forecast.timings)} locations, wrote {len(table)} forecast rows to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute demand forecast tables for the Streamlit pages")
+    parser.add_argument("--pickup-ids", type=int, nargs="+", default=[0, 8, 19, 30, 31])
+    parser.add_argument("--horizon-days", type=int, default=14)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of training processes")
+    parser.add_argument("--new-trips", default=None, help="CSV of new trips to apply incrementally instead of a full retrain")
+    parser.add_argument("--every-hours", type=float, default=None, help="Keep running and refresh on this schedule")
+    parser.add_argument("--engine", choices=ENGINES, default="prophet", help="Forecasting engine")
+    args = parser.parse_args()
+    if args.new_trips is not None and args.every_hours is not None:
+        parser.error("--new-trips applies a file once and cannot be combined with --every-hours")
+
+    while True:
+        failed = []
+        if args.new_trips is None:
+            failed = refresh_forecasts(args.pickup_ids, args.horizon_days, n_jobs=args.workers, engine=args.engine)
+        else:
+            refresh_forecasts_incremental(args.pickup_ids, args.horizon_days, args.new_trips, engine=args.engine)
+        if failed:
+            print(f"Training failed for Pickup IDs {failed}")
+        if args.every_hours is None:
+            sys.exit(1 if failed else 0)
+        time.sleep(args.every_hours * 3600)
@@ -0,0 +1,130 @@
+import os
+import threading
+from instrumentation import count, span, timed
+
+# Models, datasets and clients shared by every page and session of one server process.
+# Streamlit re-executes the page scripts on every interaction, so anything expensive lives here instead.
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models")
+
+# Loaded resources keyed by name, each stored with the mtime of the file it came from
+_resources = {}
+_lock = threading.Lock()
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+# Load a file-backed resource once, reloading it only when the file changes on disk (or disappears)
+def _cached(key, path, loader):
+    mtime = _mtime(path)
+    with _lock:
+        cached = _resources.get(key)
+        if cached is not None and cached[0] == mtime:
+            count("resource_cache_hits")
+            return cached[1]
+    count("resource_cache_misses")
+    value = loader(path) if mtime is not None else None
+    with _lock:
+        _resources[key] = (mtime, value)
+    return value
+
+
+# Load a resource without a backing file once per process
+def _singleton(key, factory):
+    with _lock:
+        if key in _resources:
+            return _resources[key][1]
+    value = factory()
+    with _lock:
+        _resources.setdefault(key, (None, value))
+        return _resources[key][1]
+
+
+def model_path(pickup_id):
+    return os.path.join(MODELS_DIR, f"prophet_model_pickup_{pickup_id}.pkl")
+
+
+def _load_pickle(path):
+    import joblib
+    with span("joblib_load"):
+        return joblib.load(path)
+
+
+# Pre-trained models for the pickup IDs, missing models are left out of the result
+# The model registry is served first (compact parameters, no Prophet import), legacy pickles cover the rest
+@timed()
+def load_all_models(pickup_ids):
+    from model_registry import load_registry
+    registry = load_registry()
+    models = registry.load_all(pickup_ids) if registry is not None else {}
+    for pickup_id in pickup_ids:
+        if pickup_id in models:
+            continue
+        model = _cached(("model", pickup_id), model_path(pickup_id), _load_pickle)
+        if model is not None:
+            models[pickup_id] = model
+    return models
+
+
+# Precomputed stop-to-stop matrix, reopened when stop_matrix.py rewrites it
+def get_stop_matrix():
+    from stop_matrix import MATRIX_PATH, StopMatrix
+    return _cached("stop_matrix", MATRIX_PATH, lambda path: StopMatrix())
+
+
+# Trips from the columnar store, cached per query until trips.parquet is rebuilt
+def get_trips(columns=None, status=None):
+    from trip_store import TRIP_STORE_PATH, ensure_trip_store, load_trips
+    ensure_trip_store()
+    key = ("trips", tuple(columns) if columns else None, status)
+    return _cached(key, TRIP_STORE_PATH, lambda path: load_trips(columns=columns, status=status))
+
+
+def get_stops(columns=None):
+    from trip_store import STOP_STORE_PATH, ensure_trip_store, load_stops
+    ensure_trip_store()
+    key = ("stops", tuple(columns) if columns else None)
+    return _cached(key, STOP_STORE_PATH, lambda path: load_stops(columns=columns))
+
+
+# On-disk Mapbox route cache, one SQLite connection per process
+def get_route_cache():
+    def create():
+        from route_cache import RouteCache
+        return RouteCache()
+    return _singleton("route_cache", create)
+
+
+def get_ors_client():
+    def create():
+        import openrouteservice
+        return openrouteservice.Client(key=os.getenv("ORS_API_KEY"))
+    return _singleton("ors_client", create)
+
+
+# Offline road graph when ROUTING_BACKEND=local, otherwise the batched ORS client
+def get_router():
+    from local_router import get_local_router, use_local_routing
+    if use_local_routing():
+        return get_local_router()
+
+    def create():
+        from ors_routing import BatchRouter
+        return BatchRouter(get_ors_client())
+    return _singleton("ors_router", create)
+
+
+# Drop cached resources (all of them, or those whose key equals or starts with name)
+# Forecast grids computed from dropped models are dropped with them
+def invalidate(name=None):
+    with _lock:
+        for key in list(_resources):
+            if name is None or key == name or (isinstance(key, tuple) and key[0] == name):
+                del _resources[key]
+    if name is None or name == "model":
+        from forecast_batch import clear_forecast_cache
+        clear_forecast_cache()
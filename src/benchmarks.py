@@ -0,0 +1,283 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# Benchmark results, one JSON file per run so versions can be compared
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+
+# Multiples of the real trip log (and of the fleet) to run every case at; 1 is the real data
+SCALES = (1, 10, 100, 1000)
+BASE_FLEET = 5
+# A case is reported as a regression when its median time grows by more than this factor
+REGRESSION_THRESHOLD = 1.2
+
+TRIP_COLUMNS = ["Booking ID", "Passenger status", "Passengers", "Pickup ID", "Dropoff ID",
+                "Actual Pickup Time", "Actual Dropoff Time",
+                "Pickup Latitude", "Pickup Longitude", "Dropoff Latitude", "Dropoff Longitude"]
+
+
+# Real trip log repeated `scale` times with pickup times jittered by up to half an hour and unique booking IDs
+def synthetic_trips(trips, scale, seed=42):
+    if scale == 1:
+        return trips.reset_index(drop=True)
+    rng = np.random.default_rng(seed)
+    synthetic = trips.iloc[np.tile(np.arange(len(trips)), scale)].reset_index(drop=True)
+    jitter = pd.to_timedelta(rng.integers(-30, 31, len(synthetic)), unit="min")
+    synthetic["Actual Pickup Time"] += jitter
+    synthetic["Actual Dropoff Time"] += jitter
+    synthetic["Booking ID"] = np.arange(len(synthetic), dtype=np.int64)
+    return synthetic.sort_values("Actual Pickup Time", kind="stable").reset_index(drop=True)
+
+
+# Synthetic fleet: BASE_FLEET * scale vehicles parked at random stops, as (lat, lon) and stop matrix positions
+def synthetic_fleet(stop_matrix, scale, seed=42):
+    rng = np.random.default_rng(seed)
+    stops = rng.integers(0, len(stop_matrix), BASE_FLEET * scale)
+    return np.column_stack([stop_matrix.latitudes[stops], stop_matrix.longitudes[stops]]), stops
+
+
+# Stand-in for get_real_route_mapbox: straight line with 20 vertices and the offline leg estimates, no network
+def stub_route(api_key, start, end, profile="driving"):
+    from geo import estimate_legs
+    distance, duration, co2_emission = estimate_legs(start[1], start[0], end[1], end[0])
+    steps = np.linspace(0.0, 1.0, 20)[:, None]
+    route = (np.asarray(start) + steps * (np.asarray(end) - np.asarray(start))).tolist()
+    return route, float(distance), float(duration), float(co2_emission)
+
+
+# Data shared by the cases of one scale, built outside the timed code
+class Fixture:
+    def __init__(self, trips, stop_matrix, scale, workdir):
+        from demand_tensor import DemandTensor
+
+        self.scale = scale
+        self.stop_matrix = stop_matrix
+        self.trips = synthetic_trips(trips, scale)
+        self.start = self.trips["Actual Pickup Time"].min().normalize()
+        self.end = self.trips["Actual Pickup Time"].max().normalize() + pd.Timedelta(days=1)
+        self.tensor = DemandTensor.from_trips(self.trips, stop_matrix.stop_ids, self.start, self.end)
+        self.fleet_positions, self.fleet_stops = synthetic_fleet(stop_matrix, scale)
+        # Bookings with known pickup and dropoff coordinates, what the dispatch cases draw from
+        self.located = self.trips.dropna(subset=["Pickup Latitude", "Pickup Longitude", "Dropoff Latitude", "Dropoff Longitude"])
+        self.store_path = os.path.join(workdir, f"trips_x{scale}.parquet")
+        self.trips.to_parquet(self.store_path, index=False, row_group_size=50_000)
+
+
+# Benchmark cases: name -> (function(fixture) run under the timer, largest scale it is run at)
+# Cases with a largest scale of None do not depend on data volume and run once
+def case_excel_load(fixture):
+    from trip_store import RAW_STOPS_PATH, RAW_TRIPS_PATH
+    pd.read_excel(RAW_TRIPS_PATH, engine="openpyxl")
+    pd.read_excel(RAW_STOPS_PATH, engine="openpyxl")
+
+
+def case_trip_store_load(fixture):
+    from trip_store import load_trips
+    load_trips(columns=["Pickup ID", "Actual Pickup Time", "Passenger status"], path=fixture.store_path)
+
+
+def case_load_all_models(fixture):
+    from model_registry import REGISTRY_DIR, ModelRegistry
+    registry = ModelRegistry(REGISTRY_DIR)
+    registry.load_all(registry.pickup_ids)
+
+
+def case_predict_demand_hourly(fixture):
+    # One call per pickup ID and hour, the way the pages forecasted before the batch grid
+    from forecast_batch import hourly_timestamps, predict_demand
+    from model_registry import load_registry
+    models = load_registry().load_all()
+    for timestamp in hourly_timestamps(fixture.start):
+        for model in models.values():
+            predict_demand(model, timestamp)
+
+
+def case_forecast_grid(fixture):
+    from forecast_batch import clear_forecast_cache, forecast_grid
+    from model_registry import load_registry
+    clear_forecast_cache()
+    forecast_grid(load_registry().load_all(), fixture.start, days=7)
+
+
+def case_demand_tensor(fixture):
+    from demand_tensor import DemandTensor
+    DemandTensor.from_trips(fixture.trips, fixture.stop_matrix.stop_ids, fixture.start, fixture.end)
+
+
+def case_seasonal_fit(fixture):
+    from seasonal_forecast import SeasonalBaseline
+    SeasonalBaseline().fit(fixture.tensor.counts, fixture.start, fixture.stop_matrix.stop_ids)
+
+
+def case_kmeans_positions(fixture):
+    # The KMeans step prepositioning_final.py used before the planner, for every hour of one day
+    from sklearn.cluster import KMeans
+    coordinates = np.column_stack([fixture.stop_matrix.latitudes, fixture.stop_matrix.longitudes])
+    day = fixture.tensor.window(fixture.start, fixture.start + pd.Timedelta(days=1))
+    for hour in range(24):
+        weights = day[:, hour].astype(np.float64)
+        if weights.sum() > 0:
+            n_clusters = min(BASE_FLEET * fixture.scale, int((weights > 0).sum()))
+            KMeans(n_clusters=n_clusters, random_state=42, n_init=10).fit(coordinates, sample_weight=weights)
+
+
+def case_prepositioning_plan(fixture):
+    from prepositioning_plan import plan_prepositioning
+    from stop_matrix import DISTANCE, DURATION
+    day = fixture.tensor.window(fixture.start, fixture.start + pd.Timedelta(days=1))
+    plan_prepositioning(day, fixture.stop_matrix.matrix[DURATION], fixture.stop_matrix.matrix[DISTANCE], BASE_FLEET * fixture.scale)
+
+
+def case_calculate_cost_loop(fixture):
+    # Per-shuttle scoring with two stubbed route calls each, as Route_optimisation.py did before vectorizing
+    from dispatch import calculate_cost
+    pickup, dropoff = [11.4105, 49.0201], [11.4200, 49.0300]
+    for lat, lon in fixture.fleet_positions:
+        _, d1, t1, c1 = stub_route(None, [lon, lat], pickup)
+        _, d2, t2, c2 = stub_route(None, pickup, dropoff)
+        calculate_cost(d1 + d2, t1 + t2, 3, c1 + c2)
+
+
+def case_dispatch(fixture):
+    # One dispatch round: every vehicle against as many open bookings, cost matrix + optimal assignment
+    from dispatch import dispatch
+    requests = fixture.located.iloc[:len(fixture.fleet_positions)]
+    dispatch(fixture.fleet_positions,
+             requests[["Pickup Latitude", "Pickup Longitude"]].to_numpy(),
+             requests[["Dropoff Latitude", "Dropoff Longitude"]].to_numpy(),
+             requests["Passengers"].to_numpy())
+
+
+def case_route_optimisation(fixture):
+    # The Route_optimisation.py request path (rank the fleet, route the chosen shuttle) for 10 bookings per scale
+    from dispatch import calculate_cost, dispatch
+    requests = fixture.located.iloc[:10 * fixture.scale]
+    for pickup_lat, pickup_lon, dropoff_lat, dropoff_lon, passengers in requests[
+            ["Pickup Latitude", "Pickup Longitude", "Dropoff Latitude", "Dropoff Longitude", "Passengers"]].to_numpy():
+        assignment, _ = dispatch(fixture.fleet_positions, [[pickup_lat, pickup_lon]], [[dropoff_lat, dropoff_lon]], [passengers])
+        lat, lon = fixture.fleet_positions[assignment[0]]
+        _, d1, t1, c1 = stub_route(None, [lon, lat], [pickup_lon, pickup_lat])
+        _, d2, t2, c2 = stub_route(None, [pickup_lon, pickup_lat], [dropoff_lon, dropoff_lat])
+        calculate_cost(d1 + d2, t1 + t2, passengers, c1 + c2)
+
+
+def case_simulator(fixture):
+    from simulator import simulate
+    simulate(fixture.start, fixture.end, BASE_FLEET * fixture.scale, trips=fixture.trips, stop_matrix=fixture.stop_matrix)
+
+
+def case_map_grid(fixture):
+    from map_layers import MapLayers
+    MapLayers(fixture.trips).grid("pickups", zoom=13)
+
+
+CASES = {
+    "excel_load": (case_excel_load, 1),
+    "trip_store_load": (case_trip_store_load, 1000),
+    "load_all_models": (case_load_all_models, None),
+    "predict_demand_hourly": (case_predict_demand_hourly, None),
+    "forecast_grid": (case_forecast_grid, None),
+    "demand_tensor": (case_demand_tensor, 1000),
+    "seasonal_fit": (case_seasonal_fit, 1000),
+    "kmeans_positions": (case_kmeans_positions, 10),
+    "prepositioning_plan": (case_prepositioning_plan, 100),
+    "calculate_cost_loop": (case_calculate_cost_loop, 1000),
+    "dispatch": (case_dispatch, 100),
+    "route_optimisation": (case_route_optimisation, 100),
+    "simulator": (case_simulator, 10),
+    "map_grid": (case_map_grid, 1000),
+}
+
+
+# Wall-clock time of fn(), repeated; min and median in seconds
+def measure(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return {"min": min(times), "median": float(np.median(times)), "runs": repeat}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Run the selected cases at every scale; results are keyed "case@scale" ("case" for volume-independent cases)
+def run_benchmarks(cases=None, scales=SCALES, repeat=3):
+    from stop_matrix import StopMatrix
+    from trip_store import load_trips
+
+    cases = list(cases or CASES)
+    trips = load_trips(columns=TRIP_COLUMNS)
+    stop_matrix = StopMatrix()
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in sorted(scales):
+            selected = [name for name in cases if CASES[name][1] is not None and scale <= CASES[name][1]]
+            if scale == min(scales):
+                selected += [name for name in cases if CASES[name][1] is None]
+            if not selected:
+                continue
+            fixture = Fixture(trips, stop_matrix, scale, workdir)
+            for name in selected:
+                key = name if CASES[name][1] is None else f"{name}@{scale}"
+                results[key] = measure(lambda: CASES[name][0](fixture), repeat)
+                print(f"{key:>30}: {results[key]['median'] * 1000:10.1f} ms")
+    return {
+        "revision": git_revision(),
+        "created": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "results": results,
+    }
+
+
+# Cases whose median time grew by more than `threshold` against a baseline run: {key: (baseline, current, ratio)}
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    regressions = {}
+    for key, result in current["results"].items():
+        previous = baseline["results"].get(key)
+        if previous is None:
+            continue
+        ratio = result["median"] / previous["median"] if previous["median"] > 0 else float("inf")
+        marker = "  REGRESSION" if ratio > threshold else ""
+        print(f"{key:>30}: {previous['median'] * 1000:10.1f} ms -> {result['median'] * 1000:10.1f} ms ({ratio:5.2f}x){marker}")
+        if ratio > threshold:
+            regressions[key] = (previous["median"], result["median"], ratio)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the forecasting, prepositioning and dispatch hot paths on scaled synthetic data")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=None)
+    parser.add_argument("--scales", type=int, nargs="+", default=list(SCALES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default=None, help="Result file (default: benchmarks/<git revision>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier result file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.cases, args.scales, args.repeat)
+    out = args.out or os.path.join(RESULTS_DIR, f"{report['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(f"{len(regressions)} case(s) slower than {args.threshold}x the baseline")
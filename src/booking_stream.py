@@ -0,0 +1,216 @@
+import csv
+import os
+import queue
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# CSV of live booking events to follow (same columns as the trip data), enables the stream in the pages
+BOOKING_STREAM_PATH = os.getenv("BOOKING_STREAM_PATH")
+
+# Hours of per-stop history kept by the counters, and the pseudo-count that keeps the nowcast near the forecast
+HISTORY_HOURS = 48
+NOWCAST_PRIOR = 2.0
+
+# Process-wide stream, so the counters survive Streamlit reruns
+_shared_stream = None
+_shared_lock = threading.Lock()
+
+
+# Per-stop booking counters in ring buffers: hourly totals/cancellations and minute totals for the last hour
+# Every event is O(1); a bucket is cleared when its hour or minute comes round again
+class DemandCounters:
+    def __init__(self, history_hours=HISTORY_HOURS, n_stops=128):
+        self.history_hours = history_hours
+        self.hourly = np.zeros((n_stops, history_hours), dtype=np.int32)
+        self.hourly_cancelled = np.zeros((n_stops, history_hours), dtype=np.int32)
+        self.hour_stamp = np.full(history_hours, -1, dtype=np.int64)
+        self.minutely = np.zeros((n_stops, 60), dtype=np.int32)
+        self.minute_stamp = np.full(60, -1, dtype=np.int64)
+        # Booking ID -> (stop, hour, cancelled), so a later status change moves the booking between counters
+        self.bookings = {}
+        self.events = 0
+        self.latest = None
+        self._lock = threading.Lock()
+
+    def _ensure_stop(self, stop_id):
+        if stop_id >= len(self.hourly):
+            grow = max(stop_id + 1, 2 * len(self.hourly)) - len(self.hourly)
+            self.hourly = np.pad(self.hourly, ((0, grow), (0, 0)))
+            self.hourly_cancelled = np.pad(self.hourly_cancelled, ((0, grow), (0, 0)))
+            self.minutely = np.pad(self.minutely, ((0, grow), (0, 0)))
+
+    def _hour_bucket(self, hour):
+        bucket = hour % self.history_hours
+        if self.hour_stamp[bucket] != hour:
+            self.hourly[:, bucket] = 0
+            self.hourly_cancelled[:, bucket] = 0
+            self.hour_stamp[bucket] = hour
+        return bucket
+
+    def _minute_bucket(self, minute):
+        bucket = minute % 60
+        if self.minute_stamp[bucket] != minute:
+            self.minutely[:, bucket] = 0
+            self.minute_stamp[bucket] = minute
+        return bucket
+
+    # Apply one booking event (Booking ID, Pickup ID, Actual Pickup Time, optional Passenger status)
+    def add(self, event):
+        stop = int(event["Pickup ID"])
+        event_time = pd.Timestamp(event["Actual Pickup Time"])
+        if pd.isna(event_time):
+            raise ValueError(f"Booking event without a pickup time: {event}")
+        minute = int(event_time.value // 60_000_000_000)
+        hour = minute // 60
+        cancelled = event.get("Passenger status") == "Cancelled"
+        booking_id = event.get("Booking ID")
+
+        with self._lock:
+            self._ensure_stop(stop)
+            self.events += 1
+            self.latest = event_time if self.latest is None else max(self.latest, event_time)
+
+            previous = self.bookings.get(booking_id) if booking_id is not None else None
+            if previous is not None:
+                # Status update of a booking already counted: only the cancellation counter can change
+                previous_stop, previous_hour, was_cancelled = previous
+                if cancelled != was_cancelled and self.hour_stamp[previous_hour % self.history_hours] == previous_hour:
+                    self.hourly_cancelled[previous_stop, previous_hour % self.history_hours] += 1 if cancelled else -1
+                self.bookings[booking_id] = (previous_stop, previous_hour, cancelled)
+                return
+
+            if self.hour_stamp[hour % self.history_hours] > hour:
+                # Older than the history kept in the ring
+                return
+            bucket = self._hour_bucket(hour)
+            self.hourly[stop, bucket] += 1
+            if cancelled:
+                self.hourly_cancelled[stop, bucket] += 1
+            if self.minute_stamp[minute % 60] <= minute:
+                self.minutely[stop, self._minute_bucket(minute)] += 1
+            if booking_id is not None:
+                self.bookings[booking_id] = (stop, hour, cancelled)
+                if len(self.bookings) > 100_000:
+                    # Forget bookings outside the hourly history
+                    oldest = hour - self.history_hours
+                    self.bookings = {key: value for key, value in self.bookings.items() if value[1] > oldest}
+
+    def _now(self, now):
+        if now is not None:
+            return pd.Timestamp(now)
+        return self.latest if self.latest is not None else pd.Timestamp.now()
+
+    # Bookings per stop in the last window_minutes (up to 60) before now
+    def recent_counts(self, stop_ids, now=None, window_minutes=60):
+        now_minute = int(self._now(now).value // 60_000_000_000)
+        with self._lock:
+            live = (self.minute_stamp > now_minute - window_minutes) & (self.minute_stamp <= now_minute)
+            stop_ids = np.asarray(stop_ids, dtype=np.int64)
+            counts = np.zeros(len(stop_ids), dtype=np.int64)
+            known = stop_ids < len(self.minutely)
+            counts[known] = self.minutely[stop_ids[known]][:, live].sum(axis=1)
+        return counts
+
+    # Bookings and cancellation rate per stop over the last `hours` complete and current hours
+    def cancellation_rates(self, stop_ids, now=None, hours=24):
+        now_hour = int(self._now(now).value // 3_600_000_000_000)
+        with self._lock:
+            live = (self.hour_stamp > now_hour - hours) & (self.hour_stamp <= now_hour)
+            stop_ids = np.asarray(stop_ids, dtype=np.int64)
+            totals = np.zeros(len(stop_ids), dtype=np.int64)
+            cancelled = np.zeros(len(stop_ids), dtype=np.int64)
+            known = stop_ids < len(self.hourly)
+            totals[known] = self.hourly[stop_ids[known]][:, live].sum(axis=1)
+            cancelled[known] = self.hourly_cancelled[stop_ids[known]][:, live].sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return totals, np.where(totals > 0, cancelled / totals, np.nan)
+
+    # Scale hourly forecasts ({pickup_id: yhat}) by how the last window_minutes compare with what they predicted
+    # Shrunk towards 1 with NOWCAST_PRIOR pseudo-bookings so a single booking does not swing the forecast
+    def nowcast(self, forecast, now=None, window_minutes=60, prior=NOWCAST_PRIOR):
+        pickup_ids = list(forecast)
+        expected = np.array([max(float(forecast[pickup_id]), 0.0) for pickup_id in pickup_ids]) * window_minutes / 60
+        observed = self.recent_counts(pickup_ids, now, window_minutes)
+        factor = (observed + prior) / (expected + prior)
+        return {pickup_id: float(forecast[pickup_id] * factor[i]) if forecast[pickup_id] > 0 else float(observed[i] * 60 / window_minutes)
+                for i, pickup_id in enumerate(pickup_ids)}
+
+
+# Follow a CSV file as it grows (tail -f), yielding one dict per booking row; the header is read first
+def tail_csv(path, from_start=True, poll_interval=1.0, stop_event=None):
+    with open(path, newline="") as f:
+        header = next(csv.reader([f.readline()]))
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        pending = ""
+        while stop_event is None or not stop_event.is_set():
+            line = f.readline()
+            if not line:
+                time.sleep(poll_interval)
+                continue
+            pending += line
+            if not pending.endswith("\n"):
+                # Partially written row, wait for the rest
+                continue
+            row = next(csv.reader([pending]))
+            pending = ""
+            if row:
+                yield dict(zip(header, row))
+
+
+# Local stand-in for a message queue: yields events put on a queue.Queue until None is received
+def queue_events(event_queue, stop_event=None):
+    while stop_event is None or not stop_event.is_set():
+        try:
+            event = event_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        if event is None:
+            return
+        yield event
+
+
+# Feeds events from a source into DemandCounters on a background thread
+class BookingStream:
+    def __init__(self, counters=None):
+        self.counters = counters or DemandCounters()
+        self.errors = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def consume(self, events):
+        for event in events:
+            try:
+                self.counters.add(event)
+            except (KeyError, ValueError):
+                # Malformed event, counted but otherwise skipped
+                self.errors += 1
+
+    def start_file(self, path, from_start=True):
+        return self._start(tail_csv(path, from_start=from_start, stop_event=self._stop))
+
+    def start_queue(self, event_queue):
+        return self._start(queue_events(event_queue, stop_event=self._stop))
+
+    def _start(self, events):
+        self._thread = threading.Thread(target=self.consume, args=(events,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+# Shared stream following BOOKING_STREAM_PATH, None when streaming is not configured
+def get_booking_stream(path=BOOKING_STREAM_PATH):
+    global _shared_stream
+    if not path:
+        return None
+    with _shared_lock:
+        if _shared_stream is None:
+            _shared_stream = BookingStream().start_file(path)
+        return _shared_stream
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+COMPLETED, CANCELLED = "Trip completed", "Cancelled"
+
+
+# Hourly pickup counts as dense int32 arrays [stops x hours], hours without bookings are explicit zeros
+# Built once and shared by model training, heatmaps and the simulator
+class DemandTensor:
+    def __init__(self, stop_ids, start, counts, completed=None, cancelled=None):
+        self.stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        self.start = pd.Timestamp(start)
+        self.counts = np.asarray(counts, dtype=np.int32)
+        # Counts split by passenger status, only available when built from trips
+        self.completed = None if completed is None else np.asarray(completed, dtype=np.int32)
+        self.cancelled = None if cancelled is None else np.asarray(cancelled, dtype=np.int32)
+        # Stop IDs are small integers, so a dense ID -> row array gives O(1) lookups
+        self._position = np.full(self.stop_ids.max() + 1 if len(self.stop_ids) else 0, -1, dtype=np.int64)
+        self._position[self.stop_ids] = np.arange(len(self.stop_ids))
+
+    @property
+    def hours(self):
+        return self.counts.shape[1]
+
+    @property
+    def end(self):
+        return self.start + pd.Timedelta(hours=self.hours)
+
+    @property
+    def timestamps(self):
+        return pd.date_range(self.start, periods=self.hours, freq="h")
+
+    def __contains__(self, stop_id):
+        return 0 <= stop_id < len(self._position) and self._position[stop_id] >= 0
+
+    def index_of(self, stop_ids):
+        stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        if np.any((stop_ids < 0) | (stop_ids >= len(self._position))) or np.any(self._position[stop_ids] < 0):
+            raise KeyError(f"Unknown stop ID in {stop_ids}")
+        return self._position[stop_ids]
+
+    # Column of the hour containing t (may be outside [0, hours) for times outside the tensor)
+    def slot(self, t):
+        return int((pd.Timestamp(t).floor("h") - self.start) / pd.Timedelta(hours=1))
+
+    def _layer(self, status):
+        if status is None:
+            return self.counts
+        layer = {COMPLETED: self.completed, CANCELLED: self.cancelled}[status]
+        if layer is None:
+            raise ValueError("Counts by passenger status need a tensor built from trips")
+        return layer
+
+    # Hourly counts of one stop (a view, no copy)
+    def row(self, stop_id, status=None):
+        return self._layer(status)[self.index_of([stop_id])[0]]
+
+    # Counts for a time window [start, end) and optionally a subset of stops, shape [stops x hours]
+    # Without stop_ids the result is a view into the tensor
+    def window(self, start=None, end=None, stop_ids=None, status=None):
+        first = 0 if start is None else max(0, self.slot(start))
+        last = self.hours if end is None else min(self.hours, self.slot(end))
+        layer = self._layer(status)
+        if stop_ids is None:
+            return layer[:, first:last]
+        return layer[self.index_of(stop_ids), first:last]
+
+    # Total counts per weekday x hour of day [7 x 24], for heatmaps
+    def weekday_hour(self, stop_ids=None, status=None):
+        counts = self.window(stop_ids=stop_ids, status=status).sum(axis=0)
+        hours = self.timestamps
+        return np.bincount(hours.dayofweek * 24 + hours.hour, weights=counts, minlength=7 * 24).reshape(7, 24)
+
+    # Long format (Rounded Pickup Time, Pickup ID, demand) as used by DemandForecast, zero hours left out by default
+    def to_frame(self, include_zeros=False):
+        rows, slots = np.nonzero(self.counts) if not include_zeros else np.indices(self.counts.shape).reshape(2, -1)
+        return pd.DataFrame({
+            "Rounded Pickup Time": self.start + pd.to_timedelta(slots, unit="h"),
+            "Pickup ID": self.stop_ids[rows],
+            "demand": self.counts[rows, slots],
+        }).sort_values(["Rounded Pickup Time", "Pickup ID"], ignore_index=True)
+
+    # From individual trips (Pickup ID, Actual Pickup Time and optionally Passenger status)
+    # Trips on stops outside stop_ids or outside [start, end) are ignored; start/end default to whole days around the data
+    @classmethod
+    def from_trips(cls, trips, stop_ids=None, start=None, end=None):
+        times = pd.to_datetime(trips["Actual Pickup Time"])
+        status = trips["Passenger status"].to_numpy() if "Passenger status" in trips else None
+        layers = {"counts": None}
+        if status is not None:
+            layers.update({"completed": status == COMPLETED, "cancelled": status == CANCELLED})
+        return cls._build(trips["Pickup ID"].to_numpy(), times, None, layers, stop_ids, start, end)
+
+    # From hourly aggregates (Rounded Pickup Time, Pickup ID, demand)
+    @classmethod
+    def from_aggregates(cls, pickup_demand, stop_ids=None, start=None, end=None):
+        times = pd.to_datetime(pickup_demand["Rounded Pickup Time"])
+        return cls._build(pickup_demand["Pickup ID"].to_numpy(), times, pickup_demand["demand"].to_numpy(),
+                          {"counts": None}, stop_ids, start, end)
+
+    # Straight from the columnar trip store
+    @classmethod
+    def from_trip_store(cls, stop_ids=None, start=None, end=None):
+        from trip_store import load_trips
+        trips = load_trips(columns=["Pickup ID", "Actual Pickup Time", "Passenger status"], start=start, end=end)
+        return cls.from_trips(trips, stop_ids, start, end)
+
+    @classmethod
+    def _build(cls, pickup_ids, times, weights, layers, stop_ids, start, end):
+        pickup_ids = np.asarray(pickup_ids, dtype=np.int64)
+        stop_ids = np.unique(pickup_ids) if stop_ids is None else np.asarray(stop_ids, dtype=np.int64)
+        if start is None:
+            start = times.min().floor("D") if len(times) else pd.Timestamp.today().normalize()
+        if end is None:
+            end = (times.max() + pd.Timedelta(hours=1)).ceil("D") if len(times) else pd.Timestamp(start) + pd.Timedelta(days=1)
+        start, end = pd.Timestamp(start).floor("h"), pd.Timestamp(end).ceil("h")
+        hours = int((end - start) / pd.Timedelta(hours=1))
+
+        # Flat cell index stop_row * hours + hour_slot, then one bincount per layer
+        position = np.full(max(pickup_ids.max(initial=0), stop_ids.max(initial=0)) + 1, -1, dtype=np.int64)
+        position[stop_ids] = np.arange(len(stop_ids))
+        rows = position[pickup_ids]
+        slots = ((times - start) // pd.Timedelta(hours=1)).to_numpy()
+        keep = (rows >= 0) & (slots >= 0) & (slots < hours)
+        flat = rows[keep] * hours + slots[keep]
+        weights = None if weights is None else np.asarray(weights)[keep]
+
+        built = {}
+        for name, mask in layers.items():
+            cell_weights = weights if mask is None else mask[keep].astype(np.int64)
+            counts = np.bincount(flat, weights=cell_weights, minlength=len(stop_ids) * hours)
+            built[name] = counts.reshape(len(stop_ids), hours)
+        return cls(stop_ids, start, built["counts"], built.get("completed"), built.get("cancelled"))
@@ -0,0 +1,57 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from geo import estimate_legs
+
+# Weights of the dispatch cost function
+DISTANCE_WEIGHT, TIME_WEIGHT, PASSENGERS_WEIGHT, CO2_WEIGHT = 1.0, 1.0, 0.5, 1.0
+
+
+# Define a cost function based on distance, time, and emissions (scalars or NumPy arrays)
+def calculate_cost(distance, time, passengers, co2_emission):
+    return (DISTANCE_WEIGHT * distance) + (TIME_WEIGHT * time) + (PASSENGERS_WEIGHT * passengers) + (CO2_WEIGHT * co2_emission)
+
+
+# Cost of serving every request with every vehicle, shape [vehicles x requests]
+# Positions are (lat, lon) arrays; leg_fn(lat1, lon1, lat2, lon2) -> (distance, duration, co2) must broadcast
+def dispatch_cost_matrix(vehicle_positions, pickups, dropoffs, passengers, leg_fn=estimate_legs):
+    vehicle_positions = np.asarray(vehicle_positions, dtype=np.float64).reshape(-1, 2)
+    pickups = np.asarray(pickups, dtype=np.float64).reshape(-1, 2)
+    dropoffs = np.asarray(dropoffs, dtype=np.float64).reshape(-1, 2)
+    passengers = np.broadcast_to(np.asarray(passengers, dtype=np.float64), (len(pickups),))
+
+    # Deadhead leg from each vehicle to each pickup
+    to_pickup = leg_fn(vehicle_positions[:, 0, None], vehicle_positions[:, 1, None], pickups[None, :, 0], pickups[None, :, 1])
+    # Passenger leg from pickup to dropoff, the same for every vehicle
+    to_dropoff = leg_fn(pickups[:, 0], pickups[:, 1], dropoffs[:, 0], dropoffs[:, 1])
+
+    distance, duration, co2_emission = (a + b[None, :] for a, b in zip(to_pickup, to_dropoff))
+    return calculate_cost(distance, duration, passengers[None, :], co2_emission)
+
+
+# Same cost matrix when vehicles and requests sit on FLEXI stops, read from the precomputed StopMatrix
+def stop_dispatch_cost_matrix(stop_matrix, vehicle_stop_ids, pickup_ids, dropoff_ids, passengers):
+    vehicles = stop_matrix.index_of(vehicle_stop_ids)
+    pickups = stop_matrix.index_of(pickup_ids)
+    dropoffs = stop_matrix.index_of(dropoff_ids)
+    passengers = np.broadcast_to(np.asarray(passengers, dtype=np.float64), (len(pickups),))
+
+    layers = np.asarray(stop_matrix.matrix[:, vehicles[:, None], pickups[None, :]], dtype=np.float64)
+    layers += np.asarray(stop_matrix.matrix[:, pickups, dropoffs], dtype=np.float64)[:, None, :]
+    return calculate_cost(layers[0], layers[1], passengers[None, :], layers[2])
+
+
+# Optimal one-to-one assignment of vehicles to requests (Hungarian / min-cost matching)
+# Returns the vehicle index per request (-1 when the request stays unassigned) and the cost per request
+def assign_requests(cost_matrix):
+    cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+    vehicles, requests = linear_sum_assignment(cost_matrix)
+    assignment = np.full(cost_matrix.shape[1], -1, dtype=np.int64)
+    costs = np.full(cost_matrix.shape[1], np.nan)
+    assignment[requests] = vehicles
+    costs[requests] = cost_matrix[vehicles, requests]
+    return assignment, costs
+
+
+# Convenience wrapper: build the cost matrix from coordinates and solve the assignment in one call
+def dispatch(vehicle_positions, pickups, dropoffs, passengers, leg_fn=estimate_legs):
+    return assign_requests(dispatch_cost_matrix(vehicle_positions, pickups, dropoffs, passengers, leg_fn=leg_fn))
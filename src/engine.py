@@ -0,0 +1,298 @@
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import requests
+from app_resources import get_route_cache, get_stop_matrix, load_all_models
+from booking_stream import get_booking_stream
+from dispatch import assign_requests, dispatch_cost_matrix
+from fleet_state import get_fleet_state
+from forecast_batch import demand_at, forecast_grid
+from forecast_store import load_forecast_table
+from geo import estimate_legs
+from instrumentation import count, span, timed
+from local_router import get_local_router, use_local_routing
+from map_layers import get_map_layers
+from parking import get_parking_fetcher
+from prepositioning_plan import demand_matrix_from_forecast, plan_moves, plan_prepositioning
+from spatial_index import parking_index
+from stop_matrix import DISTANCE, DURATION
+
+# Forecasting, prepositioning, dispatch and routing without Streamlit, shared by the pages and the HTTP service
+# Models, matrices and indexes stay loaded for the life of the process
+
+# Coordinates mapping for each pickup ID
+PICKUP_COORDINATES = {
+    0: {"lat": 48.992168, "lon": 11.377365},
+    8: {"lat": 49.017505, "lon": 11.404733},
+    19: {"lat": 49.033832, "lon": 11.471982},
+    30: {"lat": 49.036378, "lon": 11.470632},
+    31: {"lat": 49.035227, "lon": 11.467885}
+}
+PICKUP_IDS = list(PICKUP_COORDINATES)
+
+# Map each pickup location to its nearest city ID in ParkAPI
+CITY_ID_MAP = {
+    0: "city1",
+    8: "city2",
+    19: "city3",
+    30: "city4",
+    31: "city5"
+}
+
+# Nearest vehicles per booking that are costed by dispatch, keeps large fleets cheap
+DISPATCH_CANDIDATES = 8
+
+MAPBOX_OPTIONS = {
+    "geometries": "geojson",
+    "overview": "full",
+    "annotations": "distance,duration",
+}
+
+_shared_engine = None
+_shared_lock = threading.Lock()
+
+
+# Request the engine cannot serve as asked (as opposed to a bug), the service answers it with 422
+class EngineInputError(ValueError):
+    pass
+
+
+# Fetch real route details from the Mapbox Directions API; start/end are [lon, lat]
+def fetch_route_mapbox(api_key, start, end, profile="driving"):
+    url = f"https://api.mapbox.com/directions/v5/mapbox/{profile}/{start[0]},{start[1]};{end[0]},{end[1]}"
+    params = {"access_token": api_key, **MAPBOX_OPTIONS}
+    count("mapbox_requests")
+    with span("mapbox_request"):
+        response = requests.get(url, params=params)
+    if response.status_code == 200:
+        data = response.json()
+        if data['routes']:
+            route = data['routes'][0]['geometry']['coordinates']
+            distance = data['routes'][0]['distance'] / 1000  # Convert to kilometers
+            duration = data['routes'][0]['duration'] / 60  # Convert to minutes
+            co2_emission = distance * 120  # Estimate CO₂ emissions (e.g., 120 grams per km)
+            return route, distance, duration, co2_emission
+    else:
+        # Reported through the mapbox_errors counter, the caller gets no route
+        count("mapbox_errors")
+    return None, None, None, None
+
+
+# Real route details, served from the route cache when possible
+# With ROUTING_BACKEND=local the offline road graph answers instead, without any network access
+@timed()
+def get_real_route_mapbox(api_key, start, end, profile="driving"):
+    if use_local_routing():
+        return get_local_router().route(start, end)
+    return get_route_cache().get_or_fetch(
+        profile, start, end, lambda: fetch_route_mapbox(api_key, start, end, profile), options=MAPBOX_OPTIONS
+    )
+
+
+class Engine:
+    def __init__(self, pickup_coordinates=PICKUP_COORDINATES, city_id_map=CITY_ID_MAP, fleet=None):
+        self.pickup_coordinates = pickup_coordinates
+        self.pickup_ids = list(pickup_coordinates)
+        self.city_id_map = city_id_map
+        # Live vehicle positions (fleet_state.FleetState), the shared store unless one is given
+        self.fleet = fleet or get_fleet_state()
+        # Day plans keyed by (date, fleet size, forecast table version), the hour only selects a row
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    # Load everything a first request would otherwise wait for
+    def warm_up(self):
+        get_stop_matrix()
+        load_forecast_table()
+        load_all_models(self.pickup_ids)
+        return self
+
+    # Demand for every pickup ID at the hour and the whole day's forecast, plus messages for the caller
+    # The forecast table is served first, live models only outside its horizon; a live booking stream corrects the hour
+    @timed("engine_forecast")
+    def forecast(self, forecast_date, forecast_hour):
+        forecast_date = pd.Timestamp(forecast_date).normalize()
+        forecast_datetime = forecast_date + pd.Timedelta(hours=forecast_hour)
+        warnings = []
+        forecast_table = load_forecast_table()
+        if forecast_table is not None and forecast_table.covers(forecast_datetime):
+            hourly_demand = forecast_table.demand_at(forecast_datetime, self.pickup_ids)
+            day_forecast = forecast_table.window(forecast_date, forecast_date + pd.Timedelta(hours=23))
+            version = ("table", forecast_table.generated_at)
+        else:
+            models = load_all_models(self.pickup_ids)
+            warnings += [f"Model file for Pickup ID {pickup_id} not found." for pickup_id in self.pickup_ids if pickup_id not in models]
+            day_forecast = forecast_grid(models, forecast_date)
+            hourly_demand = demand_at(day_forecast, forecast_datetime)
+            version = ("models", tuple(sorted(models)))
+
+        nowcast = None
+        booking_stream = get_booking_stream()
+        if booking_stream is not None and booking_stream.counters.latest is not None \
+                and forecast_datetime == booking_stream.counters.latest.floor("h"):
+            hourly_demand = {pickup_id: int(round(demand)) for pickup_id, demand in booking_stream.counters.nowcast(hourly_demand).items()}
+            day_forecast = day_forecast.copy()
+            for pickup_id, demand in hourly_demand.items():
+                day_forecast.loc[(forecast_datetime, pickup_id), "yhat"] = demand
+            nowcast = f"Nowcast from {booking_stream.counters.events} live bookings (last at {booking_stream.counters.latest:%H:%M})"
+            version = None
+        return hourly_demand, day_forecast, version, warnings, nowcast
+
+    def _plan(self, forecast_date, day_forecast, fleet_size, version):
+        key = (forecast_date, fleet_size, version)
+        with self._lock:
+            cached = self._plans.get(key) if version is not None else None
+        if cached is not None:
+            return cached
+        stop_matrix = get_stop_matrix()
+        distance = stop_matrix.submatrix(self.pickup_ids, DISTANCE)
+        demand = demand_matrix_from_forecast(day_forecast, self.pickup_ids, forecast_date)
+        plan, expected_wait, deadhead = plan_prepositioning(demand, stop_matrix.submatrix(self.pickup_ids, DURATION), distance, fleet_size)
+        result = (plan, expected_wait, deadhead, plan_moves(plan, self.pickup_ids, distance, forecast_date))
+        if version is not None:
+            with self._lock:
+                self._plans[key] = result
+        return result
+
+    # Predicted demand, shuttle positions, their parking spots and the day's relocations as plain JSON-ready data
+    @timed("engine_preposition")
+    def preposition(self, forecast_date, forecast_hour, fleet_size):
+        if not 0 <= forecast_hour <= 23 or fleet_size < 1:
+            raise EngineInputError("forecast_hour must be 0-23 and fleet_size at least 1")
+        forecast_date = pd.Timestamp(forecast_date).normalize()
+        hourly_demand, day_forecast, version, warnings, nowcast = self.forecast(forecast_date, forecast_hour)
+        demand = [{"pickup_id": int(pickup_id), "demand": demand,
+                   "lat": self.pickup_coordinates[pickup_id]["lat"], "lon": self.pickup_coordinates[pickup_id]["lon"]}
+                  for pickup_id, demand in hourly_demand.items()]
+        result = {"forecast_time": (forecast_date + pd.Timedelta(hours=forecast_hour)).isoformat(),
+                  "demand": demand, "warnings": warnings, "nowcast": nowcast}
+        if not demand:
+            return result
+
+        plan, expected_wait, deadhead, moves = self._plan(forecast_date, day_forecast, fleet_size, version)
+        positions = [{"shuttle": i + 1, "pickup_id": int(self.pickup_ids[stop]), **self.pickup_coordinates[self.pickup_ids[stop]]}
+                     for i, stop in enumerate(plan[forecast_hour])]
+
+        # Nearest parking lot to each shuttle position
+        all_parking_spots, failed_cities = self.find_parking_spots()
+        warnings += [f"Failed to fetch parking spots for {city}." for city in failed_cities]
+        parking = []
+        if all_parking_spots:
+            lots_index = parking_index(all_parking_spots)
+            nearest = lots_index.nearest_items([[p["lat"], p["lon"]] for p in positions], k=1)
+            parking = [{"name": row[0][0], "lat": row[0][1], "lon": row[0][2], "pickup_id": int(row[0][3])} for row in nearest]
+
+        moves = moves.assign(Hour=moves["Hour"].astype(str)) if len(moves) else moves
+        result.update({
+            "positions": positions,
+            "expected_wait": float(expected_wait[forecast_hour]),
+            "parking": parking,
+            "moves": moves.to_dict("records"),
+            "deadhead_km": float(deadhead.sum()),
+        })
+        return result
+
+    # ParkAPI lots around the pickup coordinates as (name, lat, lon, pickup_id), plus the cities that failed
+    @timed("find_parking_spots_around_coordinates")
+    def find_parking_spots(self):
+        return get_parking_fetcher().find_parking_spots(self.pickup_coordinates, self.city_id_map)
+
+    # Vehicles that may serve the bookings: names, positions and free seats, from the given {name: {lat, lon}}
+    # or the nearest vehicles with enough free seats in a snapshot of the live fleet
+    def _vehicles(self, pickups, passengers, shuttle_positions=None):
+        if shuttle_positions is not None:
+            names = list(shuttle_positions)
+            lat = np.array([shuttle_positions[name]["lat"] for name in names])
+            lon = np.array([shuttle_positions[name]["lon"] for name in names])
+            return names, lat, lon, np.full(len(names), np.inf)
+        snapshot = self.fleet.snapshot()
+        nearest, _ = snapshot.nearest(pickups, DISPATCH_CANDIDATES, min_free_seats=passengers)
+        candidates = np.unique(nearest[nearest >= 0])
+        return [snapshot.vehicle_ids[i] for i in candidates], snapshot.lat[candidates], snapshot.lon[candidates], \
+            (snapshot.seats - snapshot.occupancy)[candidates]
+
+    # Assign a batch of bookings ({"pickup": [lat, lon], "dropoff": [lat, lon], "passengers": n}) to shuttles at once
+    # Only the nearest vehicles with enough free seats are costed. One optimal matching per batch, bookings beyond the
+    # fleet get the cheapest shuttle that still has room after the earlier assignments, and bookings no vehicle can
+    # take get None
+    # Assignments from the live fleet are booked on it with an estimated route and ETA, unless book is False
+    @timed("engine_dispatch")
+    def dispatch(self, bookings, shuttle_positions=None, book=True):
+        pickups = np.array([booking["pickup"] for booking in bookings], dtype=np.float64).reshape(-1, 2)
+        dropoffs = np.array([booking["dropoff"] for booking in bookings], dtype=np.float64).reshape(-1, 2)
+        passengers = np.array([booking.get("passengers", 1) for booking in bookings])
+        names, lat, lon, free_seats = self._vehicles(pickups, passengers, shuttle_positions)
+        if not names:
+            return [None] * len(bookings)
+
+        cost = dispatch_cost_matrix(np.column_stack([lat, lon]), pickups, dropoffs, passengers)
+        full = free_seats[:, None] < passengers[None, :]
+        cost[full] = cost[~full].max() * 10 + 1 if (~full).any() else 1.0
+        assignment, _ = assign_requests(cost)
+
+        # Seats left per vehicle as the batch fills it: matched bookings first, then the rest in cost order
+        remaining = free_seats.astype(np.float64)
+        for i in np.nonzero(assignment >= 0)[0]:
+            if full[assignment[i], i]:
+                assignment[i] = -1
+            else:
+                remaining[assignment[i]] -= passengers[i]
+        for i in np.nonzero(assignment < 0)[0]:
+            for vehicle in np.argsort(cost[:, i], kind="stable"):
+                if remaining[vehicle] >= passengers[i]:
+                    assignment[i] = vehicle
+                    remaining[vehicle] -= passengers[i]
+                    break
+
+        results = []
+        for i, vehicle in enumerate(assignment):
+            if vehicle < 0:
+                results.append(None)
+                continue
+            result = {"shuttle": names[vehicle], "lat": float(lat[vehicle]), "lon": float(lon[vehicle]), "cost": float(cost[vehicle, i])}
+            if shuttle_positions is None and book:
+                # Straight legs shuttle -> pickup -> dropoff until a real route is recorded
+                _, to_pickup, _ = estimate_legs(lat[vehicle], lon[vehicle], pickups[i, 0], pickups[i, 1])
+                _, to_dropoff, _ = estimate_legs(pickups[i, 0], pickups[i, 1], dropoffs[i, 0], dropoffs[i, 1])
+                result["eta"] = time.time() + float(to_pickup + to_dropoff) * 60
+                route = [[result["lon"], result["lat"]], pickups[i, ::-1].tolist(), dropoffs[i, ::-1].tolist()]
+                result["booking_id"] = self.book(names[vehicle], int(passengers[i]), route, result["eta"])
+            results.append(result)
+        return results
+
+    # Shuttles for one booking ordered by estimated cost, without booking any of them
+    def rank(self, booking, shuttle_positions=None):
+        pickups = np.array([booking["pickup"]], dtype=np.float64)
+        passengers = np.array([booking.get("passengers", 1)])
+        names, lat, lon, free_seats = self._vehicles(pickups, passengers, shuttle_positions)
+        cost = dispatch_cost_matrix(np.column_stack([lat, lon]), pickups, [booking["dropoff"]], passengers)[:, 0]
+        return [{"shuttle": names[i], "lat": float(lat[i]), "lon": float(lon[i]), "cost": float(cost[i])}
+                for i in np.argsort(cost, kind="stable") if free_seats[i] >= passengers[0]]
+
+    # Book seats on a live fleet vehicle with its route ([lon, lat] coordinates) and ETA (epoch seconds), KeyError for unknown shuttles
+    # Returns the booking ID
+    def book(self, shuttle, passengers, route=None, eta=None):
+        return self.fleet.book(shuttle, passengers, route, eta)
+
+    # Free the seats of a booking made with book(), False when it already finished
+    def cancel_booking(self, booking_id):
+        return self.fleet.cancel(booking_id)
+
+    # Pre-aggregated GeoJSON grid of historical pickups or dropoffs (see map_layers.MapLayers.grid)
+    def map_grid(self, layer, hour=None, zoom=13):
+        return get_map_layers().grid(layer, hour, zoom)
+
+    # Route between two [lon, lat] points: (coordinates, km, minutes, grams CO₂), all None when no route was found
+    # The key is read per call, so one loaded from .env after this module was imported is still used
+    def route(self, start, end, profile="driving"):
+        return get_real_route_mapbox(os.getenv("MAPBOX_API_KEY"), start, end, profile)
+
+
+def get_engine():
+    global _shared_engine
+    with _shared_lock:
+        if _shared_engine is None:
+            _shared_engine = Engine()
+        return _shared_engine
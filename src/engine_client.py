@@ -0,0 +1,105 @@
+import os
+import requests
+
+# Base URL of a running service.py (e.g. http://localhost:8000); without it the engine runs inside the page process
+# The engine is only imported in that case, so thin clients never load models or matrices
+PATHFINDER_API_URL = os.getenv("PATHFINDER_API_URL")
+
+_session = requests.Session()
+
+
+# The service could not handle the request's input (HTTP 422), the message says why
+class EngineRequestError(Exception):
+    pass
+
+
+def _get(path, params):
+    response = _session.get(f"{PATHFINDER_API_URL}{path}", params=params, timeout=60)
+    if response.status_code == 422:
+        raise EngineRequestError(response.text)
+    response.raise_for_status()
+    return response.json()
+
+
+def _delete(path):
+    response = _session.delete(f"{PATHFINDER_API_URL}{path}", timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+def _post(path, body):
+    response = _session.post(f"{PATHFINDER_API_URL}{path}", json=body, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+# Predicted demand per pickup ID at one hour: {"demand": {pickup_id: bookings}, "warnings": [...], "nowcast": str or None}
+def forecast(forecast_date, forecast_hour):
+    if PATHFINDER_API_URL:
+        result = _get("/forecast", {"date": str(forecast_date), "hour": forecast_hour})
+        result["demand"] = {int(pickup_id): demand for pickup_id, demand in result["demand"].items()}
+        return result
+    from engine import get_engine
+    hourly_demand, _, _, warnings, nowcast = get_engine().forecast(forecast_date, forecast_hour)
+    return {"demand": hourly_demand, "warnings": warnings, "nowcast": nowcast}
+
+
+# Demand, shuttle positions, parking and relocations for one hour (see Engine.preposition)
+def preposition(forecast_date, forecast_hour, fleet_size):
+    if PATHFINDER_API_URL:
+        return _get("/preposition", {"date": str(forecast_date), "hour": forecast_hour, "fleet_size": fleet_size})
+    from engine import get_engine
+    return get_engine().preposition(forecast_date, forecast_hour, fleet_size)
+
+
+# Shuttle for one booking; pickup/dropoff are [lat, lon]
+def dispatch_booking(pickup, dropoff, passengers, shuttles=None):
+    booking = {"pickup": list(pickup), "dropoff": list(dropoff), "passengers": passengers}
+    if shuttles is not None:
+        booking["shuttles"] = shuttles
+    if PATHFINDER_API_URL:
+        return _post("/dispatch", booking)
+    from engine import get_engine
+    return get_engine().dispatch([booking], shuttles)[0]
+
+
+# Shuttles with enough free seats for one booking, cheapest first (nothing is booked)
+def rank_shuttles(pickup, dropoff, passengers):
+    booking = {"pickup": list(pickup), "dropoff": list(dropoff), "passengers": passengers}
+    if PATHFINDER_API_URL:
+        return _post("/rank", booking)
+    from engine import get_engine
+    return get_engine().rank(booking)
+
+
+# Book seats on a shuttle of the live fleet with its route ([lon, lat] coordinates) and ETA (epoch seconds), returns the booking ID
+def book_shuttle(shuttle, passengers, route=None, eta=None):
+    if PATHFINDER_API_URL:
+        return _post("/fleet/bookings", {"shuttle": shuttle, "passengers": passengers, "route": route, "eta": eta})["booking_id"]
+    from engine import get_engine
+    return get_engine().book(shuttle, passengers, route, eta)
+
+
+# Free the seats of a booking, False when it already finished
+def cancel_booking(booking_id):
+    if PATHFINDER_API_URL:
+        return _delete(f"/fleet/bookings/{booking_id}")["cancelled"]
+    from engine import get_engine
+    return get_engine().cancel_booking(booking_id)
+
+
+# GeoJSON grid of historical pickups or dropoffs for a zoom level and optional hour of day
+def map_grid(layer, hour=None, zoom=13):
+    if PATHFINDER_API_URL:
+        return _get(f"/layers/{layer}", {"zoom": zoom, **({"hour": hour} if hour is not None else {})})
+    from engine import get_engine
+    return get_engine().map_grid(layer, hour, zoom)
+
+
+# Route between two [lon, lat] points: (coordinates, km, minutes, grams CO₂)
+def route(start, end):
+    if PATHFINDER_API_URL:
+        result = _post("/route", {"start": list(start), "end": list(end)})
+        return result["coordinates"], result["distance"], result["duration"], result["co2_emission"]
+    from engine import get_engine
+    return get_engine().route(start, end)
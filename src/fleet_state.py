@@ -0,0 +1,306 @@
+import itertools
+import os
+import socketserver
+import threading
+import time
+import numpy as np
+import pandas as pd
+from geo import haversine_km
+from instrumentation import count
+
+# GPS pings to replay into the shared fleet state (CSV with vehicle_id, timestamp, lat, lon and optional occupancy)
+FLEET_PINGS_PATH = os.getenv("FLEET_PINGS_PATH")
+# TCP port accepting live pings as "vehicle_id,timestamp,lat,lon[,occupancy]" lines
+FLEET_PINGS_PORT = os.getenv("FLEET_PINGS_PORT")
+
+# Readers accept a snapshot this old (seconds) instead of publishing a new one, so reads stay lock-free under load
+SNAPSHOT_MAX_AGE = 0.05
+SEATS = 8
+
+# Where the shuttles start before the first ping arrives
+DEFAULT_POSITIONS = {
+    "Shuttle 1": {"lat": 49.014689777777775, "lon": 11.401692111111112},
+    "Shuttle 2": {"lat": 49.0354084, "lon": 11.469803200000001}
+}
+
+# Process-wide fleet, so positions survive Streamlit reruns and are shared with the engine
+_shared_fleet = None
+_shared_lock = threading.Lock()
+
+
+# Immutable copy of the fleet at one moment, what the dispatcher reads
+class FleetSnapshot:
+    def __init__(self, vehicle_ids, lat, lon, occupancy, seats, eta, updated, routes, version):
+        self.vehicle_ids = vehicle_ids
+        self.lat = lat
+        self.lon = lon
+        self.occupancy = occupancy
+        self.seats = seats
+        # Expected arrival at the current route's end (epoch seconds, NaN when idle) and time of the last ping
+        self.eta = eta
+        self.updated = updated
+        self.routes = routes
+        self.version = version
+        self.created = time.monotonic()
+
+    def __len__(self):
+        return len(self.vehicle_ids)
+
+    # {vehicle_id: {"lat", "lon"}}, the layout dispatch uses for shuttle positions
+    def positions(self):
+        return {vehicle_id: {"lat": float(lat), "lon": float(lon)} for vehicle_id, lat, lon in zip(self.vehicle_ids, self.lat, self.lon)}
+
+    # Indices of the k nearest vehicles to each point with at least min_free_seats free, shape [points x k]
+    # min_free_seats may differ per point; distances in km, rows are padded with -1/inf when fewer vehicles qualify
+    def nearest(self, points, k=1, min_free_seats=0):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        distances = haversine_km(points[:, 0, None], points[:, 1, None], self.lat[None, :], self.lon[None, :])
+        free_seats = self.seats - self.occupancy
+        distances[free_seats[None, :] < np.broadcast_to(np.asarray(min_free_seats), (len(points),))[:, None]] = np.inf
+        k = min(k, len(self))
+        if k == 0:
+            return np.zeros((len(points), 0), dtype=np.int64), np.zeros((len(points), 0))
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1)
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+        nearest[np.isinf(nearest_distances)] = -1
+        return nearest, nearest_distances
+
+
+# Positions, occupancy, route and ETA of every vehicle in NumPy arrays
+# Writers update the arrays under a lock; readers get the last published FleetSnapshot without locking
+class FleetState:
+    def __init__(self, positions=None, seats=SEATS):
+        self.default_seats = seats
+        self.vehicle_ids = []
+        self._index = {}
+        self._size = 0
+        capacity = max(len(positions or {}), 16)
+        self.lat = np.zeros(capacity)
+        self.lon = np.zeros(capacity)
+        self.occupancy = np.zeros(capacity, dtype=np.int16)
+        self.seats = np.zeros(capacity, dtype=np.int16)
+        self.eta = np.full(capacity, np.nan)
+        self.updated = np.full(capacity, -np.inf)
+        self.routes = {}
+        # Seats booked by dispatch as (eta, vehicle position, passengers, booking ID), released once the ETA has passed
+        # (bookings without an ETA are kept with an infinite one, until cancelled or replaced by reported occupancy)
+        self._bookings = []
+        self._booking_ids = itertools.count(1)
+        self._next_release = np.inf
+        self.updates = 0
+        self._version = 0
+        self._lock = threading.Lock()
+        for vehicle_id, position in (positions or {}).items():
+            self.update(vehicle_id, position["lat"], position["lon"], timestamp=-np.inf)
+        self._snapshot = self._publish()
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, size):
+        capacity = len(self.lat)
+        if size <= capacity:
+            return
+        grow = max(size, 2 * capacity) - capacity
+        self.lat = np.pad(self.lat, (0, grow))
+        self.lon = np.pad(self.lon, (0, grow))
+        self.occupancy = np.pad(self.occupancy, (0, grow))
+        self.seats = np.pad(self.seats, (0, grow))
+        self.eta = np.pad(self.eta, (0, grow), constant_values=np.nan)
+        self.updated = np.pad(self.updated, (0, grow), constant_values=-np.inf)
+
+    # Array positions of vehicle IDs, adding unknown vehicles (call with the lock held)
+    def _positions_of(self, vehicle_ids):
+        positions = np.empty(len(vehicle_ids), dtype=np.int64)
+        for i, vehicle_id in enumerate(vehicle_ids):
+            position = self._index.get(vehicle_id)
+            if position is None:
+                position = self._size
+                self._grow(position + 1)
+                self._index[vehicle_id] = position
+                self.vehicle_ids.append(vehicle_id)
+                self.seats[position] = self.default_seats
+                self._size += 1
+            positions[i] = position
+        return positions
+
+    # Array position of a known vehicle, only pings add vehicles (call with the lock held)
+    def _position(self, vehicle_id):
+        position = self._index.get(vehicle_id)
+        if position is None:
+            raise KeyError(f"Unknown vehicle {vehicle_id}")
+        return position
+
+    # Apply one GPS ping; pings older than the vehicle's last one are ignored
+    def update(self, vehicle_id, lat, lon, timestamp=None, occupancy=None):
+        self.update_many([vehicle_id], [lat], [lon], [time.time() if timestamp is None else timestamp],
+                         None if occupancy is None else [occupancy])
+
+    # Apply a batch of pings (ordered by time) with one lock acquisition and vectorized writes
+    def update_many(self, vehicle_ids, lats, lons, timestamps, occupancy=None):
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        with self._lock:
+            positions = self._positions_of(vehicle_ids)
+            fresh = timestamps >= self.updated[positions]
+            positions = positions[fresh]
+            self.lat[positions] = np.asarray(lats, dtype=np.float64)[fresh]
+            self.lon[positions] = np.asarray(lons, dtype=np.float64)[fresh]
+            self.updated[positions] = timestamps[fresh]
+            if occupancy is not None:
+                # Reported occupancy replaces the seats booked by dispatch
+                self.occupancy[positions] = np.asarray(occupancy, dtype=np.int16)[fresh]
+                self._drop_bookings(set(positions.tolist()))
+            self.updates += len(positions)
+            self._version += 1
+        count("fleet_pings", len(positions))
+
+    # Current route ([lon, lat] coordinates) and ETA (epoch seconds) of a vehicle, None clears them
+    def set_route(self, vehicle_id, route, eta=None):
+        with self._lock:
+            position = self._position(vehicle_id)
+            self.routes[vehicle_id] = route
+            self.eta[position] = np.nan if eta is None else eta
+            self._version += 1
+
+    # Book seats on a vehicle for a dispatched trip and record its route and ETA; the seats free up at the ETA
+    # Returns the booking ID to cancel it with
+    def book(self, vehicle_id, passengers, route=None, eta=None):
+        with self._lock:
+            position = self._position(vehicle_id)
+            booking_id = next(self._booking_ids)
+            self.occupancy[position] += passengers
+            self.routes[vehicle_id] = route
+            if eta is not None:
+                # With several trips booked the vehicle is busy until the last of them ends
+                self.eta[position] = eta if np.isnan(self.eta[position]) else max(self.eta[position], eta)
+                self._next_release = min(self._next_release, eta)
+            self._bookings.append((np.inf if eta is None else eta, position, passengers, booking_id))
+            self._version += 1
+        count("fleet_bookings")
+        return booking_id
+
+    # Free the seats of a pending booking, False when it already finished (or is unknown)
+    # The vehicle keeps the ETA of its latest remaining booking and loses its route when none remain
+    def cancel(self, booking_id):
+        with self._lock:
+            cancelled = [booking for booking in self._bookings if booking[3] == booking_id]
+            if not cancelled:
+                return False
+            _, position, passengers, _ = cancelled[0]
+            self._bookings = [booking for booking in self._bookings if booking[3] != booking_id]
+            self._next_release = min((booking[0] for booking in self._bookings), default=np.inf)
+            self.occupancy[position] = max(self.occupancy[position] - passengers, 0)
+            remaining = [booking[0] for booking in self._bookings if booking[1] == position]
+            etas = [eta for eta in remaining if np.isfinite(eta)]
+            self.eta[position] = max(etas) if etas else np.nan
+            if not remaining:
+                self.routes.pop(self.vehicle_ids[position], None)
+            self._version += 1
+        count("fleet_cancellations")
+        return True
+
+    # Forget pending bookings of the given vehicle positions (call with the lock held)
+    def _drop_bookings(self, positions):
+        self._bookings = [booking for booking in self._bookings if booking[1] not in positions]
+        self._next_release = min((booking[0] for booking in self._bookings), default=np.inf)
+
+    # Free the seats of bookings whose ETA has passed and clear the finished routes (call with the lock held)
+    def _release(self, now):
+        if now < self._next_release:
+            return
+        finished = [booking for booking in self._bookings if booking[0] <= now]
+        for eta, position, passengers, _ in finished:
+            self.occupancy[position] = max(self.occupancy[position] - passengers, 0)
+            if self.eta[position] == eta:
+                self.eta[position] = np.nan
+                self.routes.pop(self.vehicle_ids[position], None)
+        self._bookings = [booking for booking in self._bookings if booking[0] > now]
+        self._next_release = min((booking[0] for booking in self._bookings), default=np.inf)
+        self._version += 1
+
+    def _publish(self):
+        with self._lock:
+            self._release(time.time())
+            n = self._size
+            snapshot = FleetSnapshot(
+                list(self.vehicle_ids), self.lat[:n].copy(), self.lon[:n].copy(), self.occupancy[:n].copy(),
+                self.seats[:n].copy(), self.eta[:n].copy(), self.updated[:n].copy(), dict(self.routes), self._version,
+            )
+        self._snapshot = snapshot
+        return snapshot
+
+    # Consistent view of the fleet; the published snapshot is returned as is while it is current or younger than max_age
+    def snapshot(self, max_age=SNAPSHOT_MAX_AGE):
+        snapshot = self._snapshot
+        if (snapshot.version == self._version or time.monotonic() - snapshot.created < max_age) and time.time() < self._next_release:
+            return snapshot
+        return self._publish()
+
+
+# GPS pings from a CSV file, timestamps converted to epoch seconds and rows ordered by time
+def read_pings(path):
+    pings = pd.read_csv(path)
+    pings["timestamp"] = pd.to_datetime(pings["timestamp"]).astype("int64") / 1e9
+    return pings.sort_values("timestamp", kind="stable").reset_index(drop=True)
+
+
+# Feed pings into the fleet in chunks; with speed set, chunks are spaced like the original timestamps (speed x faster)
+def replay(fleet, pings, speed=None, chunk_size=1000, stop_event=None):
+    has_occupancy = "occupancy" in pings.columns
+    started = time.monotonic()
+    first = pings["timestamp"].iloc[0] if len(pings) else 0.0
+    for begin in range(0, len(pings), chunk_size):
+        if stop_event is not None and stop_event.is_set():
+            return
+        chunk = pings.iloc[begin:begin + chunk_size]
+        if speed:
+            delay = (chunk["timestamp"].iloc[0] - first) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        fleet.update_many(chunk["vehicle_id"].astype(str).tolist(), chunk["lat"].to_numpy(), chunk["lon"].to_numpy(),
+                          chunk["timestamp"].to_numpy(), chunk["occupancy"].to_numpy() if has_occupancy else None)
+
+
+# TCP server applying "vehicle_id,timestamp,lat,lon[,occupancy]" lines (timestamp in epoch seconds or ISO format)
+# Returns None when another process already listens on the port, that process then owns the live pings
+def serve_pings(fleet, port, host="0.0.0.0"):
+    class PingHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                fields = line.decode().strip().split(",")
+                if len(fields) < 4:
+                    continue
+                try:
+                    try:
+                        timestamp = float(fields[1])
+                    except ValueError:
+                        timestamp = pd.Timestamp(fields[1]).value / 1e9
+                    fleet.update(fields[0], float(fields[2]), float(fields[3]), timestamp,
+                                 int(fields[4]) if len(fields) > 4 and fields[4] else None)
+                except ValueError:
+                    count("fleet_ping_errors")
+
+    try:
+        server = socketserver.ThreadingTCPServer((host, int(port)), PingHandler)
+    except OSError as e:
+        print(f"Fleet pings not received on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Shared fleet seeded with DEFAULT_POSITIONS, fed from FLEET_PINGS_PATH and/or FLEET_PINGS_PORT when configured
+def get_fleet_state():
+    global _shared_fleet
+    with _shared_lock:
+        if _shared_fleet is None:
+            _shared_fleet = FleetState(DEFAULT_POSITIONS)
+            if FLEET_PINGS_PATH:
+                threading.Thread(target=replay, args=(_shared_fleet, read_pings(FLEET_PINGS_PATH), 1.0), daemon=True).start()
+            if FLEET_PINGS_PORT:
+                serve_pings(_shared_fleet, FLEET_PINGS_PORT)
+        return _shared_fleet
@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+import pandas as pd
+from instrumentation import count, timed
+
+# Forecast grids already computed in this server process, keyed by (pickup IDs and model objects, start, days)
+# Reloaded or retrained models are new objects, so their grids are computed afresh; least recently used grids go first
+GRID_CACHE_SIZE = 64
+_grid_cache = OrderedDict()
+_grid_lock = threading.Lock()
+
+
+# Hourly timestamps covering whole days starting at the given date
+def hourly_timestamps(start_date, days=1):
+    return pd.date_range(start=pd.Timestamp(start_date).normalize(), periods=24 * days, freq="h")
+
+
+# Forecast every model over every timestamp with a single predict call per model
+# Returns a tidy DataFrame with columns Pickup ID, ds, yhat, yhat_lower, yhat_upper
+@timed()
+def predict_demand_batch(models, timestamps):
+    future = pd.DataFrame({"ds": pd.to_datetime(pd.Series(timestamps))})
+    future["Weekday"] = future["ds"].dt.dayofweek
+
+    frames = []
+    for pickup_id, model in models.items():
+        if model is None:
+            continue
+        forecast = model.predict(future)[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+        forecast.insert(0, "Pickup ID", pickup_id)
+        frames.append(forecast)
+    if not frames:
+        return pd.DataFrame(columns=["Pickup ID", "ds", "yhat", "yhat_lower", "yhat_upper"])
+    return pd.concat(frames, ignore_index=True)
+
+
+# Forecast grid (all pickup IDs x all hours of the given days), computed once and then served from memory
+def forecast_grid(models, start_date, days=1):
+    key = (tuple(sorted((pickup_id, id(model)) for pickup_id, model in models.items() if model is not None)),
+           pd.Timestamp(start_date).normalize(), days)
+    with _grid_lock:
+        cached = _grid_cache.get(key)
+        if cached is not None:
+            _grid_cache.move_to_end(key)
+    if cached is not None:
+        count("forecast_grid_hits")
+        return cached[0]
+    count("forecast_grid_misses")
+    grid = predict_demand_batch(models, hourly_timestamps(start_date, days)).set_index(["ds", "Pickup ID"]).sort_index()
+    with _grid_lock:
+        # The models are kept with their grid so their ids cannot be reused by other objects while it is cached
+        _grid_cache[key] = (grid, dict(models))
+        while len(_grid_cache) > GRID_CACHE_SIZE:
+            _grid_cache.popitem(last=False)
+    return grid
+
+
+def clear_forecast_cache():
+    with _grid_lock:
+        _grid_cache.clear()
+
+
+# Rounded predicted demand for every pickup ID at one hour of a forecast grid
+def demand_at(grid, forecast_time):
+    rows = grid.xs(pd.Timestamp(forecast_time).floor("h"), level="ds")
+    return rows["yhat"].round().astype(int).to_dict()
+
+
+# Rounded predicted demand for one pickup ID at one hour of a forecast grid
+def lookup_demand(grid, pickup_id, forecast_time):
+    return int(round(grid.loc[(pd.Timestamp(forecast_time).floor("h"), pickup_id), "yhat"]))
+
+
+# Prediction function for a single model and time, kept for existing callers
+@timed()
+def predict_demand(model, forecast_time):
+    forecast = predict_demand_batch({None: model}, [forecast_time])
+    return int(round(forecast["yhat"].values[0]))
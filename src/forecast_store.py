@@ -0,0 +1,71 @@
+import os
+import time
+import pandas as pd
+
+# Precomputed forecasts written by models/refresh_forecasts.py, served without importing Prophet
+FORECAST_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models", "forecast_table.parquet")
+
+# Loaded tables keyed by path, reloaded when the file changes on disk
+_table_cache = {}
+
+
+# Write the forecasts of forecast_for_multiple_locations ({pickup_id: DataFrame}) as one columnar table
+def write_forecast_table(forecasts, path=FORECAST_TABLE_PATH):
+    frames = []
+    for pickup_id, forecast in forecasts.items():
+        frame = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].copy()
+        frame.insert(0, "Pickup ID", pickup_id)
+        frames.append(frame)
+    table = pd.concat(frames, ignore_index=True)
+    table["Pickup ID"] = table["Pickup ID"].astype("int32")
+    table["ds"] = pd.to_datetime(table["ds"])
+    table[["yhat", "yhat_lower", "yhat_upper"]] = table[["yhat", "yhat_lower", "yhat_upper"]].astype("float32")
+    table = table.sort_values(["ds", "Pickup ID"]).reset_index(drop=True)
+
+    # Write to a temporary file first so readers never see a half-written table
+    tmp_path = f"{path}.tmp"
+    table.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return table
+
+
+class ForecastTable:
+    def __init__(self, table, generated_at):
+        self.generated_at = generated_at
+        self.table = table.set_index(["ds", "Pickup ID"]).sort_index()
+        self.start = table["ds"].min()
+        self.end = table["ds"].max()
+        self.pickup_ids = sorted(table["Pickup ID"].unique().tolist())
+
+    # True when the forecast horizon contains the hour of forecast_time
+    def covers(self, forecast_time):
+        return self.start <= pd.Timestamp(forecast_time).floor("h") <= self.end
+
+    def age_seconds(self):
+        return time.time() - self.generated_at
+
+    # Rounded predicted demand for every pickup ID at one hour
+    def demand_at(self, forecast_time, pickup_ids=None):
+        rows = self.table.xs(pd.Timestamp(forecast_time).floor("h"), level="ds")
+        if pickup_ids is not None:
+            rows = rows[rows.index.isin(pickup_ids)]
+        return rows["yhat"].round().astype(int).to_dict()
+
+    # Rounded predicted demand for one pickup ID at one hour
+    def lookup(self, pickup_id, forecast_time):
+        return int(round(self.table.loc[(pd.Timestamp(forecast_time).floor("h"), pickup_id), "yhat"]))
+
+    # Full forecast (yhat, yhat_lower, yhat_upper) for a time window, all pickup IDs
+    def window(self, start, end):
+        return self.table.loc[pd.Timestamp(start):pd.Timestamp(end)]
+
+
+# Load the forecast table, returns None when no table has been generated yet
+def load_forecast_table(path=FORECAST_TABLE_PATH):
+    if not os.path.exists(path):
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _table_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        _table_cache[path] = (mtime, ForecastTable(pd.read_parquet(path), generated_at=mtime))
+    return _table_cache[path][1]
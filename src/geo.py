@@ -0,0 +1,25 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Rough conversion from straight-line distance to road distance in the rural service area
+ROAD_FACTOR = 1.3
+# Average shuttle speed used for duration estimates (km/h)
+AVERAGE_SPEED_KMH = 40.0
+# Estimated CO₂ emissions per km, same figure as the Mapbox route estimate (grams per km)
+CO2_GRAMS_PER_KM = 120.0
+
+
+# Vectorized great-circle distance in km, works on scalars or broadcastable arrays
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+# Estimate road distance (km), duration (minutes) and CO₂ (grams) between coordinates without a routing API
+def estimate_legs(lat1, lon1, lat2, lon2):
+    distance = haversine_km(lat1, lon1, lat2, lon2) * ROAD_FACTOR
+    duration = distance / AVERAGE_SPEED_KMH * 60
+    co2_emission = distance * CO2_GRAMS_PER_KM
+    return distance, duration, co2_emission
@@ -0,0 +1,210 @@
+import atexit
+import cProfile
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Where metrics go: a file rewritten every METRICS_INTERVAL seconds and/or a Prometheus text endpoint on a port
+# With neither set, instrumentation is disabled and spans/counters cost one flag check
+METRICS_PATH = os.getenv("METRICS_PATH")
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "10"))
+# Directory for cProfile dumps of profiled requests, profiling is off when unset
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+_enabled = bool(METRICS_PATH or METRICS_PORT)
+# Span name -> [count, total seconds, max seconds], counter name -> value
+_spans = {}
+_counters = {}
+_lock = threading.Lock()
+_started = False
+_local = threading.local()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+
+def record(name, seconds):
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            _spans[name] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+
+
+# Increment a counter, e.g. cache hits or external API calls
+def count(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# Time a block: `with span("name"):`; the shared no-op span is returned while disabled
+def span(name):
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+# Decorator form of span, named after the function unless a name is given
+def timed(name=None):
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(span_name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# Capture a cProfile dump of one request (e.g. one page run) into PROFILE_DIR/<name>-<timestamp>.prof
+# Nested or concurrent profiles in the same thread are skipped, cProfile allows only one at a time
+@contextmanager
+def profiled(name, profile_dir=None):
+    profile_dir = profile_dir or PROFILE_DIR
+    if not profile_dir or getattr(_local, "profiling", False):
+        yield
+        return
+    _local.profiling = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _local.profiling = False
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof"))
+
+
+def snapshot():
+    with _lock:
+        return {"spans": {name: list(stats) for name, stats in _spans.items()}, "counters": dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+# Prometheus text exposition format
+def render_prometheus():
+    data = snapshot()
+    lines = [
+        "# HELP pathfinder_span_seconds Time spent in instrumented code paths",
+        "# TYPE pathfinder_span_seconds summary",
+    ]
+    for name, (calls, total, _) in sorted(data["spans"].items()):
+        lines.append(f'pathfinder_span_seconds_count{{span="{name}"}} {calls}')
+        lines.append(f'pathfinder_span_seconds_sum{{span="{name}"}} {total:.6f}')
+    lines += ["# HELP pathfinder_span_max_seconds Slowest call per code path", "# TYPE pathfinder_span_max_seconds gauge"]
+    for name, (_, _, slowest) in sorted(data["spans"].items()):
+        lines.append(f'pathfinder_span_max_seconds{{span="{name}"}} {slowest:.6f}')
+    lines += ["# HELP pathfinder_events_total Cache hits, misses and external calls", "# TYPE pathfinder_events_total counter"]
+    for name, value in sorted(data["counters"].items()):
+        lines.append(f'pathfinder_events_total{{event="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+# Writes to a temporary file of this process first, so concurrent writers never share or half-read a file
+def write_metrics(path=None):
+    path = path or METRICS_PATH
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# A failed write (full disk, removed directory) is reported and retried on the next interval
+def _flush_forever(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_metrics(path)
+        except Exception as e:
+            print(f"Metrics not written to {path}: {e}")
+
+
+# Metrics file of one worker when several processes export at once: metrics.prom -> metrics.<pid>.prom
+def process_metrics_path(path):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+# Start the file writer and/or the /metrics endpoint once per process, called by the app and service entry points
+# Only one process can own the port; the others keep collecting and report the bind failure instead of crashing
+def start_exporters(path=METRICS_PATH, port=METRICS_PORT, interval=METRICS_INTERVAL):
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    if path:
+        threading.Thread(target=_flush_forever, args=(path, interval), daemon=True).start()
+        atexit.register(write_metrics, path)
+    if port:
+        try:
+            server = ThreadingHTTPServer(("", int(port)), _MetricsHandler)
+        except OSError as e:
+            print(f"Metrics endpoint not started on port {port}: {e}")
+            return
+        threading.Thread(target=server.serve_forever, daemon=True).start()
@@ -0,0 +1,230 @@
+import heapq
+import json
+import math
+import os
+import numpy as np
+from geo import CO2_GRAMS_PER_KM, EARTH_RADIUS_KM, haversine_km
+from spatial_index import SpatialIndex
+
+ROAD_GRAPH_PATH = os.getenv(
+    "ROAD_GRAPH_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets", "road_graph.npz")
+)
+# Speed assumed for roads without a usable maxspeed tag (km/h)
+DEFAULT_SPEED_KMH = 50.0
+
+# Loaded routers keyed by graph path, shared by every page in the process
+_routers = {}
+
+
+# Road graph in CSR form: the outgoing edges of node i are indices[indptr[i]:indptr[i + 1]]
+class RoadGraph:
+    def __init__(self, node_lat, node_lon, indptr, indices, length_km, duration_min):
+        self.node_lat = np.asarray(node_lat, dtype=np.float64)
+        self.node_lon = np.asarray(node_lon, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.length_km = np.asarray(length_km, dtype=np.float32)
+        self.duration_min = np.asarray(duration_min, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.node_lat)
+
+    # Build from node coordinates and directed edges (u, v, length_km, duration_min)
+    @classmethod
+    def from_edges(cls, node_lat, node_lon, edges_u, edges_v, length_km, duration_min):
+        edges_u = np.asarray(edges_u, dtype=np.int64)
+        order = np.argsort(edges_u, kind="stable")
+        counts = np.bincount(edges_u, minlength=len(node_lat))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        return cls(node_lat, node_lon, indptr, np.asarray(edges_v)[order],
+                   np.asarray(length_km)[order], np.asarray(duration_min)[order])
+
+    # Build from a GeoJSON FeatureCollection of road LineStrings (e.g. an OpenStreetMap export of the service area)
+    # Optional properties: "maxspeed" (km/h) and "oneway" ("yes"/true)
+    @classmethod
+    def from_geojson(cls, path):
+        with open(path) as f:
+            features = json.load(f)["features"]
+
+        node_ids, node_lat, node_lon = {}, [], []
+        edges_u, edges_v, speeds = [], [], []
+
+        def node(coord):
+            key = (round(coord[0], 7), round(coord[1], 7))
+            if key not in node_ids:
+                node_ids[key] = len(node_lat)
+                node_lon.append(coord[0])
+                node_lat.append(coord[1])
+            return node_ids[key]
+
+        for feature in features:
+            geometry = feature.get("geometry") or {}
+            if geometry.get("type") != "LineString":
+                continue
+            properties = feature.get("properties") or {}
+            try:
+                speed = float(str(properties.get("maxspeed", DEFAULT_SPEED_KMH)).split()[0])
+            except ValueError:
+                speed = DEFAULT_SPEED_KMH
+            oneway = properties.get("oneway") in ("yes", True, "true", "1")
+            points = [node(coord) for coord in geometry["coordinates"]]
+            for u, v in zip(points[:-1], points[1:]):
+                edges_u.append(u)
+                edges_v.append(v)
+                speeds.append(speed)
+                if not oneway:
+                    edges_u.append(v)
+                    edges_v.append(u)
+                    speeds.append(speed)
+
+        node_lat, node_lon = np.array(node_lat), np.array(node_lon)
+        edges_u, edges_v, speeds = np.array(edges_u), np.array(edges_v), np.array(speeds)
+        length_km = haversine_km(node_lat[edges_u], node_lon[edges_u], node_lat[edges_v], node_lon[edges_v])
+        duration_min = length_km / speeds * 60
+        return cls.from_edges(node_lat, node_lon, edges_u, edges_v, length_km, duration_min)
+
+    def save(self, path=ROAD_GRAPH_PATH):
+        np.savez(path, node_lat=self.node_lat, node_lon=self.node_lon, indptr=self.indptr, indices=self.indices,
+                 length_km=self.length_km, duration_min=self.duration_min)
+
+    @classmethod
+    def load(cls, path=ROAD_GRAPH_PATH):
+        data = np.load(path)
+        return cls(data["node_lat"], data["node_lon"], data["indptr"], data["indices"], data["length_km"], data["duration_min"])
+
+
+# Vectorized even-odd test of points against a GeoJSON Polygon or MultiPolygon (coordinates in lon, lat)
+def points_in_polygon(lon, lat, polygon):
+    polygons = polygon["coordinates"] if polygon["type"] == "MultiPolygon" else [polygon["coordinates"]]
+    inside = np.zeros(len(lon), dtype=bool)
+    for rings in polygons:
+        in_this = np.zeros(len(lon), dtype=bool)
+        # Holes flip the result back, so every ring is handled the same way
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)
+            x1, y1 = ring[:-1, 0], ring[:-1, 1]
+            x2, y2 = ring[1:, 0], ring[1:, 1]
+            for a, b, c, d in zip(x1, y1, x2, y2):
+                crosses = (b > lat) != (d > lat)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    x_cross = a + (lat - b) * (c - a) / (d - b)
+                in_this ^= crosses & (lon < x_cross)
+        inside |= in_this
+    return inside
+
+
+# Offline shortest-path routing (A* on travel time) with the same return values as get_real_route_mapbox
+class LocalRouter:
+    def __init__(self, graph):
+        self.graph = graph
+        self.node_index = SpatialIndex(np.column_stack([graph.node_lat, graph.node_lon]))
+        # Fastest edge speed (km per minute) keeps the straight-line heuristic admissible
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speeds = graph.length_km / graph.duration_min
+        self.max_speed = float(np.nanmax(speeds[np.isfinite(speeds)])) if len(speeds) else 1.0
+        self._indptr = graph.indptr.tolist()
+        self._indices = graph.indices.tolist()
+        self._duration = graph.duration_min.astype(np.float64).tolist()
+        self._node_lat = graph.node_lat.tolist()
+        self._node_lon = graph.node_lon.tolist()
+        self._blocked_cache = {}
+
+    @classmethod
+    def load(cls, path=ROAD_GRAPH_PATH):
+        return cls(RoadGraph.load(path))
+
+    def _blocked(self, avoid_polygons):
+        if not avoid_polygons:
+            return None
+        key = json.dumps(avoid_polygons, sort_keys=True)
+        if key not in self._blocked_cache:
+            self._blocked_cache[key] = points_in_polygon(self.graph.node_lon, self.graph.node_lat, avoid_polygons).tolist()
+        return self._blocked_cache[key]
+
+    # Nodes and edges of the fastest path between two graph nodes, or None when they are not connected
+    def shortest_path(self, source, target, blocked=None):
+        node_lat, node_lon = self._node_lat, self._node_lon
+        target_lat, target_lon = math.radians(node_lat[target]), math.radians(node_lon[target])
+        cos_target = math.cos(target_lat)
+        scale = 2 * EARTH_RADIUS_KM / self.max_speed
+
+        # Straight-line travel time to the target at the fastest edge speed, computed only for visited nodes
+        def heuristic(node):
+            lat, lon = math.radians(node_lat[node]), math.radians(node_lon[node])
+            a = math.sin((target_lat - lat) / 2) ** 2 + math.cos(lat) * cos_target * math.sin((target_lon - lon) / 2) ** 2
+            return scale * math.asin(math.sqrt(min(1.0, a)))
+
+        indptr, indices, duration = self._indptr, self._indices, self._duration
+        best = {source: 0.0}
+        previous = {}
+        queue = [(heuristic(source), 0.0, source)]
+        while queue:
+            _, cost, node = heapq.heappop(queue)
+            if node == target:
+                nodes, edges = [node], []
+                while node in previous:
+                    node, edge = previous[node]
+                    nodes.append(node)
+                    edges.append(edge)
+                return nodes[::-1], edges[::-1]
+            if cost > best[node]:
+                continue
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[edge]
+                if blocked is not None and blocked[neighbour]:
+                    continue
+                new_cost = cost + duration[edge]
+                if new_cost < best.get(neighbour, float("inf")):
+                    best[neighbour] = new_cost
+                    previous[neighbour] = (node, edge)
+                    heapq.heappush(queue, (new_cost + heuristic(neighbour), new_cost, neighbour))
+        return None
+
+    # Route between [lon, lat] points: (coordinates as [lon, lat], distance km, duration minutes, CO₂ grams)
+    def route(self, start, end, avoid_polygons=None):
+        _, nodes = self.node_index.nearest([[start[1], start[0]], [end[1], end[0]]], k=1)
+        path = self.shortest_path(int(nodes[0, 0]), int(nodes[1, 0]), self._blocked(avoid_polygons))
+        if path is None:
+            return None, None, None, None
+
+        nodes, edges = path
+        distance = float(self.graph.length_km[edges].sum()) if edges else 0.0
+        duration = float(self.graph.duration_min[edges].sum()) if edges else 0.0
+        route = [[self._node_lon[node], self._node_lat[node]] for node in nodes]
+        return route, distance, duration, distance * CO2_GRAMS_PER_KM
+
+    # Drop-in for BatchRouter.route_coords_batch: (lon, lat) pairs in, lists of (lat, lon) points and errors by pair index out
+    def route_coords_batch(self, pairs, avoid_polygons=None):
+        routes, errors = [], {}
+        for i, (origin, destination) in enumerate(pairs):
+            route = self.route(origin, destination, avoid_polygons)[0]
+            if route is None:
+                errors[i] = ValueError("No route found in the local road graph")
+                routes.append(None)
+            else:
+                routes.append([(lat, lon) for lon, lat in route])
+        return routes, errors
+
+
+# Process-wide router for a graph file, loaded on first use
+def get_local_router(path=ROAD_GRAPH_PATH):
+    if path not in _routers:
+        _routers[path] = LocalRouter.load(path)
+    return _routers[path]
+
+
+# True when the pages should route on the local graph instead of the remote APIs (ROUTING_BACKEND=local)
+def use_local_routing():
+    return os.getenv("ROUTING_BACKEND", "").lower() == "local"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a GeoJSON road export into the local routing graph")
+    parser.add_argument("geojson")
+    parser.add_argument("--out", default=ROAD_GRAPH_PATH)
+    args = parser.parse_args()
+    graph = RoadGraph.from_geojson(args.geojson)
+    graph.save(args.out)
+    print(f"Road graph with {len(graph)} nodes and {len(graph.indices)} edges saved to {args.out}")
@@ -1,19 +1,13 @@
-import pandas as pd
+from trip_store import load_trips
 
-# Load the datasets 
-trip_data = pd.read_excel('./data/FLEXI_trip_data.xlsx')  
-bus_stops = pd.read_excel('./data/FLEXI_bus_stops.xlsx')  
+# Load the trips with pickup and dropoff coordinates already joined (built once from the Excel sheets)
+merged_data = load_trips(columns=['Booking ID', 'Pickup ID', 'Dropoff ID',
+                                  'Actual Pickup Time', 'Actual Dropoff Time',
+                                  'Pickup Latitude', 'Pickup Longitude', 'Dropoff Latitude', 'Dropoff Longitude',
+                                  'Pickup Name', 'Pickup District', 'Passenger status'])
 
-# Merge data to get pickup and dropoff coordinates
-merged_data = trip_data.merge(bus_stops, left_on='Pickup ID', right_on='index', suffixes=('', '_pickup'))
-merged_data = merged_data.merge(bus_stops, left_on='Dropoff ID', right_on='index', suffixes=('', '_dropoff'))
-
-# Drop extra index columns to avoid exposing unnecessary data
-merged_data = merged_data.drop(columns=['index', 'index_dropoff'])
-
-# Convert time columns to datetime
-merged_data['Actual Pickup Time'] = pd.to_datetime(merged_data['Actual Pickup Time'])
-merged_data['Actual Dropoff Time'] = pd.to_datetime(merged_data['Actual Dropoff Time'])
+# Keep only trips whose pickup and dropoff stops are known
+merged_data = merged_data.dropna(subset=['Pickup Latitude', 'Dropoff Latitude'])
 
 # Calculate trip duration in minutes
 merged_data['Trip Duration (minutes)'] = (merged_data['Actual Dropoff Time'] - merged_data['Actual Pickup Time']).dt.total_seconds() / 60
@@ -21,14 +15,13 @@ merged_data['Trip Duration (minutes)'] = (merged_data['Actual Dropoff Time'] - m
 # columns selection for heatmap visualization
 heatmap_data = merged_data[['Booking ID', 'Pickup ID', 'Dropoff ID',
                             'Actual Pickup Time', 'Actual Dropoff Time',
-                            'latitude', 'longitude', 'latitude_dropoff', 'longitude_dropoff', "name", "district", "Passenger status"]]
+                            'Pickup Latitude', 'Pickup Longitude', 'Dropoff Latitude', 'Dropoff Longitude',
+                            'Pickup Name', 'Pickup District', 'Passenger status']]
 
 # Rename columns for clarity
 heatmap_data = heatmap_data.rename(columns={
-    'latitude': 'Pickup Latitude',
-    'longitude': 'Pickup Longitude',
-    'latitude_dropoff': 'Dropoff Latitude',
-    'longitude_dropoff': 'Dropoff Longitude'
+    'Pickup Name': 'name',
+    'Pickup District': 'district'
 })
 
 # Filter the data based on Pickup and Dropoff IDs
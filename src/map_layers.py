@@ -0,0 +1,201 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from instrumentation import count, span
+
+# Web Mercator tiles as used by Leaflet/folium
+TILE_SIZE = 256
+# Zoom levels served by the map layers (Leaflet's usual range)
+MIN_ZOOM, MAX_ZOOM = 0, 20
+# Width of one aggregation cell on screen, so the number of cells depends on the map view and not on trip volume
+CELL_PIXELS = 24
+# Route vertices closer than this to the simplified line are dropped (screen pixels at the layer's zoom)
+SIMPLIFY_PIXELS = 1.0
+# Grids kept per MapLayers, least recently used go first (a grid at high zoom can hold tens of thousands of cells)
+LAYER_CACHE_SIZE = 64
+
+# Process-wide layers built from the trip store, reloaded when trips.parquet changes
+_shared_layers = None
+_shared_lock = threading.Lock()
+
+
+# Latitude/longitude to global pixel coordinates at a zoom level
+def to_pixels(lat, lon, zoom):
+    scale = TILE_SIZE * 2.0 ** zoom
+    sin_lat = np.clip(np.sin(np.radians(np.asarray(lat, dtype=np.float64))), -0.9999, 0.9999)
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+    return x, y
+
+
+def from_pixels(x, y, zoom):
+    scale = TILE_SIZE * 2.0 ** zoom
+    lon = np.asarray(x, dtype=np.float64) / scale * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(y, dtype=np.float64) / scale))))
+    return lat, lon
+
+
+# Counts per screen-aligned grid cell: cell columns, cell rows and counts of the non-empty cells
+def grid_counts(lat, lon, zoom, cell_pixels=CELL_PIXELS):
+    x, y = to_pixels(lat, lon, zoom)
+    # One integer key per cell, much faster to count than unique rows
+    rows = int(np.ceil(TILE_SIZE * 2.0 ** zoom / cell_pixels))
+    keys = np.floor(x / cell_pixels).astype(np.int64) * rows + np.floor(y / cell_pixels).astype(np.int64)
+    unique, counts = np.unique(keys, return_counts=True)
+    return unique // rows, unique % rows, counts
+
+
+# GeoJSON squares for grid cells, with the count of each cell as a property
+def grid_geojson(cell_x, cell_y, counts, zoom, cell_pixels=CELL_PIXELS):
+    north, west = from_pixels(cell_x * cell_pixels, cell_y * cell_pixels, zoom)
+    south, east = from_pixels((cell_x + 1) * cell_pixels, (cell_y + 1) * cell_pixels, zoom)
+    features = []
+    for n, w, s, e, cell_count in zip(np.round(north, 5), np.round(west, 5), np.round(south, 5), np.round(east, 5), counts):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [[[w, n], [e, n], [e, s], [w, s], [w, n]]]},
+            "properties": {"count": int(cell_count)},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+# Douglas–Peucker simplification of a polyline given as an [n x 2] array, returns the indices of the kept vertices
+def douglas_peucker(points, tolerance):
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) < 3:
+        return np.arange(len(points))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        # Perpendicular distance of every inner vertex to the chord, all at once
+        start, end = points[first], points[last]
+        inner = points[first + 1:last]
+        chord = end - start
+        length = np.hypot(chord[0], chord[1])
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - start[0], inner[:, 1] - start[1])
+        else:
+            distances = np.abs(chord[0] * (inner[:, 1] - start[1]) - chord[1] * (inner[:, 0] - start[0])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return np.nonzero(keep)[0]
+
+
+# Simplify a route of (lat, lon) points for display at a zoom level
+def simplify_route(route, zoom, tolerance_pixels=SIMPLIFY_PIXELS):
+    route = np.asarray(route, dtype=np.float64).reshape(-1, 2)
+    x, y = to_pixels(route[:, 0], route[:, 1], zoom)
+    return route[douglas_peucker(np.column_stack([x, y]), tolerance_pixels)]
+
+
+# One GeoJSON layer for many routes ((lat, lon) lists), simplified for the zoom level; None routes are skipped
+def routes_geojson(routes, zoom, properties=None):
+    features = []
+    for i, route in enumerate(routes):
+        if route is None or len(route) < 2:
+            continue
+        simplified = np.round(simplify_route(route, zoom), 5)
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString", "coordinates": simplified[:, ::-1].tolist()},
+            "properties": properties[i] if properties is not None else {},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+# One GeoJSON layer for many points, instead of a folium Marker per point
+def points_geojson(latitudes, longitudes, properties=None):
+    features = []
+    for i, (lat, lon) in enumerate(zip(latitudes, longitudes)):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(float(lon), 6), round(float(lat), 6)]},
+            "properties": properties[i] if properties is not None else {},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+# Pickup and dropoff density layers per (layer, hour, zoom), aggregated once and then served from memory
+class MapLayers:
+    def __init__(self, trips, cell_pixels=CELL_PIXELS):
+        self.cell_pixels = cell_pixels
+        self.points = {}
+        for layer, prefix, time_column in [("pickups", "Pickup", "Actual Pickup Time"), ("dropoffs", "Dropoff", "Actual Dropoff Time")]:
+            located = trips.dropna(subset=[f"{prefix} Latitude", f"{prefix} Longitude", time_column])
+            self.points[layer] = (
+                located[f"{prefix} Latitude"].to_numpy(dtype=np.float64),
+                located[f"{prefix} Longitude"].to_numpy(dtype=np.float64),
+                located[time_column].dt.hour.to_numpy(),
+            )
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    # GeoJSON grid for a layer ("pickups" or "dropoffs"), hour of day (None for all hours) and zoom level
+    # ValueError for an hour outside 0-23 or a zoom outside MIN_ZOOM-MAX_ZOOM, KeyError for an unknown layer
+    def grid(self, layer, hour=None, zoom=13):
+        if hour is not None and not 0 <= hour <= 23:
+            raise ValueError(f"hour must be 0-23, got {hour}")
+        if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom must be {MIN_ZOOM}-{MAX_ZOOM}, got {zoom}")
+        if layer not in self.points:
+            raise KeyError(f"Unknown map layer {layer}")
+        key = (layer, hour, zoom)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is None:
+            count("map_layer_misses")
+            lat, lon, hours = self.points[layer]
+            if hour is not None:
+                selected = hours == hour
+                lat, lon = lat[selected], lon[selected]
+            with span("map_layer_grid"):
+                cached = grid_geojson(*grid_counts(lat, lon, zoom, self.cell_pixels), zoom, self.cell_pixels)
+            with self._lock:
+                self._cache[key] = cached
+                while len(self._cache) > LAYER_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        else:
+            count("map_layer_hits")
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+# Fill colour of a grid cell relative to the busiest cell of its layer
+def cell_style(max_count, color="#d7301f"):
+    def style(feature):
+        share = feature["properties"]["count"] / max_count if max_count else 0
+        return {"fillColor": color, "color": color, "weight": 0, "fillOpacity": 0.15 + 0.6 * share}
+    return style
+
+
+def max_count(geojson):
+    return max((feature["properties"]["count"] for feature in geojson["features"]), default=0)
+
+
+# Shared layers over the whole trip store
+def get_map_layers():
+    global _shared_layers
+    from trip_store import TRIP_STORE_PATH, ensure_trip_store, load_trips
+
+    ensure_trip_store()
+    mtime = os.path.getmtime(TRIP_STORE_PATH)
+    with _shared_lock:
+        if _shared_layers is None or _shared_layers[0] != mtime:
+            trips = load_trips(columns=["Pickup Latitude", "Pickup Longitude", "Actual Pickup Time",
+                                        "Dropoff Latitude", "Dropoff Longitude", "Actual Dropoff Time"])
+            _shared_layers = (mtime, MapLayers(trips))
+        return _shared_layers[1]
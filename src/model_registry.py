@@ -0,0 +1,309 @@
+import datetime
+import hashlib
+import importlib.metadata
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy.special import erfinv
+
+# Registry of fitted demand models, independent of the working directory and of pickle compatibility:
+#   pickup_<id>.prophet.json  full Prophet serialization (refits, warm starts, exact uncertainty intervals)
+#   pickup_<id>.params.json   compact fitted parameters, enough to forecast with NumPy alone
+#   manifest.json             pickup ID, training window, metrics, hash and row of every model
+#   params.npy                compact parameters of all models stacked row-wise, memory-mapped for bulk loads
+REGISTRY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models", "registry")
+FORMAT_VERSION = 1
+
+# Fixed columns of params.npy, followed by the changepoint deltas, changepoint times and feature weights
+FIXED_COLUMNS = ["k", "m", "sigma_obs", "y_scale", "floor", "start", "t_scale", "interval_width"]
+
+# Loaded registries keyed by directory, reloaded when the manifest changes
+_registry_cache = {}
+
+
+def prophet_path(pickup_id, registry_dir=REGISTRY_DIR):
+    return os.path.join(registry_dir, f"pickup_{pickup_id}.prophet.json")
+
+
+def params_path(pickup_id, registry_dir=REGISTRY_DIR):
+    return os.path.join(registry_dir, f"pickup_{pickup_id}.params.json")
+
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _write_atomic(path, text):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+# Fitted parameters of a Prophet model as plain JSON, or None when the model uses features the NumPy path lacks
+def compact_params(model):
+    if (model.growth != "linear" or model.holidays is not None or model.mcmc_samples
+            or any(s["mode"] != "additive" or s["condition_name"] for s in model.seasonalities.values())
+            or any(r["mode"] != "additive" for r in model.extra_regressors.values())):
+        return None
+    return {
+        "k": float(model.params["k"][0][0]),
+        "m": float(model.params["m"][0][0]),
+        "sigma_obs": float(model.params["sigma_obs"][0][0]),
+        "delta": [float(x) for x in model.params["delta"][0]],
+        "beta": [float(x) for x in model.params["beta"][0]],
+        "changepoints_t": [float(x) for x in model.changepoints_t],
+        "y_scale": float(model.y_scale),
+        "floor": 0.0,
+        "start": pd.Timestamp(model.start).isoformat(),
+        "t_scale": pd.Timedelta(model.t_scale).total_seconds(),
+        "interval_width": float(model.interval_width),
+        "seasonalities": [[name, float(s["period"]), int(s["fourier_order"])] for name, s in model.seasonalities.items()],
+        "regressors": [[name, float(r["mu"]), float(r["std"])] for name, r in model.extra_regressors.items()],
+    }
+
+
+# Forecasting with the compact parameters of a linear, additive Prophet model, without importing Prophet
+# Intervals only cover observation noise (Prophet also samples future trend changes), so they are slightly narrower
+class CompactProphet:
+    def __init__(self, params, pickup_id=None):
+        self.pickup_id = pickup_id
+        self.k = params["k"]
+        self.m = params["m"]
+        self.sigma_obs = params["sigma_obs"]
+        self.delta = np.asarray(params["delta"], dtype=np.float64)
+        self.changepoints_t = np.asarray(params["changepoints_t"], dtype=np.float64)
+        self.beta = np.asarray(params["beta"], dtype=np.float64)
+        self.y_scale = params["y_scale"]
+        self.floor = params["floor"]
+        self.start = pd.Timestamp(params["start"])
+        self.t_scale = params["t_scale"]
+        self.interval_width = params["interval_width"]
+        self.seasonalities = params["seasonalities"]
+        self.regressors = params["regressors"]
+
+    # Seasonality Fourier terms and standardized regressors, in Prophet's column order
+    def features(self, df):
+        days = (df["ds"] - pd.Timestamp("1970-01-01")).dt.total_seconds().to_numpy() / 86400
+        columns = []
+        for _, period, order in self.seasonalities:
+            for i in range(order):
+                angle = 2.0 * (i + 1) * np.pi * days / period
+                columns.extend([np.sin(angle), np.cos(angle)])
+        for name, mu, std in self.regressors:
+            if name not in df:
+                raise ValueError(f"Regressor '{name}' missing from dataframe")
+            columns.append((df[name].to_numpy(dtype=np.float64) - mu) / std)
+        return np.column_stack(columns) if columns else np.zeros((len(df), 0))
+
+    def trend(self, t):
+        # Piecewise linear trend: rate and offset change at every changepoint already passed
+        passed = t[:, None] >= self.changepoints_t[None, :]
+        k = self.k + passed @ self.delta
+        m = self.m + passed @ (-self.changepoints_t * self.delta)
+        return (k * t + m) * self.y_scale + self.floor
+
+    # Same columns as Prophet.predict for the ones the app uses: ds, trend, yhat, yhat_lower, yhat_upper
+    def predict(self, df):
+        df = df.copy()
+        df["ds"] = pd.to_datetime(df["ds"])
+        t = (df["ds"] - self.start).dt.total_seconds().to_numpy() / self.t_scale
+        trend = self.trend(t)
+        yhat = trend + self.features(df) @ self.beta * self.y_scale
+        z = float(np.sqrt(2) * erfinv(self.interval_width))
+        noise = z * self.sigma_obs * self.y_scale
+        return pd.DataFrame({"ds": df["ds"].to_numpy(), "trend": trend, "yhat": yhat,
+                             "yhat_lower": yhat - noise, "yhat_upper": yhat + noise})
+
+
+# Save a fitted Prophet model into the registry (both files), manifest and params.npy are refreshed by rebuild_registry
+def save_model(model, pickup_id, registry_dir=REGISTRY_DIR):
+    from prophet import __version__ as prophet_version
+    from prophet.serialize import model_to_json
+
+    os.makedirs(registry_dir, exist_ok=True)
+    _write_atomic(prophet_path(pickup_id, registry_dir), model_to_json(model))
+
+    history = model.history
+    params = compact_params(model)
+    metrics = None
+    if params is not None and len(history):
+        errors = CompactProphet(params).predict(history)["yhat"].to_numpy() - history["y"].to_numpy()
+        metrics = {"mae": float(np.abs(errors).mean()), "rmse": float(np.sqrt((errors ** 2).mean()))}
+    meta = {
+        "pickup_id": int(pickup_id),
+        "trained_from": pd.Timestamp(history["ds"].min()).isoformat() if len(history) else None,
+        "trained_to": pd.Timestamp(history["ds"].max()).isoformat() if len(history) else None,
+        "n_obs": int(len(history)),
+        "metrics": metrics,
+        "prophet_version": prophet_version,
+        "sha256": _sha256(prophet_path(pickup_id, registry_dir)),
+        "saved_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "params": params,
+    }
+    _write_atomic(params_path(pickup_id, registry_dir), json.dumps(meta))
+    return meta
+
+
+# Rebuild manifest.json and params.npy from the per-model files (run once after a batch of saves)
+def rebuild_registry(registry_dir=REGISTRY_DIR):
+    metas = []
+    for name in sorted(os.listdir(registry_dir)):
+        if name.endswith(".params.json"):
+            with open(os.path.join(registry_dir, name)) as f:
+                metas.append(json.load(f))
+    metas.sort(key=lambda meta: meta["pickup_id"])
+
+    compact = [meta for meta in metas if meta["params"] is not None]
+    n_changepoints = max((len(meta["params"]["delta"]) for meta in compact), default=0)
+    n_features = max((len(meta["params"]["beta"]) for meta in compact), default=0)
+    # Shorter parameter vectors are zero-padded, a zero delta or beta contributes nothing to the forecast
+    table = np.zeros((len(compact), len(FIXED_COLUMNS) + 2 * n_changepoints + n_features), dtype=np.float64)
+    rows = {}
+    for row, meta in enumerate(compact):
+        params = meta["params"]
+        table[row, :len(FIXED_COLUMNS)] = [
+            params["k"], params["m"], params["sigma_obs"], params["y_scale"], params["floor"],
+            pd.Timestamp(params["start"]).timestamp(), params["t_scale"], params["interval_width"],
+        ]
+        offset = len(FIXED_COLUMNS)
+        table[row, offset:offset + len(params["delta"])] = params["delta"]
+        table[row, offset + n_changepoints:offset + n_changepoints + len(params["changepoints_t"])] = params["changepoints_t"]
+        table[row, offset + 2 * n_changepoints:offset + 2 * n_changepoints + len(params["beta"])] = params["beta"]
+        rows[meta["pickup_id"]] = row
+    np.save(os.path.join(registry_dir, "params.tmp.npy"), table)
+    os.replace(os.path.join(registry_dir, "params.tmp.npy"), os.path.join(registry_dir, "params.npy"))
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "n_changepoints": n_changepoints,
+        "n_features": n_features,
+        "models": {
+            str(meta["pickup_id"]): {
+                "row": rows.get(meta["pickup_id"]),
+                "prophet_file": os.path.basename(prophet_path(meta["pickup_id"])),
+                "trained_from": meta["trained_from"],
+                "trained_to": meta["trained_to"],
+                "n_obs": meta["n_obs"],
+                "metrics": meta["metrics"],
+                "sha256": meta["sha256"],
+                "prophet_version": meta["prophet_version"],
+                "saved_at": meta["saved_at"],
+                "seasonalities": meta["params"]["seasonalities"] if meta["params"] else None,
+                "regressors": meta["params"]["regressors"] if meta["params"] else None,
+            }
+            for meta in metas
+        },
+    }
+    _write_atomic(os.path.join(registry_dir, "manifest.json"), json.dumps(manifest, indent=2))
+    return manifest
+
+
+# A full Prophet serialization from another Prophet release may not load or forecast the same way
+# Compact rows only need NumPy and are never checked
+def check_prophet_version(entry, pickup_id):
+    installed = importlib.metadata.version("prophet")
+    if entry["prophet_version"] != installed:
+        raise ValueError(f"Model for pickup ID {pickup_id} was saved with Prophet {entry['prophet_version']}, "
+                         f"installed is {installed}; retrain it with models/refresh_forecasts.py")
+
+
+# Read access to a registry directory: manifest in memory, parameters memory-mapped from params.npy
+class ModelRegistry:
+    def __init__(self, registry_dir=REGISTRY_DIR):
+        self.registry_dir = registry_dir
+        with open(os.path.join(registry_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported registry format {self.manifest['format_version']}")
+        params_file = os.path.join(registry_dir, "params.npy")
+        self.params = np.load(params_file, mmap_mode="r") if os.path.exists(params_file) else None
+        self._models = {}
+
+    @property
+    def pickup_ids(self):
+        return [int(pickup_id) for pickup_id in self.manifest["models"]]
+
+    def __contains__(self, pickup_id):
+        return str(pickup_id) in self.manifest["models"]
+
+    def entry(self, pickup_id):
+        return self.manifest["models"][str(pickup_id)]
+
+    # Compact model of one pickup ID, built from its row of params.npy on first use
+    def get(self, pickup_id):
+        if pickup_id not in self._models:
+            entry = self.manifest["models"].get(str(pickup_id))
+            if entry is None:
+                return None
+            if entry["row"] is None:
+                # Not representable compactly, fall back to the full Prophet model
+                self._models[pickup_id] = self.load_prophet(pickup_id)
+            else:
+                self._models[pickup_id] = CompactProphet(self._row_params(entry), pickup_id)
+        return self._models[pickup_id]
+
+    # Models of many pickup IDs at once, IDs missing from the registry are left out
+    def load_all(self, pickup_ids=None):
+        pickup_ids = self.pickup_ids if pickup_ids is None else pickup_ids
+        return {pickup_id: self.get(pickup_id) for pickup_id in pickup_ids if pickup_id in self}
+
+    # Full Prophet model from its JSON file, verified against the manifest hash
+    def load_prophet(self, pickup_id):
+        from prophet.serialize import model_from_json
+
+        entry = self.entry(pickup_id)
+        check_prophet_version(entry, pickup_id)
+        path = os.path.join(self.registry_dir, entry["prophet_file"])
+        if _sha256(path) != entry["sha256"]:
+            raise ValueError(f"Model file {path} does not match the registry manifest")
+        with open(path) as f:
+            return model_from_json(f.read())
+
+    def _row_params(self, entry):
+        row = np.asarray(self.params[entry["row"]], dtype=np.float64)
+        n_changepoints, n_features = self.manifest["n_changepoints"], self.manifest["n_features"]
+        fixed = dict(zip(FIXED_COLUMNS, row[:len(FIXED_COLUMNS)]))
+        offset = len(FIXED_COLUMNS)
+        return {
+            **fixed,
+            "start": pd.Timestamp(fixed["start"], unit="s"),
+            "delta": row[offset:offset + n_changepoints],
+            "changepoints_t": row[offset + n_changepoints:offset + 2 * n_changepoints],
+            "beta": row[offset + 2 * n_changepoints:offset + 2 * n_changepoints + n_features],
+            "seasonalities": entry["seasonalities"],
+            "regressors": entry["regressors"],
+        }
+
+
+# Shared registry for a directory, reopened when its manifest changes; None when no registry exists yet
+def load_registry(registry_dir=REGISTRY_DIR):
+    manifest_path = os.path.join(registry_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    mtime = os.path.getmtime(manifest_path)
+    cached = _registry_cache.get(registry_dir)
+    if cached is None or cached[0] != mtime:
+        _registry_cache[registry_dir] = (mtime, ModelRegistry(registry_dir))
+    return _registry_cache[registry_dir][1]
+
+
+if __name__ == "__main__":
+    import argparse
+    import glob
+    import joblib
+
+    parser = argparse.ArgumentParser(description="Import pickled Prophet models into the model registry")
+    parser.add_argument("pickles", nargs="*", help="prophet_model_pickup_<id>.pkl files (default: all in models/)")
+    parser.add_argument("--registry-dir", default=REGISTRY_DIR)
+    args = parser.parse_args()
+
+    pickles = args.pickles or sorted(glob.glob(os.path.join(os.path.dirname(REGISTRY_DIR), "prophet_model_pickup_*.pkl")))
+    for pickle_path in pickles:
+        pickup_id = int(os.path.basename(pickle_path).split("_")[-1].split(".")[0])
+        meta = save_model(joblib.load(pickle_path), pickup_id, args.registry_dir)
+        print(f"Pickup ID {pickup_id}: {meta['n_obs']} hours, metrics {meta['metrics']}")
+    manifest = rebuild_registry(args.registry_dir)
+    print(f"Registry with {len(manifest['models'])} models written to {args.registry_dir}")
@@ -2,12 +2,16 @@ import openrouteservice
 import folium
 import os
 from dotenv import load_dotenv
+from ors_routing import BatchRouter
+from local_router import get_local_router, use_local_routing
 
 
 load_dotenv()
 
 
 ors_client = openrouteservice.Client(key=os.getenv('ORS_API_KEY'))  
+# Offline road graph when ROUTING_BACKEND=local, otherwise the batched ORS client
+router = get_local_router() if use_local_routing() else BatchRouter(ors_client)
 
 # coordinates for pickup and drop-off (longitude, latitude)
 pickup_point = (48.994215, 11.461103)  # Pickup coordinates (longitude, latitude)
@@ -27,15 +31,13 @@ expanded_avoidance_area = {
 
 # Request route with expanded avoidance area
 try:
-    route_with_avoidance = ors_client.directions(
-        coordinates=[pickup_point, dropoff_point],
-        profile='driving-car',
-        format='geojson',
-        options={"avoid_polygons": expanded_avoidance_area}  
+    routes, route_errors = router.route_coords_batch(
+        [(pickup_point, dropoff_point)],
+        avoid_polygons=expanded_avoidance_area
     )
-    
-    # Extract route coordinates for plotting
-    route_coords_with_avoidance = [(coord[1], coord[0]) for coord in route_with_avoidance['features'][0]['geometry']['coordinates']]
+    route_coords_with_avoidance = routes[0]
+    if route_coords_with_avoidance is None:
+        raise route_errors[0]
 
     # Init map centered around the pickup point for the avoided route
     m_avoidance = folium.Map(location=[pickup_point[0], pickup_point[1]], zoom_start=13)
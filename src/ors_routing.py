@@ -0,0 +1,130 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Free openrouteservice plans allow 40 directions or matrix requests per minute
+DEFAULT_REQUESTS_PER_MINUTE = 40
+# Maximum number of sources x destinations per matrix request
+MATRIX_MAX_ELEMENTS = 3500
+
+
+# Thread-safe token bucket, acquire() blocks until a request may be sent
+class RateLimiter:
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, burst=None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1, requests_per_minute // 4)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Batched routing on top of an openrouteservice.Client: dedupes pairs and runs them concurrently under a rate limit
+class BatchRouter:
+    def __init__(self, client, max_workers=4, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, profile="driving-car"):
+        self.client = client
+        self.max_workers = max_workers
+        self.profile = profile
+        self.limiter = RateLimiter(requests_per_minute)
+        # Requests sent so far, counted from the worker threads of every batch
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def _pair_key(self, origin, destination, avoid_polygons):
+        return (
+            tuple(round(float(c), 6) for c in origin),
+            tuple(round(float(c), 6) for c in destination),
+            json.dumps(avoid_polygons, sort_keys=True) if avoid_polygons else None,
+        )
+
+    def _count_call(self):
+        with self._calls_lock:
+            self.calls += 1
+
+    def _directions(self, origin, destination, avoid_polygons):
+        self.limiter.acquire()
+        self._count_call()
+        options = {"avoid_polygons": avoid_polygons} if avoid_polygons else None
+        kwargs = {"options": options} if options else {}
+        return self.client.directions(coordinates=[origin, destination], profile=self.profile, format="geojson", **kwargs)
+
+    # GeoJSON directions for each (origin, destination) pair given as (lon, lat), aligned with the input
+    # Failed pairs come back as None, with their exception in the returned errors by pair index
+    # The router is shared by concurrent sessions, so nothing about one batch is kept on it
+    def directions_batch(self, pairs, avoid_polygons=None):
+        errors = {}
+        unique = {}
+        for origin, destination in pairs:
+            unique.setdefault(self._pair_key(origin, destination, avoid_polygons), (origin, destination))
+
+        def fetch(item):
+            key, (origin, destination) = item
+            try:
+                return key, self._directions(origin, destination, avoid_polygons), None
+            except Exception as e:
+                return key, None, e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            fetched = {key: (result, error) for key, result, error in pool.map(fetch, unique.items())}
+
+        results = []
+        for i, (origin, destination) in enumerate(pairs):
+            result, error = fetched[self._pair_key(origin, destination, avoid_polygons)]
+            if error is not None:
+                errors[i] = error
+            results.append(result)
+        return results, errors
+
+    # Route geometries as lists of (lat, lon) points for folium (None for failed pairs), and the errors by pair index
+    def route_coords_batch(self, pairs, avoid_polygons=None):
+        results, errors = self.directions_batch(pairs, avoid_polygons)
+        routes = []
+        for result in results:
+            if result is None:
+                routes.append(None)
+            else:
+                routes.append([(coord[1], coord[0]) for coord in result["features"][0]["geometry"]["coordinates"]])
+        return routes, errors
+
+    # Distances (km) and durations (minutes) only, answered with as few matrix requests as possible
+    def distances(self, pairs):
+        locations, location_index = [], {}
+        for origin, destination in pairs:
+            for point in (origin, destination):
+                key = tuple(round(float(c), 6) for c in point)
+                if key not in location_index:
+                    location_index[key] = len(locations)
+                    locations.append(list(point))
+        origin_ids = [location_index[tuple(round(float(c), 6) for c in o)] for o, _ in pairs]
+        destination_ids = [location_index[tuple(round(float(c), 6) for c in d)] for _, d in pairs]
+        sources = sorted(set(origin_ids))
+        destinations = sorted(set(destination_ids))
+
+        distance = np.full((len(locations), len(locations)), np.nan)
+        duration = np.full((len(locations), len(locations)), np.nan)
+        # Split the sources so each request stays under the matrix element limit
+        step = max(1, MATRIX_MAX_ELEMENTS // max(1, len(destinations)))
+        for start in range(0, len(sources), step):
+            chunk = sources[start:start + step]
+            self.limiter.acquire()
+            self._count_call()
+            matrix = self.client.distance_matrix(
+                locations=locations, sources=chunk, destinations=destinations,
+                profile=self.profile, metrics=["distance", "duration"], units="km",
+            )
+            distance[np.ix_(chunk, destinations)] = np.array(matrix["distances"], dtype=np.float64)
+            duration[np.ix_(chunk, destinations)] = np.array(matrix["durations"], dtype=np.float64) / 60
+        return distance[origin_ids, destination_ids], duration[origin_ids, destination_ids]
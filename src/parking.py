@@ -0,0 +1,97 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from instrumentation import count, span
+
+PARKAPI_URL = "https://api.parkendd.de/{city}/"
+
+# Process-wide fetcher, so the session and the lot cache survive Streamlit reruns
+_shared_fetcher = None
+_shared_lock = threading.Lock()
+
+
+# Fetches ParkAPI lots for several cities concurrently over one pooled session, with a TTL cache per city
+class ParkingFetcher:
+    def __init__(self, url_base=PARKAPI_URL, max_workers=8, timeout=5, ttl_seconds=600):
+        self.url_base = url_base
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+
+        # Keep-alive connections are reused across cities and reruns
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._cache = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Lots of one city as (name, lat, lon) tuples
+    # When the request fails or the response is not valid JSON, the last lots fetched for the city are returned
+    # (with a warning) however old they are; None only when the city was never fetched
+    def fetch_city(self, city):
+        with self._lock:
+            cached = self._cache.get(city)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl_seconds:
+                self.hits += 1
+                count("parkapi_cache_hits")
+                return cached[1]
+            self.misses += 1
+
+        count("parkapi_requests")
+
+        try:
+            with span("parkapi_request"):
+                response = self.session.get(self.url_base.format(city=city), timeout=self.timeout)
+            response.raise_for_status()
+            lots = []
+            for lot in response.json().get("lots", []):
+                name = lot.get("name", "Unnamed Parking Spot")
+                lots.append((name, lot["coords"]["lat"], lot["coords"]["lng"]))
+        except (requests.RequestException, ValueError, KeyError, TypeError, AttributeError) as e:
+            count("parkapi_errors")
+            if cached is None:
+                return None
+            count("parkapi_stale")
+            print(f"ParkAPI request for {city} failed ({e}), using lots from {time.monotonic() - cached[0]:.0f} s ago")
+            return cached[1]
+        with self._lock:
+            self._cache[city] = (time.monotonic(), lots)
+        return lots
+
+    # All lots around the pickup coordinates as (name, lat, lon, pickup_id), plus the cities that failed
+    def find_parking_spots(self, coordinates_dict, city_id_map):
+        cities = []
+        for pickup_id in coordinates_dict:
+            city = city_id_map.get(pickup_id)
+            if city and city not in cities:
+                cities.append(city)
+
+        # Every city is requested in parallel, so the wait is the slowest city rather than the sum
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(cities)))) as pool:
+            lots_by_city = dict(zip(cities, pool.map(self.fetch_city, cities)))
+
+        all_parking_spots = []
+        for pickup_id in coordinates_dict:
+            lots = lots_by_city.get(city_id_map.get(pickup_id))
+            if lots:
+                all_parking_spots.extend((name, lat, lon, pickup_id) for name, lat, lon in lots)
+        failed_cities = [city for city, lots in lots_by_city.items() if lots is None]
+        return all_parking_spots, failed_cities
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def get_parking_fetcher():
+    global _shared_fetcher
+    with _shared_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = ParkingFetcher()
+        return _shared_fetcher
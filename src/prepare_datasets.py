@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+from trip_store import DATASETS_DIR, RAW_STOPS_PATH, RAW_TRIPS_PATH, TRIP_STORE_PATH, ensure_trip_store
+
+MANIFEST_NAME = "pipeline_manifest.json"
+CHECKPOINT_NAME = "pipeline_checkpoint.json"
+AGGREGATES_NAME = "hourly_pickup_demand.csv"
+PARTIAL_AGGREGATES_NAME = "hourly_pickup_demand.partial.parquet"
+CHUNK_SIZE = 100_000
+
+# Columns of the cleaned dataset (and of the completed/cancelled splits)
+CLEANED_COLUMNS = ['Booking ID', 'Pickup ID', 'Dropoff ID', 'Actual Pickup Time', 'Actual Dropoff Time',
+                   'Pickup Latitude', 'Pickup Longitude', 'Dropoff Latitude', 'Dropoff Longitude',
+                   'name', 'district', 'Passenger status']
+HEATMAP_COLUMNS = ['Actual Pickup Time', 'Booking ID', 'Pickup ID', 'Dropoff ID', 'Actual Dropoff Time',
+                   'Pickup Latitude', 'Pickup Longitude', 'Dropoff Latitude', 'Dropoff Longitude',
+                   'name', 'district', 'Passenger status', 'Rounded Pickup Time', 'Pickup Date', 'Pickup Hour']
+OUTPUTS = {
+    "cleaned": "cleaned_dataset.csv",
+    "heatmap": "heatmap_data.csv",
+    "completed": "trip_completed_data.csv",
+    "cancelled": "trip_cancelled_data.csv",
+}
+
+
+# Content hash of a file, read in blocks so large inputs never sit in memory
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Hash of all raw inputs, used to skip the pipeline when nothing changed
+def inputs_hash(input_paths):
+    digest = hashlib.sha256()
+    for path in input_paths:
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Derive the cleaned rows of one chunk of the trip store (known stops with IDs up to 69)
+def clean_chunk(trips):
+    trips = trips.dropna(subset=['Pickup Latitude', 'Dropoff Latitude'])
+    trips = trips[(trips['Pickup ID'] <= 69) & (trips['Dropoff ID'] <= 69)]
+    cleaned = trips.rename(columns={'Pickup Name': 'name', 'Pickup District': 'district'})[CLEANED_COLUMNS].copy()
+    cleaned['Passenger status'] = cleaned['Passenger status'].astype(str)
+    return cleaned
+
+
+# Add the hourly columns used by the heatmaps and the forecasting models
+def heatmap_chunk(cleaned):
+    heatmap = cleaned.copy()
+    heatmap['Rounded Pickup Time'] = heatmap['Actual Pickup Time'].dt.floor('h')
+    heatmap['Pickup Date'] = heatmap['Actual Pickup Time'].dt.date
+    heatmap['Pickup Hour'] = heatmap['Actual Pickup Time'].dt.hour
+    return heatmap[HEATMAP_COLUMNS]
+
+
+# Read the raw trips once and write the cleaned, heatmap, completed and cancelled datasets plus hourly aggregates
+def prepare_datasets(out_dir=DATASETS_DIR, input_paths=(RAW_TRIPS_PATH, RAW_STOPS_PATH), store_path=TRIP_STORE_PATH, chunk_size=CHUNK_SIZE, force=False):
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    checkpoint_path = os.path.join(out_dir, CHECKPOINT_NAME)
+    partial_aggregates_path = os.path.join(out_dir, PARTIAL_AGGREGATES_NAME)
+    final_paths = {name: os.path.join(out_dir, filename) for name, filename in OUTPUTS.items()}
+    final_paths["aggregates"] = os.path.join(out_dir, AGGREGATES_NAME)
+    partial_paths = {name: f"{path}.partial" for name, path in final_paths.items() if name != "aggregates"}
+
+    # Skip everything when the inputs have the same content as the last completed run
+    current_hash = inputs_hash(input_paths)
+    manifest = _read_json(manifest_path)
+    if not force and manifest and manifest["inputs_hash"] == current_hash and all(os.path.exists(p) for p in final_paths.values()):
+        print("Inputs unchanged, datasets are up to date.")
+        return manifest
+
+    if store_path == TRIP_STORE_PATH:
+        ensure_trip_store()
+
+    # Resume an interrupted run of the same inputs from its last finished chunk
+    checkpoint = _read_json(checkpoint_path)
+    if force or not checkpoint or checkpoint["inputs_hash"] != current_hash:
+        checkpoint = {"inputs_hash": current_hash, "chunks_done": 0, "rows_written": 0, "sizes": {}}
+        for path in list(partial_paths.values()) + [partial_aggregates_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        aggregates = None
+    else:
+        print(f"Resuming after chunk {checkpoint['chunks_done']}")
+        # Drop anything written after the checkpoint
+        for name, path in partial_paths.items():
+            with open(path, "r+b") as f:
+                f.truncate(checkpoint["sizes"][name])
+        aggregates = pd.read_parquet(partial_aggregates_path).set_index(['Rounded Pickup Time', 'Pickup ID'])['demand']
+
+    batches = pq.ParquetFile(store_path).iter_batches(batch_size=chunk_size)
+    for chunk_number, batch in enumerate(batches):
+        if chunk_number < checkpoint["chunks_done"]:
+            continue
+
+        cleaned = clean_chunk(batch.to_pandas())
+        cleaned.index = pd.RangeIndex(checkpoint["rows_written"], checkpoint["rows_written"] + len(cleaned))
+        heatmap = heatmap_chunk(cleaned)
+        frames = {
+            "cleaned": cleaned,
+            "heatmap": heatmap,
+            "completed": cleaned[cleaned['Passenger status'] == 'Trip completed'],
+            "cancelled": cleaned[cleaned['Passenger status'] == 'Cancelled'],
+        }
+        for name, frame in frames.items():
+            first = not os.path.exists(partial_paths[name])
+            frame.to_csv(partial_paths[name], mode="a", header=first)
+
+        # Hourly pickup counts per location, the same aggregation DemandForecast uses
+        counts = heatmap.groupby(['Rounded Pickup Time', 'Pickup ID']).size()
+        aggregates = counts if aggregates is None else aggregates.add(counts, fill_value=0).astype("int64")
+        aggregates.rename("demand").reset_index().to_parquet(partial_aggregates_path, index=False)
+
+        checkpoint["chunks_done"] = chunk_number + 1
+        checkpoint["rows_written"] += len(cleaned)
+        checkpoint["sizes"] = {name: os.path.getsize(path) for name, path in partial_paths.items()}
+        _write_json(checkpoint_path, checkpoint)
+
+    # A trip store without rows still publishes every output, with headers only
+    if aggregates is None:
+        print("No trips in the trip store, writing empty datasets")
+        index = pd.MultiIndex.from_arrays([pd.DatetimeIndex([]), pd.Index([], dtype="int64")])
+        aggregates = pd.Series([], index=index, dtype="int64")
+    for name, path in partial_paths.items():
+        if not os.path.exists(path):
+            pd.DataFrame(columns=HEATMAP_COLUMNS if name == "heatmap" else CLEANED_COLUMNS).to_csv(path)
+
+    # Publish all outputs together once every chunk is done
+    aggregates.rename_axis(['Rounded Pickup Time', 'Pickup ID']).rename("demand").reset_index().to_csv(final_paths["aggregates"], index=False)
+    for name, path in partial_paths.items():
+        os.replace(path, final_paths[name])
+    if os.path.exists(partial_aggregates_path):
+        os.remove(partial_aggregates_path)
+
+    manifest = {
+        "inputs_hash": current_hash,
+        "rows": checkpoint["rows_written"],
+        "outputs": {name: file_hash(path) for name, path in final_paths.items()},
+    }
+    _write_json(manifest_path, manifest)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    print(f"Prepared {checkpoint['rows_written']} rows into {', '.join(os.path.basename(p) for p in final_paths.values())}")
+    return manifest
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Derive all prepared datasets from the raw trip data in one pass")
+    parser.add_argument("--out-dir", default=DATASETS_DIR)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the inputs are unchanged")
+    args = parser.parse_args()
+    prepare_datasets(out_dir=args.out_dir, chunk_size=args.chunk_size, force=args.force)
+    # The stop-to-stop matrix is generated too (not kept in git), rebuilt when the bus stop sheet changes
+    from stop_matrix import ensure_stop_matrix
+    ensure_stop_matrix()
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+
+# Minutes of expected passenger wait that one deadhead km is worth
+DEADHEAD_WEIGHT = 1.0
+# Hours of future demand considered when placing the fleet, and how fast later hours lose weight
+LOOKAHEAD_HOURS = 3
+DISCOUNT = 0.5
+
+
+# Dense demand matrix [stops x hours] from a forecast indexed by (ds, Pickup ID) with a yhat column
+def demand_matrix_from_forecast(forecast, stop_ids, start, hours=24):
+    yhat = forecast["yhat"].clip(lower=0).unstack("Pickup ID")
+    yhat = yhat.reindex(index=pd.date_range(pd.Timestamp(start).floor("h"), periods=hours, freq="h"), columns=list(stop_ids))
+    return yhat.fillna(0).to_numpy(dtype=np.float64).T
+
+
+# Demand each hour weighted over the lookahead window: sum_k DISCOUNT^k * demand[:, t + k]
+def lookahead_demand(demand, lookahead_hours=LOOKAHEAD_HOURS, discount=DISCOUNT):
+    weighted = np.zeros_like(demand, dtype=np.float64)
+    for k in range(lookahead_hours):
+        weighted[:, :demand.shape[1] - k] += discount ** k * demand[:, k:]
+    return weighted
+
+
+# Expected wait: demand-weighted travel time from the closest vehicle to every stop
+def expected_wait(positions, weights, travel_time):
+    return float(weights @ travel_time[positions].min(axis=0))
+
+
+# Greedy placement for the first hour: add the stop that lowers the expected wait most, one vehicle at a time
+def greedy_positions(weights, travel_time, fleet_size):
+    best = np.full(travel_time.shape[1], np.inf)
+    positions = []
+    for _ in range(fleet_size):
+        # Cost of adding each candidate stop, evaluated for all candidates at once
+        candidate_cost = (np.minimum(best[None, :], travel_time) * weights[None, :]).sum(axis=1)
+        choice = int(np.argmin(candidate_cost))
+        positions.append(choice)
+        best = np.minimum(best, travel_time[choice])
+    return np.array(positions)
+
+
+# Improve positions by moving one vehicle at a time to the stop that lowers wait + deadhead the most
+def improve_positions(positions, previous, weights, travel_time, distance, deadhead_weight=DEADHEAD_WEIGHT, max_sweeps=10):
+    positions = positions.copy()
+    for _ in range(max_sweeps):
+        improved = False
+        for vehicle in range(len(positions)):
+            # Travel time to each stop from the closest of the other vehicles
+            others = np.delete(positions, vehicle)
+            base = travel_time[others].min(axis=0) if len(others) else np.full(travel_time.shape[1], np.inf)
+            wait = (np.minimum(base[None, :], travel_time) * weights[None, :]).sum(axis=1)
+            cost = wait + deadhead_weight * distance[previous[vehicle]]
+            choice = int(np.argmin(cost))
+            if cost[choice] < cost[positions[vehicle]] - 1e-9:
+                positions[vehicle] = choice
+                improved = True
+        if not improved:
+            break
+    return positions
+
+
+# Re-assign vehicles to the chosen positions so the total deadhead distance is minimal
+def match_vehicles(previous, positions, distance):
+    vehicles, slots = linear_sum_assignment(distance[np.ix_(previous, positions)])
+    matched = np.empty_like(positions)
+    matched[vehicles] = positions[slots]
+    return matched
+
+
+# Plan vehicle positions for every hour of the demand matrix, each hour warm-started from the previous one
+# demand: [stops x hours], travel_time (minutes) and distance (km): [stops x stops], positions are stop indices
+def plan_prepositioning(demand, travel_time, distance, fleet_size, initial_positions=None,
+                        lookahead_hours=LOOKAHEAD_HOURS, discount=DISCOUNT, deadhead_weight=DEADHEAD_WEIGHT):
+    demand = np.asarray(demand, dtype=np.float64)
+    travel_time = np.asarray(travel_time, dtype=np.float64)
+    distance = np.asarray(distance, dtype=np.float64)
+    weights = lookahead_demand(demand, lookahead_hours, discount)
+    hours = demand.shape[1]
+
+    plan = np.zeros((hours, fleet_size), dtype=np.int64)
+    wait = np.zeros(hours)
+    deadhead = np.zeros(hours)
+    previous = None if initial_positions is None else np.asarray(initial_positions, dtype=np.int64)
+    for hour in range(hours):
+        if previous is None:
+            positions = greedy_positions(weights[:, hour], travel_time, fleet_size)
+            positions = improve_positions(positions, positions, weights[:, hour], travel_time, distance, 0.0)
+        else:
+            positions = improve_positions(previous, previous, weights[:, hour], travel_time, distance, deadhead_weight)
+            positions = match_vehicles(previous, positions, distance)
+            deadhead[hour] = distance[previous, positions].sum()
+        plan[hour] = positions
+        # Expected wait per booking in this hour (minutes)
+        total = demand[:, hour].sum()
+        wait[hour] = expected_wait(positions, demand[:, hour], travel_time) / total if total > 0 else 0.0
+        previous = positions
+    return plan, wait, deadhead
+
+
+# Relocations of the plan as a DataFrame: hour, vehicle, from/to stop ID and deadhead km
+def plan_moves(plan, stop_ids, distance, start):
+    stop_ids = np.asarray(stop_ids)
+    moves = []
+    for hour in range(1, len(plan)):
+        for vehicle in np.nonzero(plan[hour] != plan[hour - 1])[0]:
+            moves.append({
+                "Hour": pd.Timestamp(start).floor("h") + pd.Timedelta(hours=hour),
+                "Vehicle": int(vehicle) + 1,
+                "From Stop": int(stop_ids[plan[hour - 1, vehicle]]),
+                "To Stop": int(stop_ids[plan[hour, vehicle]]),
+                "Deadhead km": float(distance[plan[hour - 1, vehicle], plan[hour, vehicle]]),
+            })
+    return pd.DataFrame(moves, columns=["Hour", "Vehicle", "From Stop", "To Stop", "Deadhead km"])
@@ -0,0 +1,108 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from instrumentation import count
+
+# Default location of the shared on-disk route cache
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets", "route_cache.sqlite")
+
+
+# Persistent routing cache shared across Streamlit sessions and processes (SQLite in WAL mode)
+class RouteCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=7 * 24 * 3600, max_entries=5000, precision=5):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.precision = precision  # 5 decimals is roughly 1 m, enough to merge repeated stop coordinates
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS routes_accessed ON routes (accessed)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+
+    # Build the cache key from the profile, rounded coordinates and request options
+    def make_key(self, profile, start, end, options=None):
+        start = [round(float(c), self.precision) for c in start]
+        end = [round(float(c), self.precision) for c in end]
+        return json.dumps([profile, start, end, options or {}], sort_keys=True)
+
+    def _count(self, name):
+        self._conn.execute(
+            "INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,)
+        )
+
+    # Look up a cached value, returns None on a miss or when the entry has expired
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created FROM routes WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM routes WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                self._count("misses")
+                count("route_cache_misses")
+                return None
+            self._conn.execute("UPDATE routes SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self._count("hits")
+            count("route_cache_hits")
+        return json.loads(row[0])
+
+    # Store a value and evict the least recently used entries above the size cap
+    def set(self, key, value):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO routes (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM routes WHERE key IN (SELECT key FROM routes ORDER BY accessed ASC LIMIT ?)", (overflow,)
+                )
+
+    # Return the cached route for (profile, start, end, options) or call fetch() and cache its result
+    def get_or_fetch(self, profile, start, end, fetch, options=None):
+        key = self.make_key(profile, start, end, options)
+        cached = self.get(key)
+        if cached is not None:
+            return tuple(cached)
+        result = fetch()
+        # Only successful lookups are cached, failed requests are retried on the next call
+        if result is not None and result[0] is not None:
+            self.set(key, list(result))
+        return result
+
+    # Hit/miss counters for this process and the totals shared by every process using the file
+    def stats(self):
+        with self._lock:
+            shared = dict(self._conn.execute("SELECT name, value FROM stats").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": shared.get("hits", 0),
+            "shared_misses": shared.get("misses", 0),
+            "entries": entries,
+        }
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM routes")
+            self._conn.execute("DELETE FROM stats")
+        self.hits = 0
+        self.misses = 0
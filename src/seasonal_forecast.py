@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from scipy.special import erfinv
+
+# Pseudo-observations pulling each weekday x hour cell towards the stop's hour-of-day profile
+PRIOR_STRENGTH = 4.0
+# Smoothing factor of the daily level (1 = only the last day counts)
+LEVEL_ALPHA = 0.3
+
+
+# Hour-of-week x stop demand profiles with an exponentially smoothed level, fitted for all stops at once
+class SeasonalBaseline:
+    def __init__(self, prior_strength=PRIOR_STRENGTH, level_alpha=LEVEL_ALPHA, interval_width=0.8):
+        self.prior_strength = prior_strength
+        self.level_alpha = level_alpha
+        self.interval_width = interval_width
+        self.pickup_ids = None
+        self.profile = None
+        self.level = None
+        self.sigma = None
+        self.history_start = None
+        self.history_end = None
+
+    # counts: [stops x hours] starting at start (hourly, midnight-aligned), e.g. a DemandTensor window
+    def fit(self, counts, start, pickup_ids):
+        counts = np.asarray(counts, dtype=np.float64)
+        n_stops, n_hours = counts.shape
+        start = pd.Timestamp(start)
+        n_days = n_hours // 24
+        counts = counts[:, :n_days * 24]
+        days = counts.reshape(n_stops, n_days, 24)
+        weekday = (start.dayofweek + np.arange(n_days)) % 7
+
+        # Mean per stop x weekday x hour, each weekday cell shrunk towards the stop's mean for that hour
+        hour_mean = days.mean(axis=1)
+        sums = np.zeros((n_stops, 7, 24))
+        np.add.at(sums, (slice(None), weekday), days)
+        seen = np.bincount(weekday, minlength=7).astype(np.float64)
+        self.profile = (sums + self.prior_strength * hour_mean[:, None, :]) / (seen[None, :, None] + self.prior_strength)
+
+        # Level: how busy recent days were relative to the profile, smoothed day by day
+        expected = self.profile[:, weekday, :].sum(axis=2)
+        actual = days.sum(axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(expected > 0, actual / expected, 1.0)
+        level = np.ones(n_stops)
+        for day in range(n_days):
+            level = self.level_alpha * ratio[:, day] + (1 - self.level_alpha) * level
+        self.level = level
+
+        # Residual spread per stop gives intervals in the same spirit as Prophet's yhat_lower/yhat_upper
+        fitted = self.profile[:, weekday, :]
+        self.sigma = np.sqrt(((days - fitted) ** 2).mean(axis=(1, 2)))
+        self.pickup_ids = [int(pickup_id) for pickup_id in pickup_ids]
+        self.history_start = start
+        self.history_end = start + pd.Timedelta(hours=n_days * 24)
+        return self
+
+    # Forecasts [stops x timestamps]: yhat, yhat_lower, yhat_upper
+    def predict(self, timestamps):
+        timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps))
+        yhat = self.level[:, None] * self.profile[:, timestamps.dayofweek, timestamps.hour]
+        spread = float(np.sqrt(2) * erfinv(self.interval_width)) * self.sigma[:, None]
+        return yhat, yhat - spread, yhat + spread
+
+    # Same tidy layout as predict_demand_batch: Pickup ID, ds, yhat, yhat_lower, yhat_upper
+    def forecast_frame(self, timestamps):
+        timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps))
+        yhat, lower, upper = self.predict(timestamps)
+        return pd.DataFrame({
+            "Pickup ID": np.repeat(self.pickup_ids, len(timestamps)),
+            "ds": np.tile(timestamps, len(self.pickup_ids)),
+            "yhat": yhat.ravel(),
+            "yhat_lower": lower.ravel(),
+            "yhat_upper": upper.ravel(),
+        })
+
+    # Per-location view with a Prophet-like predict(df), so forecast_grid and the pages can use it unchanged
+    def location(self, pickup_id):
+        return LocationForecast(self, self.pickup_ids.index(int(pickup_id)))
+
+    def save(self, path):
+        np.savez(path, profile=self.profile, level=self.level, sigma=self.sigma, pickup_ids=np.array(self.pickup_ids),
+                 history=np.array([self.history_start.value, self.history_end.value]),
+                 settings=np.array([self.prior_strength, self.level_alpha, self.interval_width]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        model = cls(*data["settings"])
+        model.profile, model.level, model.sigma = data["profile"], data["level"], data["sigma"]
+        model.pickup_ids = [int(pickup_id) for pickup_id in data["pickup_ids"]]
+        model.history_start, model.history_end = (pd.Timestamp(value) for value in data["history"])
+        return model
+
+
+class LocationForecast:
+    def __init__(self, baseline, row):
+        self.baseline = baseline
+        self.row = row
+
+    def predict(self, df):
+        timestamps = pd.to_datetime(df["ds"])
+        yhat, lower, upper = self.baseline.predict(timestamps)
+        return pd.DataFrame({"ds": timestamps.to_numpy(), "yhat": yhat[self.row], "yhat_lower": lower[self.row], "yhat_upper": upper[self.row]})
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from aiohttp import web
+from dotenv import load_dotenv
+
+# Settings kept in .env (MAPBOX_API_KEY, METRICS_*, FLEET_PINGS_*) are read by the modules imported below
+load_dotenv()
+
+from engine import EngineInputError, get_engine
+from fleet_state import FLEET_PINGS_PORT
+from instrumentation import METRICS_PATH, count, enable, process_metrics_path, render_prometheus, start_exporters
+from map_layers import MAX_ZOOM, MIN_ZOOM
+
+# Bookings arriving within this window (seconds) are dispatched together, up to MAX_BATCH at a time
+BATCH_DELAY = 0.01
+MAX_BATCH = 64
+
+
+# Collects concurrent requests for a short window and hands them to handler(items) in one call on a worker thread
+class MicroBatcher:
+    def __init__(self, handler, max_batch=MAX_BATCH, max_delay=BATCH_DELAY):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        count("service_batches")
+        count("service_batched_items", len(batch))
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(None, self.handler, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# Identical concurrent calls share one computation (e.g. many clients asking for the same day's plan)
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, key, fn, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, fn, *args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            count("service_coalesced")
+        return await asyncio.shield(task)
+
+
+def _dispatch_batch(bookings):
+    # Bookings against the same fleet are matched jointly, others separately
+    engine = get_engine()
+    results = [None] * len(bookings)
+    groups = {}
+    for i, booking in enumerate(bookings):
+        key = tuple(sorted((name, p["lat"], p["lon"]) for name, p in (booking.get("shuttles") or {}).items()))
+        groups.setdefault(key, []).append(i)
+    for indices in groups.values():
+        shuttles = bookings[indices[0]].get("shuttles")
+        for i, result in zip(indices, engine.dispatch([bookings[i] for i in indices], shuttles)):
+            results[i] = result
+    return results
+
+
+def _query(request, name, parse, default=None):
+    value = request.query.get(name)
+    if value is None:
+        if default is None:
+            raise web.HTTPBadRequest(text=f"Missing query parameter {name}")
+        return default
+    try:
+        return parse(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"Invalid value for {name}: {value}")
+
+
+async def health(request):
+    return web.json_response({"status": "ok", "pid": os.getpid()})
+
+
+# GET /forecast?date=YYYY-MM-DD&hour=H -> predicted demand per pickup ID
+async def forecast(request):
+    forecast_date = _query(request, "date", pd.Timestamp)
+    forecast_hour = _query(request, "hour", int)
+    if not 0 <= forecast_hour <= 23:
+        raise web.HTTPBadRequest(text="hour must be 0-23")
+    hourly_demand, _, _, warnings, nowcast = await request.app["single_flight"].run(
+        ("forecast", forecast_date, forecast_hour), get_engine().forecast, forecast_date, forecast_hour
+    )
+    return web.json_response({"demand": {str(k): v for k, v in hourly_demand.items()}, "warnings": warnings, "nowcast": nowcast})
+
+
+# GET /preposition?date=YYYY-MM-DD&hour=H&fleet_size=N -> Engine.preposition result
+async def preposition(request):
+    forecast_date = _query(request, "date", pd.Timestamp)
+    forecast_hour = _query(request, "hour", int)
+    fleet_size = _query(request, "fleet_size", int, 2)
+    if not 0 <= forecast_hour <= 23 or fleet_size < 1:
+        raise web.HTTPBadRequest(text="hour must be 0-23 and fleet_size at least 1")
+    try:
+        result = await request.app["single_flight"].run(
+            ("preposition", forecast_date, forecast_hour, fleet_size), get_engine().preposition, forecast_date, forecast_hour, fleet_size
+        )
+    except EngineInputError as e:
+        raise web.HTTPUnprocessableEntity(text=str(e))
+    return web.json_response(result)
+
+
+# A coordinate pair as two finite floats, ValueError otherwise
+def _point(value):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError(f"Expected a coordinate pair, got {value!r}")
+    point = [float(v) for v in value]
+    if not np.isfinite(point).all():
+        raise ValueError(f"Expected finite coordinates, got {value!r}")
+    return point
+
+
+# Booking from a request body, fully validated here so one bad booking never reaches (and fails) a micro-batch
+async def _booking(request):
+    try:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise TypeError(body)
+        passengers = body.get("passengers", 1)
+        booking = {"pickup": _point(body["pickup"]), "dropoff": _point(body["dropoff"]), "passengers": int(passengers)}
+        if isinstance(passengers, bool) or booking["passengers"] != float(passengers) or booking["passengers"] < 1:
+            raise ValueError(passengers)
+        shuttles = body.get("shuttles")
+        if shuttles is not None:
+            if not isinstance(shuttles, dict) or not shuttles:
+                raise TypeError(shuttles)
+            booking["shuttles"] = {}
+            for name, position in shuttles.items():
+                lat, lon = _point([position["lat"], position["lon"]])
+                booking["shuttles"][str(name)] = {"lat": lat, "lon": lon}
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(text="Expected JSON with pickup and dropoff [lat, lon], passengers at least 1 "
+                                      "and optional shuttles {name: {lat, lon}}")
+    return booking
+
+
+# POST /dispatch {"pickup": [lat, lon], "dropoff": [lat, lon], "passengers": n, "shuttles": optional {name: {lat, lon}}}
+async def dispatch(request):
+    booking = await _booking(request)
+    return web.json_response(await request.app["dispatcher"].submit(booking))
+
+
+# POST /rank {"pickup": [lat, lon], "dropoff": [lat, lon], "passengers": n} -> shuttles with free seats, cheapest first
+async def rank(request):
+    booking = await _booking(request)
+    return web.json_response(await asyncio.get_running_loop().run_in_executor(None, get_engine().rank, booking))
+
+
+# POST /route {"start": [lon, lat], "end": [lon, lat]} -> coordinates, distance, duration, co2_emission
+async def route(request):
+    try:
+        body = await request.json()
+        start, end = _point(body["start"]), _point(body["end"])
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(text="Expected JSON with start and end [lon, lat]")
+    coordinates, distance, duration, co2_emission = await request.app["single_flight"].run(
+        ("route", tuple(start), tuple(end)), get_engine().route, start, end
+    )
+    return web.json_response({"coordinates": coordinates, "distance": distance, "duration": duration, "co2_emission": co2_emission})
+
+
+# GET /layers/{pickups|dropoffs}?zoom=Z&hour=H -> GeoJSON grid
+async def map_grid(request):
+    layer = request.match_info["layer"]
+    if layer not in ("pickups", "dropoffs"):
+        raise web.HTTPNotFound()
+    hour = _query(request, "hour", int, -1)
+    zoom = _query(request, "zoom", int, 13)
+    if not -1 <= hour <= 23 or not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        raise web.HTTPBadRequest(text=f"hour must be 0-23 and zoom {MIN_ZOOM}-{MAX_ZOOM}")
+    geojson = await request.app["single_flight"].run(
+        ("layer", layer, hour, zoom), get_engine().map_grid, layer, None if hour < 0 else hour, zoom
+    )
+    return web.json_response(geojson)
+
+
+# GET /fleet -> position, occupancy, seats, ETA and route of every vehicle in this process's fleet state
+async def fleet(request):
+    snapshot = get_engine().fleet.snapshot()
+    vehicles = [{"vehicle_id": vehicle_id, "lat": float(snapshot.lat[i]), "lon": float(snapshot.lon[i]),
+                 "occupancy": int(snapshot.occupancy[i]), "seats": int(snapshot.seats[i]),
+                 "eta": None if np.isnan(snapshot.eta[i]) else float(snapshot.eta[i]), "route": snapshot.routes.get(vehicle_id)}
+                for i, vehicle_id in enumerate(snapshot.vehicle_ids)]
+    return web.json_response({"version": snapshot.version, "vehicles": vehicles})
+
+
+# POST /fleet/bookings {"shuttle": name, "passengers": n, "route": optional [[lon, lat], ...], "eta": optional epoch seconds}
+async def book(request):
+    try:
+        body = await request.json()
+        shuttle, passengers = str(body["shuttle"]), int(body["passengers"])
+        eta = None if body.get("eta") is None else float(body["eta"])
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(text="Expected JSON with shuttle and passengers")
+    if passengers < 1:
+        raise web.HTTPBadRequest(text="passengers must be at least 1")
+    try:
+        booking_id = get_engine().book(shuttle, passengers, body.get("route"), eta)
+    except KeyError:
+        raise web.HTTPNotFound(text=f"Unknown shuttle {shuttle}")
+    return web.json_response({"status": "booked", "booking_id": booking_id})
+
+
+# DELETE /fleet/bookings/{booking_id} -> {"cancelled": false} when the booking already finished
+async def cancel_booking(request):
+    try:
+        booking_id = int(request.match_info["booking_id"])
+    except ValueError:
+        raise web.HTTPBadRequest(text="booking_id must be an integer")
+    return web.json_response({"cancelled": get_engine().cancel_booking(booking_id)})
+
+
+async def metrics(request):
+    return web.Response(text=render_prometheus(), content_type="text/plain")
+
+
+async def _warm_up(app):
+    # Models, forecast table and matrices are loaded before the first request arrives
+    await asyncio.get_running_loop().run_in_executor(None, get_engine().warm_up)
+
+
+def make_app():
+    # The service always collects metrics, they are served on /metrics
+    enable()
+    app = web.Application()
+    app["dispatcher"] = MicroBatcher(_dispatch_batch)
+    app["single_flight"] = SingleFlight()
+    app.on_startup.append(_warm_up)
+    app.add_routes([
+        web.get("/health", health),
+        web.get("/forecast", forecast),
+        web.get("/preposition", preposition),
+        web.post("/dispatch", dispatch),
+        web.post("/rank", rank),
+        web.post("/route", route),
+        web.get("/layers/{layer}", map_grid),
+        web.get("/fleet", fleet),
+        web.post("/fleet/bookings", book),
+        web.delete("/fleet/bookings/{booking_id}", cancel_booking),
+        web.get("/metrics", metrics),
+    ])
+    return app
+
+
+def _serve(host, port, reuse_port):
+    # Metrics are served on /metrics, only the METRICS_PATH file writer is started
+    # With several workers each one writes its own file, scrape or sum them together
+    path = METRICS_PATH
+    if path and reuse_port:
+        path = process_metrics_path(path)
+    start_exporters(path=path, port=None)
+    web.run_app(make_app(), host=host, port=port, reuse_port=reuse_port, print=None)
+
+
+# One process per worker, all listening on the same port (SO_REUSEPORT lets the kernel spread connections)
+def serve(host="0.0.0.0", port=8000, workers=1):
+    if workers == 1:
+        _serve(host, port, False)
+        return
+    processes = [multiprocessing.Process(target=_serve, args=(host, port, True), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP service for forecasting, prepositioning and dispatch")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--split-fleet", action="store_true",
+                        help="Allow several workers, each dispatching and booking against its own copy of the fleet")
+    args = parser.parse_args()
+    # Every worker keeps its own fleet state: a /rank and the following /fleet/bookings may reach different workers,
+    # and only one of them could listen for the pings
+    if args.workers > 1 and FLEET_PINGS_PORT:
+        parser.error("FLEET_PINGS_PORT needs --workers 1")
+    if args.workers > 1 and not args.split_fleet:
+        parser.error("several workers do not share seat bookings, pass --split-fleet to run them anyway")
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,287 @@
+import heapq
+import time
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import KMeans
+from demand_tensor import DemandTensor
+from dispatch import calculate_cost
+from prepositioning_plan import plan_prepositioning
+from stop_matrix import CO2, DISTANCE, DURATION, StopMatrix
+from trip_store import load_trips
+
+# Event kinds, ordered so that at equal times vehicles are freed before new bookings are dispatched
+DROPOFF, PICKUP, REPOSITION, REQUEST = 0, 1, 2, 3
+
+# Bookings that would wait longer than this (minutes) are counted as lost
+MAX_WAIT_MINUTES = 30
+# Weeks of bookings before the replay that the repositioning policies plan from
+HISTORY_WEEKS = 4
+
+
+class Vehicle:
+    __slots__ = ("vehicle_id", "stop", "free_at", "served", "deadhead_km", "service_km")
+
+    def __init__(self, vehicle_id, stop, free_at=0.0):
+        self.vehicle_id = vehicle_id
+        # Position of the stop (in the stop matrix) where the vehicle is, or will be once free
+        self.stop = stop
+        self.free_at = free_at
+        self.served = 0
+        self.deadhead_km = 0.0
+        self.service_km = 0.0
+
+
+class Request:
+    __slots__ = ("booking_id", "time", "pickup", "dropoff", "passengers", "cancelled", "vehicle", "wait")
+
+    def __init__(self, booking_id, time, pickup, dropoff, passengers, cancelled):
+        self.booking_id = booking_id
+        # Minutes since the start of the simulation
+        self.time = time
+        self.pickup = pickup
+        self.dropoff = dropoff
+        self.passengers = passengers
+        # True when the booking was cancelled in the real trip log
+        self.cancelled = cancelled
+        self.vehicle = None
+        self.wait = None
+
+
+# Dispatch policy: the vehicle with the lowest calculate_cost over approach + trip, where waiting for a busy
+# vehicle to become free counts as approach time
+class CostDispatch:
+    def __init__(self, max_wait=MAX_WAIT_MINUTES):
+        self.max_wait = max_wait
+
+    def choose(self, sim, request):
+        stops = np.fromiter((v.stop for v in sim.vehicles), dtype=np.int64, count=len(sim.vehicles))
+        free_at = np.fromiter((v.free_at for v in sim.vehicles), dtype=np.float64, count=len(sim.vehicles))
+        wait = np.maximum(free_at - request.time, 0) + sim.duration[stops, request.pickup]
+        distance = sim.distance[stops, request.pickup] + sim.distance[request.pickup, request.dropoff]
+        co2_emission = sim.co2[stops, request.pickup] + sim.co2[request.pickup, request.dropoff]
+        cost = calculate_cost(distance, wait + sim.duration[request.pickup, request.dropoff], request.passengers, co2_emission)
+        cost[wait > self.max_wait] = np.inf
+        vehicle = int(np.argmin(cost))
+        return vehicle if np.isfinite(cost[vehicle]) else -1
+
+
+# Dispatch policy: the vehicle that can reach the pickup first
+class NearestDispatch:
+    def __init__(self, max_wait=MAX_WAIT_MINUTES):
+        self.max_wait = max_wait
+
+    def choose(self, sim, request):
+        stops = np.fromiter((v.stop for v in sim.vehicles), dtype=np.int64, count=len(sim.vehicles))
+        free_at = np.fromiter((v.free_at for v in sim.vehicles), dtype=np.float64, count=len(sim.vehicles))
+        wait = np.maximum(free_at - request.time, 0) + sim.duration[stops, request.pickup]
+        vehicle = int(np.argmin(wait))
+        return vehicle if wait[vehicle] <= self.max_wait else -1
+
+
+# Repositioning policy: idle vehicles stay where their last trip ended
+class NoRepositioning:
+    def targets(self, sim, hour):
+        return None
+
+
+# Repositioning policy: weighted KMeans over the stops with the hour's demand, centres snapped to the nearest stop
+class KMeansRepositioning:
+    def __init__(self, demand):
+        # Demand per stop and hour of the simulation, shape [stops x hours]
+        self.demand = demand
+
+    def targets(self, sim, hour):
+        weights = self.demand[:, hour]
+        stops = np.nonzero(weights > 0)[0]
+        if len(stops) == 0:
+            return None
+        n_clusters = min(len(sim.vehicles), len(stops))
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=1)
+        kmeans.fit(sim.coordinates[stops], sample_weight=weights[stops])
+        nearest = ((sim.coordinates[None, :, :] - kmeans.cluster_centers_[:, None, :]) ** 2).sum(axis=2).argmin(axis=1)
+        return np.resize(nearest, len(sim.vehicles))
+
+
+# Repositioning policy: the rolling-horizon plan from prepositioning_plan, computed once for the whole run
+class PlanRepositioning:
+    def __init__(self, demand, **plan_options):
+        self.demand = demand
+        self.plan_options = plan_options
+        self.plan = None
+
+    def targets(self, sim, hour):
+        if self.plan is None:
+            self.plan = plan_prepositioning(self.demand, sim.duration, sim.distance, len(sim.vehicles), **self.plan_options)[0]
+        return self.plan[hour]
+
+
+# Discrete-event replay of bookings against a fleet, with pluggable dispatch and repositioning policies
+class Simulator:
+    def __init__(self, stop_matrix, fleet_size, dispatch_policy=None, reposition_policy=None, initial_stops=None):
+        self.stop_matrix = stop_matrix
+        self.distance = np.asarray(stop_matrix.matrix[DISTANCE], dtype=np.float64)
+        self.duration = np.asarray(stop_matrix.matrix[DURATION], dtype=np.float64)
+        self.co2 = np.asarray(stop_matrix.matrix[CO2], dtype=np.float64)
+        self.coordinates = np.column_stack([stop_matrix.latitudes, stop_matrix.longitudes])
+        self.dispatch_policy = dispatch_policy or CostDispatch()
+        self.reposition_policy = reposition_policy or NoRepositioning()
+
+        if initial_stops is None:
+            initial_stops = np.arange(fleet_size) % len(stop_matrix)
+        self.vehicles = [Vehicle(i, int(stop)) for i, stop in enumerate(initial_stops)]
+        self.queue = []
+        self._sequence = 0
+        self.events = 0
+
+    def schedule(self, event_time, kind, payload):
+        # The sequence number keeps the heap stable and avoids comparing payloads
+        heapq.heappush(self.queue, (event_time, kind, self._sequence, payload))
+        self._sequence += 1
+
+    # Booking log -> Request objects in minutes since start; bookings on stops missing from the matrix are skipped
+    def requests_from_trips(self, trips, start):
+        known = np.array([pickup in self.stop_matrix and dropoff in self.stop_matrix
+                          for pickup, dropoff in zip(trips["Pickup ID"], trips["Dropoff ID"])], dtype=bool)
+        trips = trips[known]
+        minutes = ((trips["Actual Pickup Time"] - pd.Timestamp(start)).dt.total_seconds() / 60).to_numpy()
+        pickups = self.stop_matrix.index_of(trips["Pickup ID"].to_numpy())
+        dropoffs = self.stop_matrix.index_of(trips["Dropoff ID"].to_numpy())
+        cancelled = (trips["Passenger status"] == "Cancelled").to_numpy()
+        return [
+            Request(booking_id, minute, pickup, dropoff, passengers, was_cancelled)
+            for booking_id, minute, pickup, dropoff, passengers, was_cancelled in zip(
+                trips["Booking ID"].to_numpy(), minutes, pickups, dropoffs, trips["Passengers"].to_numpy(), cancelled
+            )
+        ]
+
+    def _dispatch(self, now, request):
+        choice = self.dispatch_policy.choose(self, request)
+        if choice < 0:
+            return
+        vehicle = self.vehicles[choice]
+        arrival = max(now, vehicle.free_at) + self.duration[vehicle.stop, request.pickup]
+        dropoff_time = arrival + self.duration[request.pickup, request.dropoff]
+        vehicle.deadhead_km += self.distance[vehicle.stop, request.pickup]
+        vehicle.service_km += self.distance[request.pickup, request.dropoff]
+        vehicle.stop = request.dropoff
+        vehicle.free_at = dropoff_time
+        request.vehicle = choice
+        request.wait = arrival - request.time
+        self.schedule(arrival, PICKUP, request)
+        self.schedule(dropoff_time, DROPOFF, request)
+
+    def _reposition(self, now, hour):
+        targets = self.reposition_policy.targets(self, hour)
+        if targets is None:
+            return
+        idle = [v for v in self.vehicles if v.free_at <= now]
+        if not idle:
+            return
+        # Send idle vehicles to the targets with the least total deadhead
+        current = np.array([v.stop for v in idle])
+        rows, cols = linear_sum_assignment(self.distance[np.ix_(current, np.asarray(targets))])
+        for row, col in zip(rows, cols):
+            vehicle, target = idle[row], int(targets[col])
+            if vehicle.stop != target:
+                vehicle.deadhead_km += self.distance[vehicle.stop, target]
+                vehicle.free_at = now + self.duration[vehicle.stop, target]
+                vehicle.stop = target
+
+    # Replay the requests, returns a dict of summary metrics
+    def run(self, requests, hours=None):
+        if hours is None:
+            hours = int(max((r.time for r in requests), default=0) // 60) + 1
+        for request in requests:
+            self.schedule(request.time, REQUEST, request)
+        for hour in range(hours):
+            self.schedule(hour * 60.0, REPOSITION, hour)
+
+        started = time.perf_counter()
+        completed = 0
+        while self.queue:
+            now, kind, _, payload = heapq.heappop(self.queue)
+            self.events += 1
+            if kind == REQUEST:
+                self._dispatch(now, payload)
+            elif kind == REPOSITION:
+                self._reposition(now, payload)
+            elif kind == DROPOFF:
+                completed += 1
+        elapsed = time.perf_counter() - started
+
+        waits = np.array([r.wait for r in requests if r.wait is not None])
+        served_cancelled = sum(1 for r in requests if r.cancelled and r.wait is not None)
+        return {
+            "requests": len(requests),
+            "served": completed,
+            "lost": len(requests) - completed,
+            "mean_wait_min": float(waits.mean()) if len(waits) else None,
+            "p90_wait_min": float(np.percentile(waits, 90)) if len(waits) else None,
+            "cancellations_avoided": served_cancelled,
+            "deadhead_km": float(sum(v.deadhead_km for v in self.vehicles)),
+            "service_km": float(sum(v.service_km for v in self.vehicles)),
+            "events": self.events,
+            "seconds": elapsed,
+            "events_per_sec": self.events / elapsed if elapsed > 0 else float("inf"),
+        }
+
+
+# Expected demand per stop and hour of [start, end), shape [stops x hours], known before the replay starts:
+# the mean count of the same weekday and hour over the history_weeks before start (a seasonal naive forecast)
+# Planning from the replayed trips themselves would let the policies see the future bookings they are scored on
+def history_demand(stop_ids, start, end, history_weeks=HISTORY_WEEKS, history=None):
+    history_start = pd.Timestamp(start) - pd.Timedelta(weeks=history_weeks)
+    if history is None:
+        history = load_trips(columns=["Pickup ID", "Actual Pickup Time"], start=history_start, end=start)
+    past = DemandTensor.from_trips(history, stop_ids, history_start, start)
+    past_slots = (past.timestamps.dayofweek * 24 + past.timestamps.hour).to_numpy()
+    profile = np.zeros((len(past.stop_ids), 7 * 24))
+    np.add.at(profile.T, past_slots, past.counts.T)
+    profile /= np.maximum(np.bincount(past_slots, minlength=7 * 24), 1)
+    hours = pd.date_range(pd.Timestamp(start).floor("h"), pd.Timestamp(end).ceil("h"), freq="h", inclusive="left")
+    return profile[:, (hours.dayofweek * 24 + hours.hour).to_numpy()]
+
+
+# Replay the FLEXI trip log between start and end with the named policies
+# Repositioning plans from history_demand, the trips before start (history, loaded from the trip store by default)
+def simulate(start, end, fleet_size, dispatch="cost", reposition="none", trips=None, stop_matrix=None, max_wait=MAX_WAIT_MINUTES,
+             history=None, history_weeks=HISTORY_WEEKS):
+    stop_matrix = stop_matrix or StopMatrix()
+    if trips is None:
+        trips = load_trips(
+            columns=["Booking ID", "Passenger status", "Passengers", "Pickup ID", "Dropoff ID", "Actual Pickup Time"],
+            start=start, end=end,
+        )
+    dispatch_policy = {"cost": CostDispatch, "nearest": NearestDispatch}[dispatch](max_wait)
+    sim = Simulator(stop_matrix, fleet_size, dispatch_policy)
+    requests = sim.requests_from_trips(trips, start)
+
+    # One repositioning step per hour of the replay window
+    hours = DemandTensor.from_trips(trips, stop_matrix.stop_ids, start, end).hours
+    if reposition != "none":
+        demand = history_demand(stop_matrix.stop_ids, start, end, history_weeks, history)
+        if not demand.any():
+            print(f"No bookings in the {history_weeks} weeks before {start}, idle vehicles will not be repositioned")
+        policy = {"kmeans": KMeansRepositioning, "plan": PlanRepositioning}[reposition]
+        sim.reposition_policy = policy(demand)
+    return sim.run(requests, hours)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Replay FLEXI bookings against a simulated fleet")
+    parser.add_argument("--start", default="2024-09-01")
+    parser.add_argument("--end", default="2024-10-01")
+    parser.add_argument("--fleet-size", type=int, default=5)
+    parser.add_argument("--dispatch", choices=["cost", "nearest"], default="cost")
+    parser.add_argument("--reposition", choices=["none", "kmeans", "plan"], default="none")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT_MINUTES)
+    parser.add_argument("--history-weeks", type=int, default=HISTORY_WEEKS,
+                        help="Weeks of bookings before --start that repositioning plans from")
+    args = parser.parse_args()
+    result = simulate(args.start, args.end, args.fleet_size, args.dispatch, args.reposition, max_wait=args.max_wait,
+                      history_weeks=args.history_weeks)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,65 @@
+import hashlib
+import numpy as np
+from sklearn.neighbors import BallTree
+from geo import EARTH_RADIUS_KM
+
+# Built indexes keyed by name, each stored with a fingerprint of its points
+_index_cache = {}
+
+
+# Nearest-neighbour and radius queries over (lat, lon) points using a haversine BallTree
+class SpatialIndex:
+    def __init__(self, points, items=None):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.items = list(items) if items is not None else list(range(len(self.points)))
+        self.tree = BallTree(np.radians(self.points), metric="haversine")
+
+    def __len__(self):
+        return len(self.points)
+
+    # k nearest points for each query point, returns distances in metres and indices, both [queries x k]
+    def nearest(self, query_points, k=1):
+        query = np.radians(np.asarray(query_points, dtype=np.float64).reshape(-1, 2))
+        distances, indices = self.tree.query(query, k=min(k, len(self.points)))
+        return distances * EARTH_RADIUS_KM * 1000, indices
+
+    # Items of the k nearest points for each query point
+    def nearest_items(self, query_points, k=1):
+        _, indices = self.nearest(query_points, k)
+        return [[self.items[i] for i in row] for row in indices]
+
+    # Indices (and distances in metres) of all points within radius_m of each query point, closest first
+    def within_radius(self, query_points, radius_m):
+        query = np.radians(np.asarray(query_points, dtype=np.float64).reshape(-1, 2))
+        indices, distances = self.tree.query_radius(
+            query, r=radius_m / (EARTH_RADIUS_KM * 1000), return_distance=True, sort_results=True
+        )
+        return [(idx, dist * EARTH_RADIUS_KM * 1000) for idx, dist in zip(indices, distances)]
+
+
+def _fingerprint(points, items=None):
+    digest = hashlib.sha1(np.ascontiguousarray(points, dtype=np.float64).tobytes())
+    # Items are part of the key too, the same coordinates may carry other lot names or IDs
+    digest.update(repr(None if items is None else list(items)).encode())
+    return digest.hexdigest()
+
+
+# Shared index by name, rebuilt only when its points or items change
+def get_index(name, points, items=None):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    fingerprint = _fingerprint(points, items)
+    cached = _index_cache.get(name)
+    if cached is None or cached[0] != fingerprint:
+        cached = (fingerprint, SpatialIndex(points, items))
+        _index_cache[name] = cached
+    return cached[1]
+
+
+# Index over ParkAPI lots given as (name, lat, lon, pickup_id) tuples
+def parking_index(parking_spots):
+    return get_index("parking", [(spot[1], spot[2]) for spot in parking_spots], parking_spots)
+
+
+# Index over the FLEXI bus stops, items are the stop IDs
+def bus_stop_index(stop_ids, latitudes, longitudes):
+    return get_index("bus_stops", np.column_stack([latitudes, longitudes]), [int(stop_id) for stop_id in stop_ids])
@@ -0,0 +1,201 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from geo import CO2_GRAMS_PER_KM, estimate_legs
+from spatial_index import bus_stop_index
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets")
+STOPS_PATH = os.path.join(DATASETS_DIR, "FLEXI_bus_stops.xlsx")
+MATRIX_PATH = os.path.join(DATASETS_DIR, "stop_matrix.npy")
+STOPS_INDEX_PATH = os.path.join(DATASETS_DIR, "stop_matrix_stops.npy")
+# Which leg function built the matrix: "road_graph" (shortest paths on the local road graph, see local_router.py)
+# or "estimate" (straight-line distance × geo.ROAD_FACTOR at geo.AVERAGE_SPEED_KMH, not real road values)
+SOURCE_PATH = os.path.join(DATASETS_DIR, "stop_matrix_source.json")
+
+# Layers of the matrix along the first axis
+DISTANCE, DURATION, CO2 = 0, 1, 2
+
+
+# Load the FLEXI bus stops (stop ID, latitude, longitude)
+def load_bus_stops(path=STOPS_PATH):
+    bus_stops = pd.read_excel(path, engine="openpyxl")
+    return bus_stops[["index", "latitude", "longitude"]].sort_values("index").reset_index(drop=True)
+
+
+# Straight-line estimate, used when no road graph is available
+def estimate_leg_fn(origins, destinations):
+    distance, duration, _ = estimate_legs(origins[:, 0], origins[:, 1], destinations[:, 0], destinations[:, 1])
+    return distance, duration
+
+
+# Fastest paths on the local road graph, pairs the graph cannot connect fall back to the straight-line estimate
+def road_leg_fn(origins, destinations):
+    from local_router import get_local_router
+    router = get_local_router()
+    distance, duration = estimate_leg_fn(origins, destinations)
+    unrouted = 0
+    for i, (origin, destination) in enumerate(zip(origins, destinations)):
+        _, km, minutes, _ = router.route([origin[1], origin[0]], [destination[1], destination[0]])
+        if km is None:
+            unrouted += 1
+            continue
+        distance[i], duration[i] = km, minutes
+    if unrouted:
+        print(f"{unrouted} of {len(origins)} stop pairs not connected in the road graph, estimated instead")
+    return distance, duration
+
+
+# Road graph legs when datasets/road_graph.npz (or ROAD_GRAPH_PATH) exists, otherwise the estimate
+def default_leg_fn():
+    from local_router import ROAD_GRAPH_PATH
+    if os.path.exists(ROAD_GRAPH_PATH):
+        return "road_graph", road_leg_fn
+    return "estimate", estimate_leg_fn
+
+
+# Build the dense [3 x N x N] distance/duration/CO₂ matrix, reusing cells of a previous build when given
+def build_stop_matrix(bus_stops, leg_fn=estimate_leg_fn, previous=None):
+    stops = np.column_stack([
+        bus_stops["index"].to_numpy(dtype=np.float64),
+        bus_stops["latitude"].to_numpy(dtype=np.float64),
+        bus_stops["longitude"].to_numpy(dtype=np.float64),
+    ])
+    n = len(stops)
+    matrix = np.zeros((3, n, n), dtype=np.float32)
+    known = np.zeros(n, dtype=bool)
+
+    # Copy over every pair whose stops were already in the previous matrix with the same coordinates
+    if previous is not None:
+        old_stops, old_matrix = previous
+        old_position = {int(row[0]): i for i, row in enumerate(old_stops)}
+        new_pos, old_pos = [], []
+        for i, row in enumerate(stops):
+            j = old_position.get(int(row[0]))
+            if j is not None and np.allclose(old_stops[j, 1:], row[1:]):
+                new_pos.append(i)
+                old_pos.append(j)
+        if new_pos:
+            new_pos, old_pos = np.array(new_pos), np.array(old_pos)
+            known[new_pos] = True
+            matrix[:, new_pos[:, None], new_pos[None, :]] = old_matrix[:, old_pos[:, None], old_pos[None, :]]
+
+    # Only pairs touching a new (or moved) stop need to be computed
+    rows, cols = np.nonzero(~known[:, None] | ~known[None, :])
+    off_diagonal = rows != cols
+    rows, cols = rows[off_diagonal], cols[off_diagonal]
+    if len(rows):
+        distance, duration = leg_fn(stops[rows, 1:], stops[cols, 1:])
+        matrix[DISTANCE, rows, cols] = distance
+        matrix[DURATION, rows, cols] = duration
+        matrix[CO2, rows, cols] = np.asarray(distance) * CO2_GRAMS_PER_KM
+    return stops, matrix
+
+
+# Save the matrix and its stop index as plain .npy files so they can be memory-mapped, plus the source of its legs
+def save_stop_matrix(stops, matrix, matrix_path=MATRIX_PATH, stops_path=STOPS_INDEX_PATH, source="estimate", source_path=SOURCE_PATH):
+    np.save(matrix_path, matrix.astype(np.float32))
+    np.save(stops_path, stops)
+    with open(source_path, "w") as f:
+        json.dump({"source": source}, f)
+
+
+# Source of a saved matrix, matrices saved without one were built from estimates
+def read_source(source_path=SOURCE_PATH):
+    if not os.path.exists(source_path):
+        return "estimate"
+    with open(source_path) as f:
+        return json.load(f)["source"]
+
+
+# Rebuild the matrix from the bus stop sheet, only computing legs for stops that are new or moved
+# Cells of a previous matrix are only reused when it was built from the same source
+def update_stop_matrix(bus_stops_path=STOPS_PATH, matrix_path=MATRIX_PATH, stops_path=STOPS_INDEX_PATH, leg_fn=None,
+                       source=None, source_path=SOURCE_PATH):
+    if leg_fn is None:
+        source, leg_fn = default_leg_fn()
+    source = source or "custom"
+    previous = None
+    if os.path.exists(matrix_path) and os.path.exists(stops_path) and read_source(source_path) == source:
+        previous = (np.load(stops_path), np.load(matrix_path))
+    stops, matrix = build_stop_matrix(load_bus_stops(bus_stops_path), leg_fn=leg_fn, previous=previous)
+    save_stop_matrix(stops, matrix, matrix_path, stops_path, source, source_path)
+    return stops, matrix
+
+
+# Build the matrix when it is missing or older than the bus stop sheet; it is generated, not kept in git
+def ensure_stop_matrix(bus_stops_path=STOPS_PATH, matrix_path=MATRIX_PATH, stops_path=STOPS_INDEX_PATH):
+    outputs = [matrix_path, stops_path]
+    if all(os.path.exists(p) for p in outputs):
+        if min(os.path.getmtime(p) for p in outputs) >= os.path.getmtime(bus_stops_path):
+            return
+    update_stop_matrix(bus_stops_path, matrix_path, stops_path)
+
+
+# Read-only lookup API over the precomputed matrix
+class StopMatrix:
+    def __init__(self, matrix_path=MATRIX_PATH, stops_path=STOPS_INDEX_PATH, mmap=True, source_path=SOURCE_PATH):
+        if matrix_path == MATRIX_PATH and stops_path == STOPS_INDEX_PATH:
+            ensure_stop_matrix()
+        # "road_graph" or "estimate", see SOURCE_PATH
+        self.source = read_source(source_path)
+        self.matrix = np.load(matrix_path, mmap_mode="r" if mmap else None)
+        self.stops = np.load(stops_path)
+        self.stop_ids = self.stops[:, 0].astype(np.int64)
+        self.latitudes = self.stops[:, 1]
+        self.longitudes = self.stops[:, 2]
+        # Stop IDs are small integers, so a dense ID -> position array gives O(1) lookups
+        self._position = np.full(self.stop_ids.max() + 1, -1, dtype=np.int64)
+        self._position[self.stop_ids] = np.arange(len(self.stop_ids))
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def __contains__(self, stop_id):
+        return 0 <= stop_id < len(self._position) and self._position[stop_id] >= 0
+
+    def index_of(self, stop_ids):
+        stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        if np.any((stop_ids < 0) | (stop_ids >= len(self._position))):
+            raise KeyError(f"Unknown stop ID in {stop_ids}")
+        positions = self._position[stop_ids]
+        if np.any(positions < 0):
+            raise KeyError(f"Unknown stop ID in {stop_ids}")
+        return positions
+
+    @property
+    def distance(self):
+        return self.matrix[DISTANCE]
+
+    @property
+    def duration(self):
+        return self.matrix[DURATION]
+
+    @property
+    def co2(self):
+        return self.matrix[CO2]
+
+    # Distance (km), duration (minutes) and CO₂ (grams) between two stops
+    def lookup(self, from_id, to_id):
+        i, j = self.index_of([from_id, to_id])
+        return float(self.matrix[DISTANCE, i, j]), float(self.matrix[DURATION, i, j]), float(self.matrix[CO2, i, j])
+
+    # Vectorized lookup for arrays of stop ID pairs, returns a [3 x k] array
+    def lookup_many(self, from_ids, to_ids):
+        return np.asarray(self.matrix[:, self.index_of(from_ids), self.index_of(to_ids)])
+
+    # Nearest stop IDs (and distances in metres) for (lat, lon) points, shape [points x k]
+    def nearest_stops(self, points, k=1):
+        index = bus_stop_index(self.stop_ids, self.latitudes, self.longitudes)
+        distances, positions = index.nearest(points, k)
+        return self.stop_ids[positions], distances
+
+    # Sub-matrix (distance, duration or CO₂ layer) for a subset of stops
+    def submatrix(self, stop_ids, layer=DISTANCE):
+        positions = self.index_of(stop_ids)
+        return np.asarray(self.matrix[layer][np.ix_(positions, positions)])
+
+
+if __name__ == "__main__":
+    stops, matrix = update_stop_matrix()
+    print(f"Stop matrix with {len(stops)} stops ({read_source()} legs) saved to {MATRIX_PATH}")
@@ -0,0 +1,80 @@
+import os
+import pandas as pd
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datasets")
+RAW_TRIPS_PATH = os.path.join(DATASETS_DIR, "FLEXI_trip_data.xlsx")
+RAW_STOPS_PATH = os.path.join(DATASETS_DIR, "FLEXI_bus_stops.xlsx")
+TRIP_STORE_PATH = os.path.join(DATASETS_DIR, "trips.parquet")
+STOP_STORE_PATH = os.path.join(DATASETS_DIR, "bus_stops.parquet")
+
+# Row groups are kept small enough that date and ID filters can skip most of the file
+ROW_GROUP_SIZE = 50_000
+
+
+# Convert the raw Excel sheets once into typed Parquet files with the stop coordinates already joined
+def build_trip_store(trips_path=RAW_TRIPS_PATH, stops_path=RAW_STOPS_PATH, out_path=TRIP_STORE_PATH, stops_out_path=STOP_STORE_PATH):
+    trip_data = pd.read_excel(trips_path, engine="openpyxl")
+    bus_stops = pd.read_excel(stops_path, engine="openpyxl")
+
+    bus_stops = bus_stops.astype({"index": "int32", "name": "category", "district": "category"})
+    bus_stops.to_parquet(stops_out_path, index=False)
+
+    # Attach pickup and dropoff stop details (left joins keep trips whose stops are unknown)
+    pickup_stops = bus_stops.rename(columns={
+        "index": "Pickup ID", "name": "Pickup Name", "district": "Pickup District",
+        "latitude": "Pickup Latitude", "longitude": "Pickup Longitude",
+    })
+    dropoff_stops = bus_stops.rename(columns={
+        "index": "Dropoff ID", "name": "Dropoff Name", "district": "Dropoff District",
+        "latitude": "Dropoff Latitude", "longitude": "Dropoff Longitude",
+    })
+    trips = trip_data.astype({"Booking ID": "int32", "Pickup ID": "int32", "Dropoff ID": "int32", "Passengers": "int32"})
+    trips = trips.merge(pickup_stops, on="Pickup ID", how="left").merge(dropoff_stops, on="Dropoff ID", how="left")
+
+    trips["Actual Pickup Time"] = pd.to_datetime(trips["Actual Pickup Time"])
+    trips["Actual Dropoff Time"] = pd.to_datetime(trips["Actual Dropoff Time"])
+    trips = trips.astype({"Status": "category", "Passenger status": "category"})
+
+    # Sorting by pickup time gives tight min/max statistics per row group for date range filters
+    trips = trips.sort_values("Actual Pickup Time").reset_index(drop=True)
+    trips.to_parquet(out_path, index=False, row_group_size=ROW_GROUP_SIZE)
+    return trips
+
+
+# Rebuild the store when it is missing or older than the raw sheets
+def ensure_trip_store(trips_path=RAW_TRIPS_PATH, stops_path=RAW_STOPS_PATH, out_path=TRIP_STORE_PATH, stops_out_path=STOP_STORE_PATH):
+    outputs = [out_path, stops_out_path]
+    if all(os.path.exists(p) for p in outputs):
+        newest_input = max(os.path.getmtime(trips_path), os.path.getmtime(stops_path))
+        if min(os.path.getmtime(p) for p in outputs) >= newest_input:
+            return
+    build_trip_store(trips_path, stops_path, out_path, stops_out_path)
+
+
+# Load trips with column projection and predicate pushdown on pickup time, passenger status and pickup ID
+def load_trips(columns=None, start=None, end=None, status=None, pickup_ids=None, path=TRIP_STORE_PATH):
+    if path == TRIP_STORE_PATH:
+        ensure_trip_store()
+
+    filters = []
+    if start is not None:
+        filters.append(("Actual Pickup Time", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("Actual Pickup Time", "<", pd.Timestamp(end)))
+    if status is not None:
+        filters.append(("Passenger status", "in", [status] if isinstance(status, str) else list(status)))
+    if pickup_ids is not None:
+        filters.append(("Pickup ID", "in", [int(pickup_id) for pickup_id in pickup_ids]))
+    return pd.read_parquet(path, columns=columns, filters=filters or None)
+
+
+# Load the bus stop table (index, name, district, latitude, longitude)
+def load_stops(columns=None, path=STOP_STORE_PATH):
+    if path == STOP_STORE_PATH:
+        ensure_trip_store()
+    return pd.read_parquet(path, columns=columns)
+
+
+if __name__ == "__main__":
+    trips = build_trip_store()
+    print(f"Trip store with {len(trips)} trips written to {TRIP_STORE_PATH}")
@@ -1,89 +1,99 @@
-import openrouteservice
 import folium
-import pandas as pd
-import os
+import streamlit as st
 from dotenv import load_dotenv
 from streamlit_folium import folium_static
+from app_resources import get_router, get_stop_matrix, get_stops, get_trips
+from geo import estimate_legs
+from instrumentation import span, start_exporters
+from map_layers import cell_style, get_map_layers, max_count, points_geojson, routes_geojson
 
 # Load environment variables from .env file
 load_dotenv()
+start_exporters()
 
-# Initialize ORS client with your API key from the .env file
-ors_client = openrouteservice.Client(key=os.getenv("ORS_API_KEY"))
+# Offline road graph when ROUTING_BACKEND=local, otherwise the batched ORS client (created once per process)
+router = get_router()
 
-# Load data (adjust paths as needed)
-bus_stops_df = pd.read_excel('/Users/shendsanaja/Downloads/FLEXI_bus_stops.xlsx', engine='openpyxl')
-trip_data_df = pd.read_excel('/Users/shendsanaja/Downloads/FLEXI_trip_data.xlsx', engine='openpyxl')
-
-completed_trips = trip_data_df[trip_data_df['Passenger status'] == 'Trip completed']
-print("Completed Trips Sample:\n", completed_trips.head())
-
-# Merge to get pickup coordinates and rename them explicitly
-pickup_coords = completed_trips.merge(bus_stops_df, left_on='Pickup ID', right_on='index', how='left')
-pickup_coords = pickup_coords.rename(columns={'latitude': 'pickup_lat', 'longitude': 'pickup_lon', 'name': 'pickup_name'})
-print("After Pickup Merge Sample:\n", pickup_coords[['Pickup ID', 'pickup_lat', 'pickup_lon', 'pickup_name']].head())
-
-# Merge to get dropoff coordinates and rename them explicitly
-dropoff_coords = pickup_coords.merge(
-    bus_stops_df,
-    left_on='Dropoff ID',
-    right_on='index',
-    how='left',
-    suffixes=('_pickup', '_dropoff')
+# Load completed trips with pickup/dropoff coordinates already joined (columnar trip store, cached per process)
+bus_stops_df = get_stops(columns=['latitude', 'longitude'])
+completed_trips = get_trips(
+    columns=['Booking ID', 'Pickup ID', 'Dropoff ID', 'Pickup Latitude', 'Pickup Longitude', 'Pickup Name',
+             'Dropoff Latitude', 'Dropoff Longitude', 'Dropoff Name'],
+    status='Trip completed',
 )
-
-# Explicitly rename dropoff columns
-dropoff_coords = dropoff_coords.rename(columns={'latitude': 'dropoff_lat', 'longitude': 'dropoff_lon', 'name': 'dropoff_name'})
-print("After Dropoff Merge Sample:\n", dropoff_coords[['Dropoff ID', 'dropoff_lat', 'dropoff_lon', 'dropoff_name']].head())
+dropoff_coords = completed_trips.rename(columns={
+    'Pickup Latitude': 'pickup_lat', 'Pickup Longitude': 'pickup_lon', 'Pickup Name': 'pickup_name',
+    'Dropoff Latitude': 'dropoff_lat', 'Dropoff Longitude': 'dropoff_lon', 'Dropoff Name': 'dropoff_name',
+})
+print("Completed Trips Sample:\n", dropoff_coords[['Pickup ID', 'pickup_lat', 'pickup_lon', 'pickup_name']].head())
 
 # Filter rows to ensure complete pickup and dropoff coordinates
 dropoff_coords_clean = dropoff_coords.dropna(subset=['pickup_lat', 'pickup_lon', 'dropoff_lat', 'dropoff_lon'])
 print("Cleaned Dropoff Coordinates Sample:\n", dropoff_coords_clean[['pickup_lat', 'pickup_lon', 'dropoff_lat', 'dropoff_lon']].head())
 
+# Precomputed stop-to-stop distances/durations (built by stop_matrix.py)
+stop_matrix = get_stop_matrix()
+
 # Step 3: Initialize map
+MAP_ZOOM = 12
 map_center = [bus_stops_df['latitude'].mean(), bus_stops_df['longitude'].mean()]
-m = folium.Map(location=map_center, zoom_start=12)
+m = folium.Map(location=map_center, zoom_start=MAP_ZOOM)
+
+# Pickups of all trips binned into a grid for this zoom (pre-aggregated once, size independent of trip volume)
+pickup_grid = get_map_layers().grid("pickups", zoom=MAP_ZOOM)
+folium.GeoJson(
+    pickup_grid, name="Pickups",
+    style_function=cell_style(max_count(pickup_grid)),
+    tooltip=folium.GeoJsonTooltip(fields=["count"], aliases=["Pickups"]),
+).add_to(m)
 
 # Sample 10 random completed trips
 sampled_trips = dropoff_coords_clean.sample(10, random_state=1)
 
-# Proceed with the rest of the code using sampled_trips
-for i, row in sampled_trips.iterrows():
-    pickup_point = (row['pickup_lon'], row['pickup_lat'])
-    dropoff_point = (row['dropoff_lon'], row['dropoff_lat'])
-
-    try:
-        route = ors_client.directions(
-            coordinates=[pickup_point, dropoff_point],
-            profile='driving-car',
-            format='geojson'
-        )
-
-        # Extract route coordinates for plotting
-        route_coords = [(coord[1], coord[0]) for coord in route['features'][0]['geometry']['coordinates']]
-
-        # Add route to map
-        folium.PolyLine(route_coords, color="blue", weight=2.5, opacity=0.7).add_to(m)
-
-        # Add pickup and dropoff markers
-        folium.Marker(
-            location=[row['pickup_lat'], row['pickup_lon']],
-            popup=f"Pickup: {row['pickup_name']}",
-            icon=folium.Icon(color="blue"),
-        ).add_to(m)
+# Fetch all sampled routes in one batch (deduplicated, concurrent, rate limited)
+trip_pairs = [((row['pickup_lon'], row['pickup_lat']), (row['dropoff_lon'], row['dropoff_lat'])) for _, row in sampled_trips.iterrows()]
+trip_routes, route_errors = router.route_coords_batch(trip_pairs)
 
-        folium.Marker(
-            location=[row['dropoff_lat'], row['dropoff_lon']],
-            popup=f"Dropoff: {row['dropoff_name']}",
-            icon=folium.Icon(color="green"),
-        ).add_to(m)
-
-    except Exception as e:
+# Collect the routes and their labels, then draw them as one simplified layer
+route_labels = []
+for position, (i, row) in enumerate(sampled_trips.iterrows()):
+    if trip_routes[position] is None:
+        e = route_errors.get(position)
         print(f"Error fetching route for trip {i}: {e}")
         st.write(f"Error fetching route for trip {i}: {e}")  # Provide user feedback in case of error
+        route_labels.append({})
+        continue
+
+    try:
+        trip_distance, trip_duration, trip_co2 = stop_matrix.lookup(row['Pickup ID'], row['Dropoff ID'])
+    except KeyError:
+        # Stop outside the precomputed matrix, estimate from the coordinates instead
+        trip_distance, trip_duration, trip_co2 = (float(value) for value in estimate_legs(
+            row['pickup_lat'], row['pickup_lon'], row['dropoff_lat'], row['dropoff_lon']))
+    route_labels.append({"label": f"{trip_distance:.1f} km, ~{trip_duration:.0f} min, ~{trip_co2:.0f} g CO₂"})
+
+# Add routes to map
+folium.GeoJson(
+    routes_geojson(trip_routes, MAP_ZOOM, route_labels), name="Routes",
+    style_function=lambda feature: {"color": "blue", "weight": 2.5, "opacity": 0.7},
+    tooltip=folium.GeoJsonTooltip(fields=["label"], labels=False),
+).add_to(m)
+
+# Add pickup and dropoff markers of the routed trips, one layer each
+routed = sampled_trips[[route is not None for route in trip_routes]]
+for kind, color in [("pickup", "blue"), ("dropoff", "green")]:
+    folium.GeoJson(
+        points_geojson(routed[f'{kind}_lat'], routed[f'{kind}_lon'],
+                       [{"name": f"{kind.capitalize()}: {name}"} for name in routed[f'{kind}_name']]),
+        name=f"{kind.capitalize()}s",
+        marker=folium.CircleMarker(radius=6, fill=True, fill_opacity=0.9),
+        style_function=lambda feature, color=color: {"color": color, "fillColor": color},
+        popup=folium.GeoJsonPopup(fields=["name"], labels=False),
+    ).add_to(m)
 
 # Display map in Streamlit
-folium_static(m)
+with span("vgi_map"):
+    folium_static(m)
 
 # Save the map to HTML file (optional)
 m.save("vgi_flexi_real_routes_map.html")
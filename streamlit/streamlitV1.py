@@ -1,32 +1,10 @@
 import streamlit as st
-import pandas as pd
-import joblib
-from prophet import Prophet
-from datetime import datetime
+import os
+import sys
 from streamlit_navigation_bar import st_navbar
-import streamlit_home 
-import streamlit_products
-import streamlit_about
-
-
-# Function to load all pre-trained models
-def load_all_models(pickup_ids):
-    models = {}
-    for pickup_id in pickup_ids:
-        model_filename = f"prophet_model_pickup_{pickup_id}.pkl"
-        try:
-            models[pickup_id] = joblib.load(model_filename)
-        except FileNotFoundError:
-            st.write(f"Model for Pickup ID {pickup_id} not found.")
-    return models
-
-# Function to predict demand using a selected model
-def predict_demand(model, forecast_time):
-    future = pd.DataFrame({'ds': [forecast_time]})
-    future['Weekday'] = future['ds'].dt.dayofweek
-    forecast = model.predict(future)
-    predicted_demand = forecast['yhat'].values[0]
-    return int(round(predicted_demand))
+
+# Shared forecasting helpers live in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
 
 # Top Navigation Bar using columns
 # st.title("📈 VGI-FLEXI in Rural Areas")
@@ -36,12 +14,23 @@ def predict_demand(model, forecast_time):
 page = st.radio("", ["Home", "Products", "About Us"], horizontal=True)
 st.write(page)
 
-if page == "Home":
-    streamlit_home.run()
-if page == "Products":
-    streamlit_products.run()
-if page == "About Us":
-    streamlit_about.run()
+from instrumentation import profiled, span, start_exporters
+
+start_exporters()
+
+# Pages are imported when they are opened, so their dependencies are only loaded when needed
+# Each page run is timed, and profiled into PROFILE_DIR when that is set
+page_name = "page_" + page.lower().replace(" ", "_")
+with profiled(page_name), span(page_name):
+    if page == "Home":
+        import streamlit_home
+        streamlit_home.run()
+    if page == "Products":
+        import streamlit_products
+        streamlit_products.run()
+    if page == "About Us":
+        import streamlit_about
+        streamlit_about.run()
 
 # col1, col2, col3 = st.columns(3)
 # with col1:
@@ -1,7 +1,7 @@
 import streamlit as st 
-from streamlitV1 import load_all_models, predict_demand
 from datetime import datetime
 import pandas as pd
+from engine_client import forecast
 
 def run():
     st.title("Products")
@@ -20,11 +20,6 @@ def run():
         # List of Pickup IDs (replace with actual Pickup IDs)
         pickup_ids = [0, 8, 19, 30, 31]
 
-        # Load all models
-        with st.spinner('Loading models...'):
-            models = load_all_models(pickup_ids)
-        st.success("Models loaded.")
-
         # User input: Select Pickup ID
         pickup_id = st.selectbox("Select Pickup ID", pickup_ids)
 
@@ -37,9 +32,11 @@ def run():
 
         # Make prediction
         if st.button("Get Prediction"):
-            if pickup_id in models:
-                model = models[pickup_id]
-                demand = predict_demand(model, forecast_datetime)
+            # The engine serves precomputed forecasts and only falls back to live models outside the table horizon
+            with st.spinner('Forecasting...'):
+                result = forecast(forecast_date, forecast_hour)
+            if pickup_id in result["demand"]:
+                demand = result["demand"][pickup_id]
                 st.success(f"Predicted demand for Pickup ID {pickup_id} at {forecast_datetime.strftime('%Y-%m-%d %H:%M')} is {demand} bookings.")
             else:
-                st.error(f"Model for Pickup ID {pickup_id} is not available.")
\ No newline at end of file
+                st.error(f"Model for Pickup ID {pickup_id} is not available.")